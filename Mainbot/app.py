@@ -3,12 +3,33 @@ singapore nutrition chatbot - flask backend
 personalized nutrition assistant with singapore food database
 """
 
-from flask import Flask, request, jsonify, send_from_directory, session
+from flask import Flask, Response, request, jsonify, session, stream_with_context
 import requests
+import asyncio
 import json
 import os
-from datetime import datetime
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import secrets
+from knowledge_store import KnowledgeStore
+from food_search import FoodIndex
+from myth_matcher import MythMatcher
+from usda_cache import USDACache, normalize_query
+from usda_client import AsyncUSDAClient, USDAClient, CircuitOpenError, OverloadedError
+from fdc_index import FDCIndex
+from history_writer import HistoryWriter, TextLog
+from history_store import HistoryStore, parse_time
+from session_store import UserSession, create_session_store
+from intent_router import IntentRouter, normalize
+from response_templates import ResponseTemplates, swap_lines
+from swap_index import SwapIndex
+from nutrient_table import NutrientTable, CONDITION_WORDS, NUTRIENT_WORDS, amount, parse_food_query
+from meal import meal_totals, split_dishes
+from static_assets import StaticAssets
+from rate_limit import create_rate_limiter
+import metrics
 
 app = Flask(__name__)
 app.secret_key = secrets.token_hex(16)  # session security
@@ -22,8 +43,10 @@ def after_request(response):
     return response
 
 # load config from json
+CONFIG_PATH = 'config.json'
+
 def load_config():
-    with open('config.json', 'r', encoding='utf-8') as f:
+    with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
         return json.load(f)
 
 config = load_config()
@@ -32,420 +55,903 @@ config = load_config()
 USDA_KEY = config['api']['usda_key']
 USDA_URL = config['api']['usda_url']
 
+# token buckets per user and per ip, and a cap on usda calls in flight
+# (memory is per worker process, sqlite is shared by all of them)
+RATE_LIMIT_SETTINGS = config.get('rate_limit', {})
+CLIENT_SETTINGS = config.get('usda_client', {})
+rate_limiter = create_rate_limiter(
+    RATE_LIMIT_SETTINGS,
+    # a lease outlives the longest call it can be held for, then a crashed worker's slot frees itself
+    lease_ttl=CLIENT_SETTINGS.get('timeout', 2.5) + CLIENT_SETTINGS.get('connect_timeout', 1.0) + 5
+)
+
+# pooled usda client with a short deadline and a circuit breaker
+usda_client = USDAClient(
+    USDA_URL,
+    USDA_KEY,
+    timeout=CLIENT_SETTINGS.get('timeout', 2.5),
+    connect_timeout=CLIENT_SETTINGS.get('connect_timeout', 1.0),
+    pool_size=CLIENT_SETTINGS.get('pool_size', 10),
+    failure_threshold=CLIENT_SETTINGS.get('failure_threshold', 5),
+    reset_timeout=CLIENT_SETTINGS.get('reset_timeout', 30),
+    gate=rate_limiter.gate if rate_limiter.enabled else None
+)
+
+# same client for asyncio callers (asgi.py), lookups waiting on usda hold no thread
+usda_async = AsyncUSDAClient(usda_client, max_in_flight=CLIENT_SETTINGS.get('max_in_flight', 200))
+
+# cache usda answers in memory and on disk, shared by all workers
+CACHE_SETTINGS = config.get('usda_cache', {})
+usda_cache = USDACache(
+    memory_size=CACHE_SETTINGS.get('memory_size', 1024),
+    ttl=CACHE_SETTINGS.get('ttl', 7 * 24 * 3600),
+    negative_ttl=CACHE_SETTINGS.get('negative_ttl', 3600),
+    db_path=CACHE_SETTINGS.get('db_path'),
+    max_rows=CACHE_SETTINGS.get('max_rows', 100000)
+)
+
+# offline copy of fooddata central (python fdc_index.py import ...), searched before the api
+INDEX_SETTINGS = config.get('usda_index', {})
+fdc_index = FDCIndex(
+    INDEX_SETTINGS.get('path', 'fdc_index.sqlite3'),
+    memory_size=INDEX_SETTINGS.get('memory_size', 1024),
+    mmap_size=INDEX_SETTINGS.get('mmap_size', 256 * 1024 * 1024)
+)
+# foods missing from the index go to the live api only if this is on
+USDA_LIVE_FALLBACK = INDEX_SETTINGS.get('live_fallback', True)
+
 # file paths
 FILES = config['files']
-HPB_GUIDELINES = config['hpb_guidelines']
-
-# store user data in memory (in-memory for simplicity)
-user_data = {}
-
-# helper function to safely update user count
-def update_user_count(user_id, count):
-    """safely update conversation count"""
-    if user_id not in user_data:
-        user_data[user_id] = {'name': '', 'count': 0, 'awaiting_name': False}
-    user_data[user_id]['count'] = count
-
-# save to file
-def save_to_file(data, filename):
-    """save data as json line to text file"""
-    with open(filename, 'a', encoding='utf-8') as f:
-        f.write(json.dumps(data, ensure_ascii=False) + '\n')
-
-# read from file
-def read_from_file(filename):
-    """read json lines from text file, skip comments and handle errors"""
-    try:
-        # make file if not there
-        if not os.path.exists(filename):
-            return []
-        
-        with open(filename, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            data = []
-            
-            for line_num, line in enumerate(lines, 1):
-                line = line.strip()
-                
-                # skip empty lines and comment lines (starting with #)
-                if not line or line.startswith('#'):
-                    continue
-                
-                try:
-                    # try to parse as json
-                    item = json.loads(line)
-                    data.append(item)
-                except json.JSONDecodeError as e:
-                    # print warning but continue
-                    print(f"warning: line {line_num} in {filename} has invalid json - skipping")
-                    continue
-            
-            return data
-    except FileNotFoundError:
-        return []
-    except Exception as e:
-        print(f"error reading file {filename}: {e}")
-        return []
+
+# page, css and js from memory, precompressed, with hash etags and versioned links
+STATIC_SETTINGS = config.get('static', {})
+static_assets = StaticAssets(
+    app.root_path,
+    pages=['frontend.html'],
+    assets=['style.css', 'script.js'],
+    max_age=STATIC_SETTINGS.get('max_age', 365 * 24 * 3600),
+    check_interval=STATIC_SETTINGS.get('check_interval', 2)
+)
+
+# parsed data files and config, loaded once and reloaded in the background when edited
+# (hpb guidelines come from the reloaded config, other settings are read at startup)
+store = KnowledgeStore(
+    FILES,
+    reload_interval=config.get('knowledge_store', {}).get('reload_interval', 2),
+    config_path=CONFIG_PATH
+)
+SEARCH_SETTINGS = config.get('food_search', {})
+store.register('food_index', lambda snap: FoodIndex(
+    snap.foods.values(),
+    min_score=SEARCH_SETTINGS.get('min_score', 0.6),
+    min_similarity=SEARCH_SETTINGS.get('min_similarity', 0.75)
+))
+store.register('myth_matcher', lambda snap: MythMatcher(snap.myths))
+store.register('nutrient_table', lambda snap: NutrientTable(snap.foods.values()))
+store.register('swap_index', lambda snap: SwapIndex(
+    snap.swaps,
+    snap.foods.values(),
+    dish_limits=snap.config['hpb_guidelines'].get('dish_limits')
+))
+store.register('templates', ResponseTemplates)
+store.reload(force=True)
+# the file watcher is a thread, started per process by start_worker - not here, where
+# serve.py and gunicorn import the app in the master before forking
+
+# chat history is written in batches by a background thread
+HISTORY_SETTINGS = config.get('chat_history', {})
+history_sinks = [TextLog(
+    FILES['chat_history'],
+    rotate=HISTORY_SETTINGS.get('rotate', 'size'),
+    max_bytes=HISTORY_SETTINGS.get('max_bytes', 10 * 1024 * 1024),
+    backup_count=HISTORY_SETTINGS.get('backup_count', 10),
+    compress=HISTORY_SETTINGS.get('compress', True)
+)]
+
+# structured copy for audits and slow/unanswered query analysis
+STORE_SETTINGS = config.get('history_store', {})
+history_store = None
+if STORE_SETTINGS.get('enabled', True):
+    history_store = HistoryStore(STORE_SETTINGS.get('db_path', 'chat_history.sqlite3'))
+    history_sinks.append(history_store)
+
+history_writer = HistoryWriter(
+    history_sinks,
+    max_queue=HISTORY_SETTINGS.get('max_queue', 10000),
+    batch_size=HISTORY_SETTINGS.get('batch_size', 100),
+    flush_interval=HISTORY_SETTINGS.get('flush_interval', 1.0),
+    overflow=HISTORY_SETTINGS.get('overflow', 'drop'),
+    block_timeout=HISTORY_SETTINGS.get('block_timeout', 0.5)
+)
+
+# bulk chat endpoint limits
+BATCH_SETTINGS = config.get('batch', {})
+
+# per-user state, bounded and expiring (memory) or shared by all workers (sqlite)
+sessions = create_session_store(config.get('sessions', {}))
+
+# hot path instrumentation, scraped from /metrics
+STAGE_SECONDS = metrics.histogram('chatbot_stage_seconds', 'time spent in each chat pipeline stage', ['stage'])
+CHAT_SECONDS = metrics.histogram('chatbot_chat_seconds', 'time to answer a message, by intent', ['intent'])
+FOOD_LOOKUPS = metrics.counter('chatbot_food_lookups_total', 'nutrition answers by where the food came from',
+                               ['result'])
+FDC_INDEX = metrics.counter('chatbot_fdc_index_total', 'offline fdc index lookups', ['result'])
+STATIC_RESPONSES = metrics.counter('chatbot_static_responses_total', 'page/css/js responses by encoding',
+                                   ['encoding'])
+USDA_CACHE = metrics.counter('chatbot_usda_cache_total', 'usda cache lookups', ['result'])
+USDA_REQUESTS = metrics.counter('chatbot_usda_requests_total', 'usda lookups past the cache, by outcome',
+                                ['outcome'])
+RATE_LIMITED = metrics.counter('chatbot_rate_limited_total', 'requests refused with a 429, by the bucket that ran dry',
+                               ['scope'])
+metrics.gauge('chatbot_sessions', 'users with a live session', lambda: len(sessions))
+metrics.gauge('chatbot_sessions_memory_bytes', 'approximate size of the in-memory sessions',
+              lambda: sessions.memory_bytes() if hasattr(sessions, 'memory_bytes') else None)
+metrics.gauge('chatbot_history_queued', 'chat records waiting for the history writer',
+              lambda: history_writer.stats()['queued'])
+metrics.gauge('chatbot_history_dropped', 'chat records dropped because the queue was full',
+              lambda: history_writer.dropped)
+metrics.gauge('chatbot_data_version', 'data files version, +1 on every reload', lambda: store.snapshot.version)
+metrics.gauge('chatbot_usda_circuit_open', '1 while usda calls are short-circuited',
+              lambda: int(usda_client.breaker.state != 'closed'))
+metrics.gauge('chatbot_usda_in_flight', 'usda lookups on the wire',
+              lambda: usda_client.stats()['in_flight'] + usda_async.stats()['in_flight'])
+metrics.gauge('chatbot_usda_permits_in_use', 'usda call slots taken (all workers with the sqlite backend)',
+              lambda: rate_limiter.gate.in_use() if rate_limiter.enabled else None)
+
+# cProfile for a fraction of /chat requests, switched at runtime through /admin/profiler
+profiler = metrics.RequestProfiler(config.get('metrics', {}).get('profile_rate', 0.0))
+
+# background threads don't survive a fork, so every worker process starts its own
+def start_worker():
+    """start the data file watcher and history writer in this process, and the usda
+    part of the warm-up if it is on"""
+    store.start()
+    history_writer.start()
+    if WARM_UP_SETTINGS.get('enabled', True) and WARM_UP_SETTINGS.get('usda', False):
+        # the worker serves while the popular foods still missing are fetched
+        threading.Thread(target=run_warm_up, args=(True,), name='warm-up', daemon=True).start()
+
+def stop_worker(flush_timeout=5.0):
+    """flush queued chat history and stop background threads, eg on worker exit"""
+    history_writer.close(flush_timeout)
+    store.stop()
 
 # load singapore foods from text file
 def load_sg_foods():
     """load local food database"""
-    foods = {}
-    data = read_from_file(FILES['sg_foods'])
-    for item in data:
-        # store with lowercase key for case-insensitive matching
-        foods[item['name'].lower()] = item
-    return foods
+    return store.snapshot.foods
+
+# hpb guidelines from the current config.json
+def hpb_guidelines():
+    """health promotion board targets, follows config.json edits"""
+    return store.snapshot.config['hpb_guidelines']
+
+# static answers, rebuilt when data files or config change
+def templates():
+    """pre-rendered guideline and swap responses for the current data version"""
+    return store.snapshot.derived['templates']
 
 # search local food database
 def search_local_food(query):
-    """search for food in local database"""
-    foods = load_sg_foods()
-    query = query.lower()
+    """search for food in local database, best scoring name or alias wins"""
+    with STAGE_SECONDS.time(stage='local_search'):
+        return store.snapshot.derived['food_index'].best(query)
+
+# ranked candidates from local database
+def search_local_foods(query, k=5):
+    """top k (score, food) matches for the query"""
+    return store.snapshot.derived['food_index'].search(query, k)
+
+# offline usda index, microseconds instead of a round trip
+def search_fdc_index(query):
+    """food from the imported fooddata central index, None if not there (or no index)"""
+    if not fdc_index.available():
+        return None
+    with STAGE_SECONDS.time(stage='fdc_index'):
+        food = fdc_index.search(query)
+    FDC_INDEX.inc(result='hit' if food else 'miss')
+    return food
+
+# search usda through the cache with better error handling
+def search_usda(query):
+    """search usda fooddata central - offline index, then cached api answers, then the api"""
+    food = search_fdc_index(query)
+    if food or not USDA_LIVE_FALLBACK:
+        return food
     
-    # direct match first
-    if query in foods:
-        return foods[query]
+    found, food = usda_cache.get(query)
+    USDA_CACHE.inc(result='hit' if found else 'miss')
+    if found:
+        return food
     
-    # partial match
-    for name, info in foods.items():
-        if query in name or name in query:
-            return info
+    started = time.perf_counter()
+    try:
+        food = usda_client.search(query)
+    except CircuitOpenError:
+        # usda keeps failing, answer from local data straight away
+        USDA_REQUESTS.inc(outcome='circuit_open')
+        return None
+    except OverloadedError:
+        # enough calls on the wire already, answer from local data instead of queueing
+        USDA_REQUESTS.inc(outcome='shed')
+        return None
+    except requests.Timeout as e:
+        USDA_REQUESTS.inc(outcome='timeout')
+        print(f"api request error: {e}")
+        return None
+    except requests.RequestException as e:
+        USDA_REQUESTS.inc(outcome='error')
+        print(f"api request error: {e}")
+        return None
+    except Exception as e:
+        USDA_REQUESTS.inc(outcome='error')
+        print(f"unexpected api error: {e}")
+        return None
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage='usda')
     
-    return None
+    USDA_REQUESTS.inc(outcome='found' if food else 'not_found')
+    # "not found" is cached too, errors are not
+    usda_cache.set(query, food)
+    return food
 
-# call usda api with better error handling
-def search_usda(query):
-    """search usda fooddata central api"""
+# anything that can wait on a sqlite lock (sessions, the usda cache's disk tier, sqlite rate
+# limits) runs in a thread for asyncio callers, so one locked file doesn't stall every stream
+async def off_loop(blocking, fn, *args):
+    """fn(*args), in a thread if blocking"""
+    if not blocking:
+        return fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+async def search_usda_async(query):
+    """search_usda for asyncio callers"""
+    food = search_fdc_index(query)
+    if food or not USDA_LIVE_FALLBACK:
+        return food
+    
+    found, food = await off_loop(usda_cache.disk is not None, usda_cache.get, query)
+    USDA_CACHE.inc(result='hit' if found else 'miss')
+    if found:
+        return food
+    
+    started = time.perf_counter()
     try:
-        params = {
-            "api_key": USDA_KEY,
-            "query": query,
-            "pageSize": 1
-        }
-        
-        response = requests.get(USDA_URL, params=params, timeout=10)
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('foods') and len(data['foods']) > 0:
-                food = data['foods'][0]
-                
-                # extract nutrients
-                nutrients = {}
-                for n in food.get('foodNutrients', []):
-                    name = n.get('nutrientName', '').lower()
-                    value = n.get('value', 0)
-                    
-                    if 'energy' in name or 'calorie' in name:
-                        nutrients['calories'] = value
-                    elif 'protein' in name:
-                        nutrients['protein'] = value
-                    elif 'carbohydrate' in name:
-                        nutrients['carbs'] = value
-                    elif 'total lipid' in name or ('fat' in name and 'fatty' not in name):
-                        nutrients['fat'] = value
-                    elif 'sodium' in name:
-                        nutrients['sodium'] = value
-                    elif 'fiber' in name:
-                        nutrients['fiber'] = value
-                    elif 'sugar' in name and 'added' not in name:
-                        nutrients['sugar'] = value
-                
-                return {
-                    'name': food.get('description'),
-                    **nutrients,
-                    'source': 'USDA'
-                }
-        
+        food = await usda_async.search(query)
+    except CircuitOpenError:
+        USDA_REQUESTS.inc(outcome='circuit_open')
+        return None
+    except OverloadedError:
+        USDA_REQUESTS.inc(outcome='shed')
+        return None
+    except requests.Timeout as e:
+        USDA_REQUESTS.inc(outcome='timeout')
+        print(f"api request error: {e}")
         return None
     except requests.RequestException as e:
+        USDA_REQUESTS.inc(outcome='error')
         print(f"api request error: {e}")
         return None
     except Exception as e:
+        USDA_REQUESTS.inc(outcome='error')
         print(f"unexpected api error: {e}")
         return None
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage='usda')
+    
+    USDA_REQUESTS.inc(outcome='found' if food else 'not_found')
+    await off_loop(usda_cache.disk is not None, usda_cache.set, query, food)
+    return food
+
+# local database first, then usda
+def find_food(query):
+    """food for a nutrition question, or None"""
+    # search local first
+    food = search_local_food(query)
+    
+    # try api if not found locally
+    if not food:
+        food = search_usda(query)
+    return food
+
+# offline index and cached usda answers only, never the network
+def search_usda_cached(query):
+    """search_usda without the api call"""
+    food = search_fdc_index(query)
+    if food:
+        return food
+    found, food = usda_cache.get(query)
+    USDA_CACHE.inc(result='hit' if found else 'miss')
+    return food
+
+# local database, then the offline index - no network
+def search_offline_food(query):
+    """food from local data or the imported fdc index, or None"""
+    return search_local_food(query) or search_fdc_index(query)
+
+# resolve many food queries at once
+def prefetch_foods(queries, max_workers=8, lookup=search_usda):
+    """{normalized query: food} - each distinct query looked up once, usda misses in parallel"""
+    unique = {}
+    for query in queries:
+        unique.setdefault(normalize_query(query), query)
+    
+    results = {}
+    misses = []
+    for key, query in unique.items():
+        food = search_local_food(query)
+        if food:
+            results[key] = food
+        else:
+            misses.append(key)
+    
+    if misses:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(misses)))) as pool:
+            for key, food in zip(misses, pool.map(lookup, [unique[k] for k in misses])):
+                results[key] = food
+    return results
+
+# the foods people asked about most lately, resolved before the first request asks again
+def warm_up(days=7, top_foods=50, usda=True, max_workers=8):
+    """pre-resolve the most requested foods in recent chat history - fills the local search
+    and offline index memos and the usda cache's memory copy (and the cache itself, if usda is
+    on and some are missing), returns what it did"""
+    if history_store is None or top_foods <= 0:
+        return {}
+    started = time.perf_counter()
+    counts = Counter()
+    since = time.time() - days * 24 * 3600
+    for message, intent, n in history_store.top_messages(since=since, limit=top_foods * 4):
+        # meals were looked up dish by dish, single foods by the whole message
+        queries = [item.query for item in split_dishes(message, resolve=search_offline_food)] if intent == 'meal' else [message]
+        for query in queries:
+            counts[normalize_query(query)] += n
+    queries = [query for query, _ in counts.most_common(top_foods)]
+    foods = prefetch_foods(queries, max_workers, search_usda if usda else search_usda_cached)
+    result = {
+        'queries': len(queries),
+        'found': sum(1 for food in foods.values() if food),
+        'seconds': round(time.perf_counter() - started, 3)
+    }
+    print(f"warm-up: {result['found']} of {result['queries']} popular foods resolved in {result['seconds']}s")
+    return result
 
 # load myths from text file
 def load_myths():
     """load diet myths database"""
-    return read_from_file(FILES['myths'])
+    return store.snapshot.myths
 
 # check if message contains a myth
 def check_myth(message):
-    """check if user message relates to a diet myth"""
-    myths = load_myths()
-    msg = message.lower()
-    
-    for myth in myths:
-        for keyword in myth.get('keywords', []):
-            if keyword.lower() in msg:
-                return myth
-    return None
+    """check if user message relates to a diet myth, most specific keyword wins"""
+    return store.snapshot.derived['myth_matcher'].best(message)
 
 # load healthy swaps from text file
 def load_swaps():
     """load healthy food swaps database"""
-    return read_from_file(FILES['swaps'])
+    return store.snapshot.swaps
+
+# swaps by condition and by food, rebuilt when the data files change
+def swap_index():
+    """swap index for the current data version"""
+    return store.snapshot.derived['swap_index']
 
 # get swaps based on condition
 def get_swaps(condition=None, limit=None):
     """get food swaps, optionally filtered by health condition"""
-    all_swaps = load_swaps()
-    
     if condition:
-        filtered = [s for s in all_swaps if s.get('category') == condition]
-    else:
-        filtered = all_swaps
-    
-    if limit:
-        return filtered[:limit]
-    return filtered
+        return swap_index().for_condition(condition, limit)
+    all_swaps = load_swaps()
+    return all_swaps[:limit] if limit else all_swaps
 
-# save chat to history in readable text format
-def save_chat_history(user_message, bot_response):
-    """save conversation to history in readable text format"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    with open(FILES['chat_history'], 'a', encoding='utf-8') as f:
-        f.write(f"\n{'='*60}\n")
-        f.write(f"[{timestamp}]\n")
-        f.write(f"User: {user_message}\n")
-        f.write(f"Bot: {bot_response}\n")
+# save chat to history (readable text log + structured store)
+def save_chat_history(user_message, bot_response, user_id=None, meta=None, latency_ms=None):
+    """queue conversation for the background history writer, no disk i/o here"""
+    meta = meta or {}
+    # every answered message passes through here, whichever endpoint answered it
+    if latency_ms is not None:
+        CHAT_SECONDS.observe(latency_ms / 1000, intent=meta.get('intent') or 'unknown')
+    started = time.perf_counter()
+    history_writer.write({
+        'ts': time.time(),
+        'user_id': user_id,
+        'intent': meta.get('intent'),
+        'matched': meta.get('matched'),
+        'message': user_message,
+        'response': bot_response,
+        'latency_ms': latency_ms
+    })
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage='history_enqueue')
+
+# intents, compiled once into a single keyword table
+GREETINGS = ['hi', 'hello', 'hey', 'yo', 'sup', 'greetings', 'good morning', 'good afternoon', 'good evening']
+NAME_BLOCKERS = {'nutrition', 'calories', 'healthy', 'food', 'eat', 'diet', 'diabetes', 'pressure', 'cholesterol'}
+
+router = IntentRouter(fallback='help')
+router.register('greeting', 0, openers=GREETINGS)
+router.register('name', 1, when=lambda ctx: ctx.session.awaiting_name)
+router.register('myth', 2)
+# "low sodium dishes under 500 kcal" - only if the message parses into a filter or ranking
+router.register('recommend', 3,
+                keywords=['recommend', 'recommendation', 'recommendations', 'suggest', 'suggestion',
+                          'suggestions', 'dishes', 'foods', 'options', 'meals', 'highest', 'lowest',
+                          'under', 'below'],
+                phrases=[f"{level} {word}" for level in ('low', 'high', 'less', 'more', 'most', 'least')
+                         for word in NUTRIENT_WORDS],
+                when=lambda ctx: ctx.route.entities.get('food_query') is not None)
+# "chicken rice, teh tarik and kaya toast" - nutrition for two or more dishes at once
+router.register('meal', 4, keywords=['meal', 'ate', 'had', 'total', 'altogether', 'combined'],
+                when=lambda ctx: len(ctx.route.entities.get('dishes', ())) > 1)
+router.register('nutrition', 5,
+                keywords=['nutrition', 'nutritional', 'nutrient', 'nutrients', 'calories', 'calorie',
+                          'kcal', 'info', 'information'],
+                phrases=['how many'],
+                weak=['healthy'])
+router.register('diabetes', 6, keywords=['diabetes', 'diabetic'])
+router.register('blood_pressure', 7, keywords=['hypertension', 'bp'], phrases=['blood pressure'])
+router.register('cholesterol', 8, keywords=['cholesterol', 'ldl'])
+router.register('swaps', 9, keywords=['swap', 'swaps', 'alternative', 'alternatives', 'replace', 'substitute'])
+router.register('thanks', 10, keywords=['thank', 'thanks', 'thankyou', 'thx'])
+router.register('help', 11, keywords=['help'])
+
+@router.extractor
+def extract_myth(msg, entities, intents):
+    """myth keywords, all found in one pass of the myth automaton"""
+    myth = store.snapshot.derived['myth_matcher'].best(msg.text)
+    if myth:
+        entities['myth'] = myth
+        intents.add('myth')
+
+@router.extractor
+def extract_food_query(msg, entities, intents):
+    """filters and ranking for dish recommendations, limits from the hpb guidelines"""
+    if 'recommend' in intents:
+        guide = hpb_guidelines()
+        entities['food_query'] = parse_food_query(msg.tokens, guide.get('dish_limits', {}),
+                                                  guide.get('dish_targets', {}))
+
+@router.extractor
+def extract_dishes(msg, entities, intents):
+    """every dish named in a nutrition question, two or more make it a meal"""
+    if 'nutrition' in intents or 'meal' in intents:
+        dishes = split_dishes(msg.text, resolve=search_offline_food)
+        if len(dishes) > 1:
+            entities['dishes'] = dishes
+            intents.add('meal')
+
+@router.extractor
+def extract_possible_name(msg, entities, intents):
+    """short message without food words might be the user's name"""
+    if msg.tokens and len(msg.tokens) <= 3 and not NAME_BLOCKERS.intersection(msg.tokens):
+        entities['possible_name'] = True
+        intents.add('name')
 
 # check if asking for name
 def is_asking_name(message):
     """check if user is providing their name"""
-    greetings = ['hi', 'hello', 'hey', 'yo', 'sup', 'greetings', 'good morning', 'good afternoon', 'good evening']
-    msg = message.lower().strip()
-    
-    # check for direct greetings
-    for greeting in greetings:
-        if msg == greeting or msg.startswith(greeting + ' '):
-            return 'greeting'
-    
-    # check if looks like a name (short, no special keywords)
-    food_keywords = ['nutrition', 'calories', 'healthy', 'food', 'eat', 'diet', 'diabetes', 'pressure', 'cholesterol']
-    if len(msg.split()) <= 3 and not any(kw in msg for kw in food_keywords):
+    route = router.classify(message)
+    if 'greeting' in route.intents:
+        return 'greeting'
+    if route.entities.get('possible_name'):
         return 'possible_name'
-    
     return None
 
+class ChatContext:
+    """everything a handler needs about the current message and user"""
+    
+    __slots__ = ('msg', 'route', 'user_id', 'session', 'user_name', 'count', 'name_prefix', 'meta',
+                 'lookup_food')
+    
+    def __init__(self, msg, route, user_id, session, meta, lookup_food=None):
+        self.msg = msg
+        self.route = route
+        self.user_id = user_id
+        self.session = session
+        self.user_name = session.name
+        self.count = session.count
+        # add personalization prefix if we know the name
+        self.name_prefix = f"{session.name}, " if session.name and session.count > 2 else ""
+        self.meta = meta
+        self.lookup_food = lookup_food or find_food
+
 # main chat processing function with personalization
-def process_chat(message, user_id):
-    """process user message and return response with personalization"""
+def process_chat(message, user_id, meta=None, lookup_food=None, route=None):
+    """process user message and return response with personalization
+    meta (if given) is filled with the detected intent and matched food/myth,
+    lookup_food (if given) replaces find_food, eg with results prefetched for a batch,
+    route (if given) is the message already classified"""
+    return ''.join(start_chat(message, user_id, meta, lookup_food, route))
+
+def start_chat(message, user_id, meta=None, lookup_food=None, route=None):
+    """classify and dispatch a message, returns its response as an iterator of parts
+    handlers may be generators - their slow parts (usda lookups) only run while the
+    parts are consumed, so they must not change the session"""
+    return finish_chat(open_chat(message, user_id, meta, lookup_food, route=route))
+
+def open_chat(message, user_id, meta=None, lookup_food=None, session=None, route=None):
+    """ChatContext for a message - normalized, classified, with the user's session
+    (the session and route are loaded here unless the caller already has them)"""
+    if meta is None:
+        meta = {}
+    meta['matched'] = None
+    
+    # normalize and classify once
+    with STAGE_SECONDS.time(stage='classify'):
+        msg = normalize(message)
+        if route is None:
+            route = router.classify(msg)
+    
+    # get user data and increment conversation count
+    if session is None:
+        with STAGE_SECONDS.time(stage='session_load'):
+            session = sessions.get(user_id) or UserSession()
+    session.count += 1
+    
+    return ChatContext(msg, route, user_id, session, meta, lookup_food)
+
+def finish_chat(ctx, save=True):
+    """dispatch to the intent handler and save the session, returns the response parts"""
+    with STAGE_SECONDS.time(stage='dispatch'):
+        response = router.dispatch(ctx.route, ctx)
+    
+    if save:
+        with STAGE_SECONDS.time(stage='session_save'):
+            sessions.put(ctx.user_id, ctx.session)
+    return (response,) if isinstance(response, str) else response
+
+# asyncio version - usda lookups are awaited, everything else runs as usual
+async def process_chat_async(message, user_id, meta=None):
+    """same as process_chat, without holding a thread while usda answers"""
+    ctx = await open_chat_async(message, user_id, meta)
+    return ''.join([part async for part in stream_chat_async(ctx)])
+
+async def open_chat_async(message, user_id, meta=None):
+    """open_chat for asyncio callers"""
+    with STAGE_SECONDS.time(stage='session_load'):
+        session = await off_loop(sessions.backend != 'memory', sessions.get, user_id)
+    return open_chat(message, user_id, meta, session=session or UserSession())
+
+async def save_session_async(ctx):
+    with STAGE_SECONDS.time(stage='session_save'):
+        await off_loop(sessions.backend != 'memory', sessions.put, ctx.user_id, ctx.session)
+
+async def stream_chat_async(ctx):
+    """finish_chat for asyncio callers, as an async iterator of parts - a meal's local
+    dishes go out straight away and each usda dish as soon as its lookup returns"""
+    if router.resolve(ctx.route, ctx) != 'meal':
+        await prefetch_usda_async(ctx)
+        parts = finish_chat(ctx, save=False)
+        await save_session_async(ctx)
+        for part in parts:
+            yield part
+        return
     
-    # get user data
-    user_info = user_data.get(user_id, {})
-    user_name = user_info.get('name', '')
-    conversation_count = user_info.get('count', 0)
+    ctx.meta['intent'] = 'meal'
+    await save_session_async(ctx)
     
-    # increment conversation count
-    conversation_count += 1
+    parts, found, pending = meal_start(ctx)
+    for part in parts:
+        yield part
     
-    # check if greeting or name
-    name_check = is_asking_name(message)
+    async def lookup(item):
+        return item, await search_usda_async(item.query)
     
-    if name_check == 'greeting' and not user_name:
+    missing = []
+    for arrival in asyncio.as_completed([lookup(item) for item in pending]):
+        item, food = await arrival
+        line = meal_arrived(item, food, found, missing)
+        if line:
+            yield line
+    
+    for part in meal_end(ctx, found, missing):
+        yield part
+
+async def prefetch_usda_async(ctx):
+    """if this message will need usda, look it up now so the handler finds it ready"""
+    if router.resolve(ctx.route, ctx) != 'nutrition':
+        return
+    query = ctx.msg.raw
+    if search_local_food(query):
+        return
+    food = await search_usda_async(query)
+    
+    def lookup_food(lookup_query):
+        return food if normalize_query(lookup_query) == normalize_query(query) else find_food(lookup_query)
+    ctx.lookup_food = lookup_food
+
+@router.handler('greeting')
+def handle_greeting(ctx):
+    if not ctx.user_name:
         # first time greeting - ask for name
         response = "Hello there! Welcome to Singapore Nutrition Assistant!\n\n"
         response += "I'm here to help you with nutrition info about local Singaporean foods.\n\n"
         response += "What's your name? I'd love to know who I'm chatting with!"
         
         # store temporary state
-        user_data[user_id] = {
-            'name': '',
-            'count': conversation_count,
-            'awaiting_name': True
-        }
-        
+        ctx.session.awaiting_name = True
         return response
     
-    elif user_info.get('awaiting_name') and name_check == 'possible_name':
-        # user provided their name
-        name = message.strip().title()
-        user_data[user_id] = {
-            'name': name,
-            'count': conversation_count,
-            'awaiting_name': False
-        }
-        
-        response = f"Nice to meet you, {name}!\n\n"
-        response += "I can help you with:\n\n"
-        response += "1. Nutrition info for local dishes (try: 'chicken rice nutrition')\n"
-        response += "2. Bust diet myths (try: 'are carbs bad?')\n"
-        response += "3. Health tips for diabetes, blood pressure, cholesterol\n"
-        response += "4. Healthy food swaps\n\n"
-        response += "What would you like to know?"
-        
-        return response
+    # returning user greeting
+    greetings_list = [
+        f"Hey {ctx.user_name}! Good to see you again!",
+        f"Welcome back, {ctx.user_name}!",
+        f"Hi {ctx.user_name}! Ready for some nutrition talk?",
+        f"Hello {ctx.user_name}! What can I help you with today?"
+    ]
+    response = greetings_list[ctx.count % len(greetings_list)]
+    response += "\n\nWhat would you like to know about today?"
+    return response
+
+@router.handler('name')
+def handle_name(ctx):
+    # user provided their name
+    name = ctx.msg.raw.strip().title()
+    ctx.session.name = name
+    ctx.session.awaiting_name = False
     
-    elif name_check == 'greeting' and user_name:
-        # returning user greeting
-        greetings_list = [
-            f"Hey {user_name}! Good to see you again!",
-            f"Welcome back, {user_name}!",
-            f"Hi {user_name}! Ready for some nutrition talk?",
-            f"Hello {user_name}! What can I help you with today?"
-        ]
-        response = greetings_list[conversation_count % len(greetings_list)]
-        response += "\n\nWhat would you like to know about today?"
-        
-        update_user_count(user_id, conversation_count)
-        return response
+    response = f"Nice to meet you, {name}!\n\n"
+    response += "I can help you with:\n\n"
+    response += "1. Nutrition info for local dishes (try: 'chicken rice nutrition')\n"
+    response += "2. Bust diet myths (try: 'are carbs bad?')\n"
+    response += "3. Health tips for diabetes, blood pressure, cholesterol\n"
+    response += "4. Healthy food swaps\n\n"
+    response += "What would you like to know?"
+    return response
+
+@router.handler('myth')
+def handle_myth(ctx):
+    myth = ctx.route.entities['myth']
+    ctx.meta['matched'] = myth['myth']
+    response = f"{ctx.name_prefix}great question! Let me bust that myth for you:\n\n"
+    response += f"MYTH: {myth['myth']}\n\n"
+    response += f"TRUTH: {myth['truth']}\n\n"
+    response += f"TIP: {myth['tip']}"
     
-    # add personalization prefix if we know the name
-    name_prefix = f"{user_name}, " if user_name and conversation_count > 2 else ""
+    if ctx.user_name:
+        response += f"\n\nAnything else you'd like to know, {ctx.user_name}?"
+    return response
+
+@router.handler('nutrition')
+def handle_nutrition(ctx):
+    # a generator, so /chat/stream can send each part as soon as it is known
+    if ctx.name_prefix:
+        yield ctx.name_prefix
     
-    # check for myths first
-    myth = check_myth(message)
-    if myth:
-        response = f"{name_prefix}great question! Let me bust that myth for you:\n\n"
-        response += f"MYTH: {myth['myth']}\n\n"
-        response += f"TRUTH: {myth['truth']}\n\n"
-        response += f"TIP: {myth['tip']}"
-        
-        if user_name:
-            response += f"\n\nAnything else you'd like to know, {user_name}?"
-        
-        update_user_count(user_id, conversation_count)
-        return response
+    food = ctx.lookup_food(ctx.msg.raw)
+    FOOD_LOOKUPS.inc(result=('usda' if food.get('source') == 'USDA' else 'local') if food else 'not_found')
     
-    # check for food nutrition queries
-    food_keywords = ['nutrition', 'calories', 'healthy', 'info', 'nutrient', 'nutritional', 'how many']
-    if any(word in message.lower() for word in food_keywords):
-        # search local first
-        food = search_local_food(message)
+    if food:
+        ctx.meta['matched'] = food.get('name')
+        response = f"here's the nutrition info for {food.get('name', 'this food')}:\n\n"
+        response += f"Calories: {food.get('calories', 'N/A')} kcal\n"
+        response += f"Protein: {food.get('protein', 'N/A')}g\n"
+        response += f"Carbs: {food.get('carbs', 'N/A')}g\n"
+        response += f"Fat: {food.get('fat', 'N/A')}g\n"
+        response += f"Sodium: {food.get('sodium', 'N/A')}mg\n"
+        response += f"Fiber: {food.get('fiber', 'N/A')}g\n"
+        response += f"Sugar: {food.get('sugar', 'N/A')}g\n"
+        yield response
         
-        # try api if not found locally
-        if not food:
-            food = search_usda(message)
+        # warnings based on hpb guidelines
+        guide = hpb_guidelines()
+        limits = guide.get('dish_limits', {})
+        if food.get('sodium', 0) > limits.get('sodium', 600):
+            yield f"\n\nWARNING: This is quite high in sodium! HPB recommends less than {guide['blood_pressure']['sodium_limit']}"
+        if food.get('sugar', 0) > limits.get('sugar', 10):
+            yield "\n\nWARNING: High sugar content - consume in moderation!"
         
-        if food:
-            response = f"{name_prefix}here's the nutrition info for {food.get('name', 'this food')}:\n\n"
-            response += f"Calories: {food.get('calories', 'N/A')} kcal\n"
-            response += f"Protein: {food.get('protein', 'N/A')}g\n"
-            response += f"Carbs: {food.get('carbs', 'N/A')}g\n"
-            response += f"Fat: {food.get('fat', 'N/A')}g\n"
-            response += f"Sodium: {food.get('sodium', 'N/A')}mg\n"
-            response += f"Fiber: {food.get('fiber', 'N/A')}g\n"
-            response += f"Sugar: {food.get('sugar', 'N/A')}g\n"
-            
-            # warnings based on hpb guidelines
-            if food.get('sodium', 0) > 600:
-                response += f"\n\nWARNING: This is quite high in sodium! HPB recommends less than {HPB_GUIDELINES['blood_pressure']['sodium_limit']}"
-            if food.get('sugar', 0) > 10:
-                response += "\n\nWARNING: High sugar content - consume in moderation!"
-            
-            if user_name:
-                response += f"\n\nWant to know about any other foods, {user_name}?"
-            
-            update_user_count(user_id, conversation_count)
-            return response
-        else:
-            response = f"{name_prefix}hmm, I couldn't find that food in my database.\n\n"
-            response += "Try asking about popular Singapore dishes like:\n"
-            response += "- Chicken rice\n- Nasi lemak\n- Laksa\n- Char kway teow\n- Yong tau foo"
-            
-            update_user_count(user_id, conversation_count)
-            return response
-    
-    # diabetes management
-    if 'diabetes' in message.lower():
-        response = f"{name_prefix}here are some diabetes management tips based on HPB guidelines:\n\n"
-        response += f"TARGETS:\n"
-        response += f"- Fasting glucose: {HPB_GUIDELINES['diabetes']['fasting_glucose_normal']}\n"
-        response += f"- Sugar limit: {HPB_GUIDELINES['diabetes']['sugar_limit']}\n"
-        response += f"- Daily fiber: {HPB_GUIDELINES['diabetes']['fiber_recommendation']}\n\n"
-        response += "GOOD CHOICES:\n"
-        response += "- Fish soup, yong tau foo (more veggies), economic rice\n\n"
-        response += "AVOID:\n"
-        response += "- Sugary drinks, fried noodles, white rice in large portions\n"
-        
-        # show relevant swaps
-        swaps = get_swaps('diabetes', limit=3)
+        # healthier options for this food from healthy_swaps.txt
+        swaps = swap_index().for_food(food, ctx.msg.raw)
         if swaps:
-            response += "\n\nHEALTHY SWAPS:\n"
-            for swap in swaps:
-                response += f"- {swap['unhealthy']} → {swap['healthy']}\n"
+            yield swap_lines(swaps)
         
-        if user_name:
-            response += f"\n\nNeed more specific advice, {user_name}?"
-        
-        update_user_count(user_id, conversation_count)
-        return response
+        if ctx.user_name:
+            yield f"\n\nWant to know about any other foods, {ctx.user_name}?"
+        return
     
-    # blood pressure management
-    if 'blood pressure' in message.lower() or 'hypertension' in message.lower() or 'bp' in message.lower():
-        response = f"{name_prefix}here's how to manage blood pressure with food:\n\n"
-        response += f"TARGET: {HPB_GUIDELINES['blood_pressure']['normal']}\n"
-        response += f"SODIUM LIMIT: {HPB_GUIDELINES['blood_pressure']['sodium_limit']}\n\n"
-        response += "TIPS:\n"
-        response += "- Ask for 'less salt' or 'no MSG' at hawker centers\n"
-        response += "- Avoid instant noodles and processed meats\n"
-        response += "- Choose steamed over fried options\n"
-        
-        # show relevant swaps
-        swaps = get_swaps('blood_pressure', limit=3)
-        if swaps:
-            response += "\n\nHEALTHY SWAPS:\n"
-            for swap in swaps:
-                response += f"- {swap['unhealthy']} → {swap['healthy']}\n"
-        
-        if user_name:
-            response += f"\n\nWant more BP-friendly food tips, {user_name}?"
-        
-        update_user_count(user_id, conversation_count)
-        return response
+    response = "hmm, I couldn't find that food in my database.\n\n"
+    response += "Try asking about popular Singapore dishes like:\n"
+    response += "- Chicken rice\n- Nasi lemak\n- Laksa\n- Char kway teow\n- Yong tau foo"
+    yield response
+
+# one line per dish of a meal
+def meal_line(item, food):
+    name = food.get('name', item.query)
+    if item.quantity != 1:
+        name = f"{item.quantity:g} x {name}"
+    # usda values stay per 100g, there is no plate to multiply
+    per_100g = food.get('source') == 'USDA'
+    if per_100g:
+        name += " (USDA, per 100g)"
+    facts = ', '.join(amount(column, round(food[column] * (1 if per_100g else item.quantity), 1))
+                      + ('' if column == 'calories' else f" {column}")
+                      for column in ('calories', 'protein', 'carbs', 'fat', 'sodium', 'fiber', 'sugar')
+                      if isinstance(food.get(column), (int, float)))
+    return f"- {name}: {facts}\n"
+
+def meal_start(ctx):
+    """opening parts of a meal answer with a line per local dish, the dishes found
+    so far and the ones still to look up"""
+    items = ctx.route.entities['dishes']
+    parts = [ctx.name_prefix] if ctx.name_prefix else []
+    parts.append(f"here's the breakdown for your meal of {len(items)} items:\n\n")
     
-    # cholesterol management
-    if 'cholesterol' in message.lower():
-        response = f"{name_prefix}let's talk about managing cholesterol:\n\n"
-        response += f"LDL TARGET: {HPB_GUIDELINES['cholesterol']['ldl_target']}\n\n"
-        response += "TIPS:\n"
-        response += "- Choose grilled/steamed over fried foods\n"
-        response += "- Use olive oil or canola oil for cooking\n"
-        response += "- Eat fatty fish (salmon, mackerel) 2x per week\n"
-        response += "- Limit coconut milk curries\n"
-        
-        # show relevant swaps
-        swaps = get_swaps('cholesterol', limit=3)
-        if swaps:
-            response += "\n\nHEALTHY SWAPS:\n"
-            for swap in swaps:
-                response += f"- {swap['unhealthy']} → {swap['healthy']}\n"
-        
-        if user_name:
-            response += f"\n\nAny other questions about cholesterol, {user_name}?"
-        
-        update_user_count(user_id, conversation_count)
-        return response
+    found = []
+    pending = []
+    for item in items:
+        food = search_local_food(item.query)
+        if food:
+            found.append((item, food))
+            FOOD_LOOKUPS.inc(result='local')
+            parts.append(meal_line(item, food))
+        else:
+            pending.append(item)
+    return parts, found, pending
+
+def meal_arrived(item, food, found, missing):
+    """line for a dish that was looked up, or None if it wasn't found"""
+    FOOD_LOOKUPS.inc(result=('usda' if food.get('source') == 'USDA' else 'local') if food else 'not_found')
+    if not food:
+        missing.append(item.query)
+        return None
+    found.append((item, food))
+    return meal_line(item, food)
+
+def meal_end(ctx, found, missing):
+    """closing parts of a meal answer - what wasn't found, the totals and warnings"""
+    if missing:
+        yield f"- couldn't find: {', '.join(missing)}\n"
+    if not found:
+        yield "\nhmm, I couldn't find any of these. Try dishes like chicken rice, laksa or kaya toast!"
+        return
+    ctx.meta['matched'] = ', '.join(food.get('name', '') for _, food in found)
     
-    # show healthy swaps
-    if 'swap' in message.lower() or 'alternative' in message.lower() or 'replace' in message.lower():
-        swaps = load_swaps()
-        response = f"{name_prefix}here are some healthy food swaps you can make:\n\n"
-        for i, swap in enumerate(swaps[:8], 1):
-            response += f"{i}. {swap['unhealthy']} → {swap['healthy']}\n"
-            response += f"   Why? {swap['benefit']}\n\n"
-        
-        if user_name:
-            response += f"Try these out, {user_name}! Your body will thank you."
-        
-        update_user_count(user_id, conversation_count)
+    # usda values are per 100g, not per plate, so they stay out of the totals
+    per_100g = [food.get('name', item.query) for item, food in found if food.get('source') == 'USDA']
+    plates = [(item, food) for item, food in found if food.get('source') != 'USDA']
+    if not plates:
+        yield "\nno meal total - usda values are per 100g rather than per serving, so they can't be added up."
+        if ctx.user_name:
+            yield f"\n\nWant to know about any other foods, {ctx.user_name}?"
+        return
+    
+    totals = meal_totals(plates)
+    response = "\nMeal total: " + ', '.join(
+        amount(column, round(value, 1)) + ('' if column == 'calories' else f" {column}")
+        for column, value in totals.items()) + "\n"
+    if per_100g:
+        response += f"(not counting {', '.join(per_100g)} - usda values are per 100g rather than per serving)\n"
+    
+    # the whole meal against the hpb limits for a day
+    guide = hpb_guidelines()
+    daily = guide.get('daily_limits', {})
+    over = []
+    for column in ('sodium', 'sugar'):
+        limit = daily.get(column)
+        if limit:
+            share = totals[column] / limit * 100
+            response += f"\n{column.title()}: {amount(column, round(totals[column], 1))} - {share:.0f}% of the HPB daily limit ({amount(column, limit)})"
+            if share > 100:
+                over.append(column)
+    yield response
+    
+    if 'sodium' in over:
+        yield f"\n\nWARNING: This meal alone has more sodium than HPB recommends for a whole day ({guide['blood_pressure']['sodium_limit']})!"
+    if 'sugar' in over:
+        yield "\n\nWARNING: This meal has more sugar than HPB recommends for a whole day - go for kosong or siew dai drinks!"
+    if ctx.user_name:
+        yield f"\n\nWant to know about any other foods, {ctx.user_name}?"
+
+@router.handler('meal')
+def handle_meal(ctx):
+    # local dishes are answered right away, the rest are looked up in parallel
+    # and sent as each one arrives, totals last
+    parts, found, pending = meal_start(ctx)
+    yield from parts
+    
+    missing = []
+    if pending:
+        with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+            futures = {pool.submit(ctx.lookup_food, item.query): item for item in pending}
+            for future in as_completed(futures):
+                line = meal_arrived(futures[future], future.result(), found, missing)
+                if line:
+                    yield line
+    
+    yield from meal_end(ctx, found, missing)
+
+# what the hpb guideline says for each condition a recommendation can be for
+CONDITION_GUIDES = {
+    'diabetes': lambda guide: f"HPB sugar limit: {guide['diabetes']['sugar_limit']}, fiber: {guide['diabetes']['fiber_recommendation']}",
+    'blood_pressure': lambda guide: f"HPB sodium limit: {guide['blood_pressure']['sodium_limit']}",
+    'cholesterol': lambda guide: f"HPB LDL target: {guide['cholesterol']['ldl_target']}"
+}
+
+@router.handler('recommend')
+def handle_recommend(ctx):
+    query = ctx.route.entities['food_query']
+    table = store.snapshot.derived['nutrient_table']
+    foods = table.top(query.where, query.order_by, query.descending, query.k)
+    
+    wanted = []
+    for column, (lo, hi) in query.where.items():
+        # "500 kcal" already says calories
+        name = '' if column == 'calories' else f" {column}"
+        if lo is not None and hi is not None:
+            wanted.append(f"{amount(column, lo)}-{amount(column, hi)}{name}")
+        elif hi is not None:
+            wanted.append(f"at most {amount(column, hi)}{name}")
+        else:
+            wanted.append(f"at least {amount(column, lo)}{name}")
+    wanted = ' and '.join(wanted)
+    
+    if not foods:
+        response = f"{ctx.name_prefix}hmm, none of the dishes I know have {wanted}.\n\n"
+        response += "Try a looser limit, or ask me about a specific dish!"
         return response
     
-    # thank you response
-    if 'thank' in message.lower() or 'thanks' in message.lower():
-        responses = [
-            f"You're welcome{', ' + user_name if user_name else ''}! Happy to help!",
-            f"No problem{', ' + user_name if user_name else ''}! Eat healthy!",
-            f"Anytime{', ' + user_name if user_name else ''}! Stay healthy!"
-        ]
-        update_user_count(user_id, conversation_count)
-        return responses[conversation_count % len(responses)]
+    ctx.meta['matched'] = ', '.join(food.get('name', '') for food in foods)
+    ranking = f"{'highest' if query.descending else 'lowest'} {query.order_by} first"
+    response = f"{ctx.name_prefix}here are dishes with {wanted}, {ranking}:\n\n" if wanted \
+        else f"{ctx.name_prefix}here are the dishes with the {ranking}:\n\n"
+    
+    # the columns they asked about, then calories for context
+    shown = list(dict.fromkeys([query.order_by, *query.where, 'calories']))
+    for i, food in enumerate(foods, 1):
+        facts = ', '.join(f"{column} {amount(column, food[column])}" for column in shown if column in food)
+        response += f"{i}. {food.get('name')} - {facts}\n"
     
+    if query.condition in CONDITION_GUIDES:
+        response += f"\n{CONDITION_GUIDES[query.condition](hpb_guidelines())}"
+    if ctx.user_name:
+        response += f"\n\nWant the full nutrition info for any of these, {ctx.user_name}?"
+    return response
+
+@router.handler('diabetes')
+def handle_diabetes(ctx):
+    # diabetes management, pre-rendered per data version
+    return templates().render('diabetes', ctx.name_prefix, ctx.user_name)
+
+@router.handler('blood_pressure')
+def handle_blood_pressure(ctx):
+    # blood pressure management
+    return templates().render('blood_pressure', ctx.name_prefix, ctx.user_name)
+
+@router.handler('cholesterol')
+def handle_cholesterol(ctx):
+    # cholesterol management
+    return templates().render('cholesterol', ctx.name_prefix, ctx.user_name)
+
+@router.handler('swaps')
+def handle_swaps(ctx):
+    # swaps for the food or condition they asked about, else the general list
+    swaps = swap_index().match([ctx.msg.raw], limit=5)
+    if not swaps:
+        condition = next((CONDITION_WORDS[t] for t in ctx.msg.tokens if t in CONDITION_WORDS), None)
+        swaps = swap_index().for_condition(condition, 5) if condition else ()
+    if not swaps:
+        return templates().render('swaps', ctx.name_prefix, ctx.user_name)
+    
+    response = ctx.name_prefix + "here are some healthier swaps for that:\n\n"
+    for i, swap in enumerate(swaps, 1):
+        response += f"{i}. {swap['unhealthy']} → {swap['healthy']}\n"
+        response += f"   Why? {swap['benefit']}\n\n"
+    return response
+
+@router.handler('thanks')
+def handle_thanks(ctx):
+    # thank you response
+    user_name = ctx.user_name
+    responses = [
+        f"You're welcome{', ' + user_name if user_name else ''}! Happy to help!",
+        f"No problem{', ' + user_name if user_name else ''}! Eat healthy!",
+        f"Anytime{', ' + user_name if user_name else ''}! Stay healthy!"
+    ]
+    return responses[ctx.count % len(responses)]
+
+@router.handler('help')
+def handle_help(ctx):
     # default help message
+    user_name = ctx.user_name
     response = f"{'Hey ' + user_name + '! ' if user_name else 'Hi there! '}"
     response += "I can help you with:\n\n"
     response += "1. Nutrition info (try: 'nutrition for chicken rice')\n"
@@ -453,26 +959,104 @@ def process_chat(message, user_id):
     response += "3. Health conditions (diabetes, blood pressure, cholesterol)\n"
     response += "4. Healthy food swaps\n\n"
     response += "What interests you?"
-    
-    update_user_count(user_id, conversation_count)
     return response
 
 # flask routes
 
+def serve_static(name):
+    """in-memory file in the best encoding the client accepts, or a 304"""
+    status, headers, body = static_assets.respond(
+        name,
+        version=request.args.get('v'),
+        accept_encoding=request.headers.get('Accept-Encoding'),
+        if_none_match=request.headers.get('If-None-Match')
+    )
+    STATIC_RESPONSES.inc(encoding='not_modified' if status == 304 else
+                         dict(headers).get('Content-Encoding', 'identity'))
+    return Response(body, status=status, headers=headers)
+
 @app.route('/')
 def index():
     """serve the frontend html"""
-    return send_from_directory('.', 'frontend.html')
+    return serve_static('frontend.html')
 
 @app.route('/style.css')
 def serve_css():
     """serve the css file"""
-    return send_from_directory('.', 'style.css')
+    return serve_static('style.css')
 
 @app.route('/script.js')
 def serve_js():
     """serve the javascript file"""
-    return send_from_directory('.', 'script.js')
+    return serve_static('script.js')
+
+# process one message, time it and save it to history
+def answer_message(user_message, user_id, lookup_food=None, route=None):
+    """bot response for one message, history saved in the background"""
+    msg = normalize(user_message)
+    meta = {}
+    started = time.perf_counter()
+    with profiler.maybe_profile():
+        bot_response = process_chat(msg, user_id, meta, lookup_food, route)
+    latency_ms = (time.perf_counter() - started) * 1000
+    
+    # save to history
+    try:
+        save_chat_history(msg.raw, bot_response, user_id, meta, latency_ms)
+    except Exception as history_error:
+        # dont fail if history save fails
+        print(f"warning: could not save to history - {history_error}")
+    
+    return bot_response
+
+async def answer_message_async(user_message, user_id):
+    """answer_message for asyncio callers (asgi.py)"""
+    msg = normalize(user_message)
+    meta = {}
+    started = time.perf_counter()
+    bot_response = await process_chat_async(msg, user_id, meta)
+    latency_ms = (time.perf_counter() - started) * 1000
+    
+    try:
+        save_chat_history(msg.raw, bot_response, user_id, meta, latency_ms)
+    except Exception as history_error:
+        print(f"warning: could not save to history - {history_error}")
+    
+    return bot_response
+
+RATE_LIMITED_MESSAGE = "you're sending messages faster than i can answer them - please wait a moment and try again."
+
+def client_ip(remote_addr, forwarded_for=None):
+    """address the rate limit counts against - behind a trusted proxy, the one it saw"""
+    if forwarded_for and RATE_LIMIT_SETTINGS.get('trust_forwarded_for', False):
+        # the proxy appends the address it got the request from, anything before it is the client's word
+        return forwarded_for.split(',')[-1].strip() or remote_addr
+    return remote_addr
+
+def admit(user_id, ip, cost=1):
+    """rate limit decision for cost messages from this user and address"""
+    decision = rate_limiter.check(user_id, ip, cost)
+    if not decision.allowed:
+        RATE_LIMITED.inc(scope=decision.scope)
+    return decision
+
+async def admit_async(user_id, ip, cost=1):
+    """admit for asyncio callers - a sqlite bucket can wait on its file lock, so it runs off the loop"""
+    return await off_loop(rate_limiter.buckets.backend != 'memory', admit, user_id, ip, cost)
+
+def rate_limited(decision):
+    """429 telling the client how long to back off"""
+    response = jsonify({
+        'response': RATE_LIMITED_MESSAGE,
+        'status': 'error',
+        'retry_after': decision.retry_after
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(decision.retry_after)
+    return response
+
+def request_ip():
+    return client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'))
 
 @app.route('/chat', methods=['POST'])
 def chat():
@@ -495,16 +1079,18 @@ def chat():
                 'response': 'please type a message first!',
                 'status': 'error'
             }), 400
+        if not isinstance(user_id, str):
+            return jsonify({
+                'response': 'user_id must be a string',
+                'status': 'error'
+            }), 400
         
-        # process the message with personalization
-        bot_response = process_chat(user_message, user_id)
+        decision = admit(user_id, request_ip())
+        if not decision.allowed:
+            return rate_limited(decision)
         
-        # save to history
-        try:
-            save_chat_history(user_message, bot_response)
-        except Exception as history_error:
-            # dont fail if history save fails
-            print(f"warning: could not save to history - {history_error}")
+        # process the message with personalization
+        bot_response = answer_message(user_message, user_id)
         
         return jsonify({
             'response': bot_response,
@@ -526,19 +1112,296 @@ def chat():
             'status': 'error'
         }), 500
 
+# one server-sent event
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """same as /chat, but as server-sent events: ack, then each part of the answer
+    as soon as it is known (usda results and warnings come last), then done"""
+    data = request.get_json(silent=True)
+    user_message = data.get('message') if isinstance(data, dict) else None
+    
+    if not isinstance(user_message, str) or not user_message.strip():
+        return jsonify({
+            'response': 'please type a message first!',
+            'status': 'error'
+        }), 400
+    
+    user_id = data.get('user_id', 'default_user')
+    if not isinstance(user_id, str):
+        return jsonify({
+            'response': 'user_id must be a string',
+            'status': 'error'
+        }), 400
+    decision = admit(user_id, request_ip())
+    if not decision.allowed:
+        return rate_limited(decision)
+    msg = normalize(user_message.strip())
+    
+    def generate():
+        meta = {}
+        parts = []
+        started = time.perf_counter()
+        try:
+            answer = start_chat(msg, user_id, meta)
+            yield sse('ack', {'intent': meta.get('intent')})
+            for part in answer:
+                parts.append(part)
+                yield sse('part', {'text': part})
+            yield sse('done', {'response': ''.join(parts), 'status': 'success'})
+        except Exception as e:
+            print(f"error in chat stream: {e}")
+            yield sse('error', {'response': 'oops! something went wrong on my end. please refresh and try again.',
+                                'status': 'error'})
+        finally:
+            # saved once the stream is over (or the client went away)
+            latency_ms = (time.perf_counter() - started) * 1000
+            try:
+                save_chat_history(msg.raw, ''.join(parts), user_id, meta, latency_ms)
+            except Exception as history_error:
+                print(f"warning: could not save to history - {history_error}")
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """many messages in one round trip, answered in order with a status per item"""
+    data = request.get_json(silent=True)
+    items = data.get('messages') if isinstance(data, dict) else data
+    
+    if not isinstance(items, list) or not items:
+        return jsonify({
+            'response': 'send a list of {user_id, message} items (or {"messages": [...]})',
+            'status': 'error'
+        }), 400
+    
+    max_items = BATCH_SETTINGS.get('max_items', 100)
+    if len(items) > max_items:
+        return jsonify({
+            'response': f'too many messages - the limit is {max_items} per batch',
+            'status': 'error'
+        }), 413
+    
+    # validate and normalize every message once
+    results = [None] * len(items)
+    pending = []
+    for i, item in enumerate(items):
+        message = item.get('message') if isinstance(item, dict) else None
+        if not isinstance(message, str) or not message.strip():
+            results[i] = {'index': i, 'status': 'error', 'response': 'please type a message first!'}
+            continue
+        user_id = item.get('user_id') or 'default_user'
+        if not isinstance(user_id, str):
+            return jsonify({
+                'response': f'user_id must be a string (message {i})',
+                'status': 'error'
+            }), 400
+        pending.append((i, user_id, normalize(message.strip())))
+    
+    # the address pays for the whole batch up front, each user for their own messages,
+    # and gets back what it paid for the ones their user's bucket refused
+    ip = request_ip()
+    if pending:
+        decision = admit(None, ip, cost=len(pending))
+        if not decision.allowed:
+            return rate_limited(decision)
+    admitted = []
+    for i, user_id, msg in pending:
+        decision = admit(user_id, None)
+        if decision.allowed:
+            admitted.append((i, user_id, msg))
+        else:
+            results[i] = {'index': i, 'user_id': user_id, 'status': 'rate_limited',
+                          'response': RATE_LIMITED_MESSAGE, 'retry_after': decision.retry_after}
+    # a batch past the burst was only charged the burst, never give back more than that
+    charged = min(len(pending), rate_limiter.scopes['ip'][1])
+    if len(admitted) < charged:
+        rate_limiter.refund('ip', ip, charged - len(admitted))
+    pending = admitted
+    
+    # look each distinct food (or dish of a meal) up once, usda misses in parallel - only for
+    # messages the nutrition or meal handler will answer, not every one that mentions food.
+    # the routes are kept for answering, the intent is checked again then, since an earlier
+    # message in the batch can change the session it depends on ("hi" -> asking for a name)
+    queries = []
+    routes = {}
+    for i, user_id, msg in pending:
+        route = routes[i] = router.classify(msg)
+        ctx = ChatContext(msg, route, user_id, sessions.get(user_id) or UserSession(), {})
+        intent = router.resolve(route, ctx)
+        if intent == 'meal':
+            queries.extend(item.query for item in route.entities['dishes'])
+        elif intent == 'nutrition':
+            queries.append(msg.raw)
+    prefetched = prefetch_foods(queries, BATCH_SETTINGS.get('usda_workers', 8))
+    
+    def lookup_food(query):
+        key = normalize_query(query)
+        return prefetched[key] if key in prefetched else find_food(query)
+    
+    # in order, so messages from the same user see each other's session updates
+    for i, user_id, msg in pending:
+        try:
+            response = answer_message(msg, user_id, lookup_food, routes[i])
+            results[i] = {'index': i, 'user_id': user_id, 'status': 'success', 'response': response}
+        except Exception as e:
+            print(f"error in chat batch item {i}: {e}")
+            results[i] = {'index': i, 'user_id': user_id, 'status': 'error',
+                          'response': 'oops! something went wrong on my end with this message.'}
+    
+    return jsonify({
+        'status': 'success',
+        'results': results
+    })
+
+# admin endpoints answer to the configured token only - behind a reverse proxy every
+# request comes from localhost, so the address proves nothing
+def admin_denied():
+    """error response for a request without the admin token, or None if it has it"""
+    token = config.get('admin', {}).get('token', '')
+    if not token:
+        return jsonify({'status': 'error', 'response': 'admin endpoints are off, set admin.token in config.json'}), 404
+    # prometheus sends its credentials as a bearer token
+    bearer = request.headers.get('Authorization', '')
+    sent = bearer[len('Bearer '):] if bearer.startswith('Bearer ') else request.headers.get('X-Admin-Token', '')
+    if not secrets.compare_digest(sent, token):
+        return jsonify({'status': 'error', 'response': 'forbidden'}), 403
+    return None
+
+@app.route('/history', methods=['GET'])
+def history():
+    """recent structured history, filtered by query args"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    if history_store is None:
+        return jsonify({'status': 'error', 'response': 'history store is disabled'}), 404
+    
+    try:
+        records = history_store.query(
+            limit=min(request.args.get('limit', 100, type=int), 1000),
+            **history_filters(request.args)
+        )
+    except ValueError as e:
+        return jsonify({'status': 'error', 'response': f'bad filter - {e}'}), 400
+    return jsonify({'status': 'success', 'records': records})
+
+@app.route('/history/export', methods=['GET'])
+def history_export():
+    """stream every matching record as json lines, in constant memory"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    if history_store is None:
+        return jsonify({'status': 'error', 'response': 'history store is disabled'}), 404
+    
+    try:
+        filters = history_filters(request.args)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'response': f'bad filter - {e}'}), 400
+    
+    def generate():
+        for record in history_store.iter_records(**filters):
+            yield json.dumps(record, ensure_ascii=False) + '\n'
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
+def history_filters(args):
+    """history query filters from request args"""
+    min_latency = args.get('min_latency_ms')
+    return {
+        'user_id': args.get('user_id'),
+        'since': parse_time(args.get('since')),
+        'until': parse_time(args.get('until')),
+        'intent': args.get('intent'),
+        'min_latency_ms': float(min_latency) if min_latency else None,
+        'unanswered': args.get('unanswered') in ('1', 'true', 'yes')
+    }
+
 @app.route('/health', methods=['GET'])
 def health():
     """health check endpoint"""
+    snapshot = store.snapshot
     return jsonify({
         'status': 'healthy',
         'api_configured': USDA_KEY != 'DEMO_KEY',
         'files_loaded': {
-            'foods': len(load_sg_foods()),
-            'myths': len(load_myths()),
-            'swaps': len(load_swaps())
-        }
+            'foods': len(snapshot.foods),
+            'myths': len(snapshot.myths),
+            'swaps': len(snapshot.swaps)
+        },
+        'data_version': snapshot.version,
+        'usda_index': fdc_index.stats(),
+        'usda_live_fallback': USDA_LIVE_FALLBACK,
+        'usda_cache': usda_cache.stats(),
+        'usda_client': usda_client.stats(),
+        'usda_async': usda_async.stats(),
+        'chat_history': history_writer.stats(),
+        'sessions': sessions.stats(),
+        'rate_limit': rate_limiter.stats(),
+        'swap_index': swap_index().stats(),
+        'warm_up': warm_up_stats,
+        'static': static_assets.stats()
     })
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """prometheus metrics of the worker process answering the scrape"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/profiler', methods=['GET', 'POST'])
+def profiler_endpoint():
+    """GET the merged profile, POST {"rate": 0.05, "reset": true} to switch sampling"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        data = data if isinstance(data, dict) else {}
+        try:
+            if data.get('reset'):
+                profiler.reset()
+            if 'rate' in data:
+                profiler.configure(data['rate'])
+        except (TypeError, ValueError):
+            return jsonify({'status': 'error', 'response': 'rate must be a number between 0 and 1'}), 400
+        return jsonify({'status': 'success', 'profiler': profiler.stats()})
+    
+    limit = request.args.get('limit', 30, type=int)
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime', 'calls', 'ncalls'):
+        sort = 'cumulative'
+    return Response(profiler.report(limit, sort), mimetype='text/plain')
+
+# warm the caches at startup - under serve.py or gunicorn this runs in the parent before
+# the fork, so every worker starts with them
+WARM_UP_SETTINGS = config.get('warm_up', {})
+warm_up_stats = {}
+
+def run_warm_up(usda):
+    """warm_up with the config.json settings, into warm_up_stats"""
+    try:
+        warm_up_stats.update(warm_up(
+            days=WARM_UP_SETTINGS.get('days', 7),
+            top_foods=WARM_UP_SETTINGS.get('top_foods', 50),
+            usda=usda,
+            max_workers=BATCH_SETTINGS.get('usda_workers', 8)
+        ))
+    except Exception as e:
+        # a cold start is slower, not broken
+        print(f"warning: warm-up failed - {e}")
+
+# import only reads local data, the offline index and the usda cache - never the network,
+# the api part runs in each worker (start_worker)
+if WARM_UP_SETTINGS.get('enabled', True):
+    run_warm_up(usda=False)
+
 # main
 if __name__ == '__main__':
     print("="*60)
@@ -548,6 +1411,8 @@ if __name__ == '__main__':
     print(f"chat history: {os.path.abspath(FILES['chat_history'])}")
     print("\nstarting flask server...")
     print("open browser: http://127.0.0.1:5000")
+    print("(development server - use `python serve.py` in production)")
     print("="*60)
     
+    start_worker()
     app.run(debug=True, host='127.0.0.1', port=5000)
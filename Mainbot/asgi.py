@@ -0,0 +1,259 @@
+"""
+asgi entry point - /chat and /chat/stream run on asyncio, so a message waiting on usda
+is a suspended coroutine instead of a blocked thread and one process can have hundreds
+of lookups in flight. local answers never await anything. the page, css and js come
+straight from memory. every other route is the flask app, run on a small thread pool.
+
+    uvicorn asgi:application --host 127.0.0.1 --port 5000
+"""
+
+import asyncio
+import io
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import app as bot
+from intent_router import normalize
+
+
+# same headers the flask app adds in after_request
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Content-Type,Authorization'),
+    (b'access-control-allow-methods', b'GET,PUT,POST,DELETE,OPTIONS')
+]
+
+wsgi_pool = ThreadPoolExecutor(max_workers=bot.config.get('server', {}).get('threads', 8),
+                               thread_name_prefix='wsgi')
+
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+async def send_json(send, status, data, headers=()):
+    body = json.dumps(data).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())] + list(headers) + CORS_HEADERS
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def read_message(scope, receive, send):
+    """(message, user_id) from an admitted chat request, or None after sending the 400 or 429"""
+    try:
+        data = json.loads(await read_body(receive) or b'null')
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        await send_json(send, 400, {
+            'response': 'sorry, i didnt receive your message properly. please try again.',
+            'status': 'error'
+        })
+        return None
+
+    message = data.get('message')
+    if not isinstance(message, str) or not message.strip():
+        await send_json(send, 400, {
+            'response': 'please type a message first!',
+            'status': 'error'
+        })
+        return None
+
+    user_id = data.get('user_id', 'default_user')
+    if not isinstance(user_id, str):
+        await send_json(send, 400, {
+            'response': 'user_id must be a string',
+            'status': 'error'
+        })
+        return None
+    forwarded_for = next((v.decode('latin-1') for k, v in scope.get('headers', []) if k == b'x-forwarded-for'), None)
+    decision = await bot.admit_async(user_id, bot.client_ip((scope.get('client') or ('',))[0], forwarded_for))
+    if not decision.allowed:
+        await send_json(send, 429, {
+            'response': bot.RATE_LIMITED_MESSAGE,
+            'status': 'error',
+            'retry_after': decision.retry_after
+        }, [(b'retry-after', str(decision.retry_after).encode())])
+        return None
+    return message.strip(), user_id
+
+
+async def chat(scope, receive, send):
+    request = await read_message(scope, receive, send)
+    if request is None:
+        return
+    try:
+        bot_response = await bot.answer_message_async(*request)
+    except Exception as e:
+        print(f"error in chat endpoint: {e}")
+        await send_json(send, 500, {
+            'response': 'oops! something went wrong on my end. please refresh and try again.',
+            'status': 'error'
+        })
+        return
+    await send_json(send, 200, {'response': bot_response, 'status': 'success'})
+
+
+async def chat_stream(scope, receive, send):
+    request = await read_message(scope, receive, send)
+    if request is None:
+        return
+    msg, user_id = normalize(request[0]), request[1]
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream; charset=utf-8'),
+                    (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no')] + CORS_HEADERS
+    })
+
+    async def event(name, data):
+        await send({'type': 'http.response.body', 'body': bot.sse(name, data).encode('utf-8'),
+                    'more_body': True})
+
+    meta = {}
+    parts = []
+    started = time.perf_counter()
+    try:
+        ctx = await bot.open_chat_async(msg, user_id, meta)
+        await event('ack', {'intent': bot.router.resolve(ctx.route, ctx)})
+        async for part in bot.stream_chat_async(ctx):
+            parts.append(part)
+            await event('part', {'text': part})
+        await event('done', {'response': ''.join(parts), 'status': 'success'})
+    except Exception as e:
+        print(f"error in chat stream: {e}")
+        await event('error', {'response': 'oops! something went wrong on my end. please refresh and try again.',
+                              'status': 'error'})
+    finally:
+        latency_ms = (time.perf_counter() - started) * 1000
+        try:
+            bot.save_chat_history(msg.raw, ''.join(parts), user_id, meta, latency_ms)
+        except Exception as history_error:
+            print(f"warning: could not save to history - {history_error}")
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def static_file(name):
+    """handler for one in-memory static file - no thread, no flask"""
+    async def handler(scope, receive, send):
+        headers = {k.decode('latin-1'): v.decode('latin-1') for k, v in scope.get('headers', [])}
+        version = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('v', [None])[0]
+        status, response_headers, body = bot.static_assets.respond(
+            name, version, headers.get('accept-encoding'), headers.get('if-none-match'))
+        bot.STATIC_RESPONSES.inc(encoding='not_modified' if status == 304 else
+                                 dict(response_headers).get('Content-Encoding', 'identity'))
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in response_headers] + CORS_HEADERS
+        })
+        await send({'type': 'http.response.body', 'body': body if scope['method'] == 'GET' else b''})
+    return handler
+
+
+ASYNC_ROUTES = {
+    ('POST', '/chat'): chat,
+    ('POST', '/chat/stream'): chat_stream
+}
+for path, name in (('/', 'frontend.html'), ('/style.css', 'style.css'), ('/script.js', 'script.js')):
+    ASYNC_ROUTES[('GET', path)] = ASYNC_ROUTES[('HEAD', path)] = static_file(name)
+
+
+def wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in scope.get('headers', []):
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'content-length':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    # the body has been read in full already
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+async def call_wsgi(scope, receive, send):
+    """run the flask app for this request on the thread pool, streaming its body back"""
+    environ = wsgi_environ(scope, await read_body(receive))
+    loop = asyncio.get_running_loop()
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+        return lambda data: None
+
+    result = await loop.run_in_executor(wsgi_pool, bot.app, environ, start_response)
+    chunks = iter(result)
+    try:
+        chunk = await loop.run_in_executor(wsgi_pool, next, chunks, None)
+        await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+        while chunk is not None:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            chunk = await loop.run_in_executor(wsgi_pool, next, chunks, None)
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            await loop.run_in_executor(wsgi_pool, result.close)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            bot.start_worker()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            flush_timeout = bot.config.get('server', {}).get('flush_timeout', 5)
+            await asyncio.get_running_loop().run_in_executor(None, bot.stop_worker, flush_timeout)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    handler = ASYNC_ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        await call_wsgi(scope, receive, send)
+    else:
+        await handler(scope, receive, send)
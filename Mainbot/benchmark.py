@@ -0,0 +1,416 @@
+"""
+benchmarks - micro-benchmarks of the hot functions and a load generator for /chat
+
+    python benchmark.py micro
+    python benchmark.py load --users 200 --concurrency 32 --requests 5000 --usda-latency 0.3
+    python benchmark.py load --server serve        # preforked serve.py instead of one process
+    python benchmark.py compare old.json new.json
+
+both run against a copy of the data files and config in a temp folder, with usda
+replaced by a local stub server, so the real caches and history are never touched.
+results are saved as json (with the git commit) in bench_results/
+"""
+
+import argparse
+import hashlib
+import http.server
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(HERE, 'bench_results')
+
+# what people ask, roughly in the proportions they ask it
+MIX = {
+    'greeting': (10, ['hi', 'hello', 'hey there', 'good morning']),
+    'myth': (15, ['are carbs bad?', 'is eating fat bad for me', 'should i avoid fruit', 'no carb diet good?']),
+    'nutrition_local': (35, ['calories in chicken rice', 'nasi lemak nutrition', 'how many calories in laksa',
+                             'char kway teow calories', 'nutrition info for roti prata', 'chiken rice calories',
+                             'yong tau foo nutrition', 'bak kut teh calories']),
+    'nutrition_usda': (10, [f'nutrition info for {food}' for food in (
+        'quinoa salad', 'avocado toast', 'greek yogurt', 'beef burrito', 'tofu stir fry', 'oatmeal',
+        'caesar salad', 'pad thai', 'sushi roll', 'falafel wrap', 'lentil soup', 'acai bowl')]),
+    'guideline': (20, ['diabetes tips', 'how to lower blood pressure', 'cholesterol advice', 'hypertension diet']),
+    'swaps': (5, ['healthy swaps', 'what are some healthier alternatives']),
+    'thanks': (5, ['thanks!', 'thank you'])
+}
+
+
+class StubUSDA:
+    """fooddata central stand-in that answers after a fixed delay"""
+
+    def __init__(self, latency=0.2, backlog=128):
+        self.latency = latency
+        self.requests = 0
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                query = parse_qs(urlsplit(self.path).query).get('query', [''])[0]
+                time.sleep(stub.latency)
+                body = json.dumps({'foods': [stub.food(query)]}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(http.server.ThreadingHTTPServer):
+            # the default accept queue of 5 overflows under load - the refused connects would
+            # time out and trip the breaker, and the numbers would measure the stub
+            request_queue_size = backlog
+            daemon_threads = True
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/fdc/v1/foods/search"
+        threading.Thread(target=self.server.serve_forever, name='stub-usda', daemon=True).start()
+
+    @staticmethod
+    def food(query):
+        # stable made-up numbers per query
+        seed = int(hashlib.md5(query.encode('utf-8')).hexdigest()[:8], 16)
+        values = {'Energy': 100 + seed % 700, 'Protein': seed % 40, 'Carbohydrate, by difference': seed % 90,
+                  'Total lipid (fat)': seed % 35, 'Sodium, Na': seed % 1500, 'Sugars, total': seed % 25}
+        return {'description': query.title(),
+                'foodNutrients': [{'nutrientName': name, 'value': value} for name, value in values.items()]}
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_workspace(usda_url):
+    """temp folder with the data files and a config pointing at the stub"""
+    workspace = tempfile.mkdtemp(prefix='chatbot-bench-')
+    with open(os.path.join(HERE, 'config.json'), 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    for key, name in config['files'].items():
+        if key != 'chat_history':
+            shutil.copy(os.path.join(HERE, name), workspace)
+    config['api']['usda_url'] = usda_url
+    # every simulated user shares one address, and the load is the point
+    config.setdefault('rate_limit', {})['enabled'] = False
+    with open(os.path.join(workspace, 'config.json'), 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+    return workspace
+
+
+def load_app(workspace):
+    """import the app with the workspace as its working folder"""
+    os.chdir(workspace)
+    if HERE not in sys.path:
+        sys.path.insert(0, HERE)
+    import app
+    return app
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def percentile(ordered, p):
+    """nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(latencies_ms):
+    ordered = sorted(latencies_ms)
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered), 3) if ordered else None,
+        'p50_ms': round(percentile(ordered, 50), 3) if ordered else None,
+        'p95_ms': round(percentile(ordered, 95), 3) if ordered else None,
+        'p99_ms': round(percentile(ordered, 99), 3) if ordered else None,
+        'max_ms': round(ordered[-1], 3) if ordered else None
+    }
+
+
+def save_results(kind, settings, results, output=None):
+    report = {
+        'benchmark': kind,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': settings,
+        'results': results
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f"{kind}-{report['commit'] or 'nogit'}-{stamp}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults saved to {output}")
+    return output
+
+
+def time_call(func, repeat):
+    """best and median microseconds per call, timeit style"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    runs = sorted(t / number * 1e6 for t in timer.repeat(repeat, number))
+    return {'best_us': round(runs[0], 3), 'median_us': round(runs[len(runs) // 2], 3),
+            'ops_per_sec': round(1e6 / runs[len(runs) // 2]), 'loops': number}
+
+
+def run_micro(args):
+    stub = StubUSDA(latency=0)
+    workspace = make_workspace(stub.url)
+    app = load_app(workspace)
+    users = itertools.count()
+
+    def chat(message):
+        # a new user every call, so every message is answered from the same state
+        return lambda: app.process_chat(message, f"bench-{next(users)}")
+
+    # usda answers come from the cache after the first call, like in steady state
+    app.process_chat('nutrition info for quinoa salad', 'bench-warmup')
+
+    cases = {
+        'search_local_food[exact]': lambda: app.search_local_food('chicken rice'),
+        'search_local_food[sentence]': lambda: app.search_local_food('how many calories in nasi lemak'),
+        'search_local_food[typo]': lambda: app.search_local_food('chiken rice'),
+        'search_local_food[miss]': lambda: app.search_local_food('quinoa salad with feta'),
+        'check_myth[hit]': lambda: app.check_myth('are carbs bad for me?'),
+        'check_myth[miss]': lambda: app.check_myth('what should i eat for lunch today'),
+        'is_asking_name[name]': lambda: app.is_asking_name('my name is Ann'),
+        'is_asking_name[question]': lambda: app.is_asking_name('calories in laksa'),
+        'get_swaps[all]': lambda: app.get_swaps(),
+        'get_swaps[diabetes]': lambda: app.get_swaps('diabetes', 3),
+        'process_chat[greeting]': chat('hi'),
+        'process_chat[myth]': chat('are carbs bad?'),
+        'process_chat[nutrition_local]': chat('calories in chicken rice'),
+        'process_chat[nutrition_usda_cached]': chat('nutrition info for quinoa salad'),
+        'process_chat[diabetes]': chat('diabetes tips'),
+        'process_chat[blood_pressure]': chat('how to lower blood pressure'),
+        'process_chat[cholesterol]': chat('cholesterol advice'),
+        'process_chat[swaps]': chat('healthy swaps'),
+        'process_chat[thanks]': chat('thanks!'),
+        'process_chat[help]': chat('what can you do'),
+    }
+    if args.filter:
+        cases = {name: func for name, func in cases.items() if args.filter in name}
+
+    results = {}
+    print(f"{'benchmark':<40} {'best us':>10} {'median us':>10} {'ops/s':>10}")
+    for name, func in cases.items():
+        results[name] = time_call(func, args.repeat)
+        r = results[name]
+        print(f"{name:<40} {r['best_us']:>10.2f} {r['median_us']:>10.2f} {r['ops_per_sec']:>10}")
+
+    app.stop_worker()
+    stub.close()
+    os.chdir(HERE)
+    shutil.rmtree(workspace, ignore_errors=True)
+    save_results('micro', {'repeat': args.repeat, 'filter': args.filter}, results, args.output)
+
+
+def start_server(args, workspace):
+    """(base url, stop function) for the server under test"""
+    if args.url:
+        return args.url.rstrip('/'), lambda: None
+
+    if args.server == 'serve':
+        port = args.port or 5099
+        env = dict(os.environ, PYTHONPATH=HERE + os.pathsep + os.environ.get('PYTHONPATH', ''))
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, 'serve.py'), '--bind', f'127.0.0.1:{port}',
+             '--workers', str(args.workers), '--threads', str(args.threads)],
+            cwd=workspace, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        url = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                requests.get(url + '/health', timeout=1)
+                break
+            except requests.RequestException:
+                time.sleep(0.2)
+
+        def stop():
+            proc.terminate()
+            proc.wait(60)
+        return url, stop
+
+    # flask app in this process on werkzeug's threaded server
+    from werkzeug.serving import make_server
+    app = load_app(workspace)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', args.port or 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+
+    def stop():
+        server.shutdown()
+        app.stop_worker()
+    return f"http://127.0.0.1:{server.server_port}", stop
+
+
+def run_load(args):
+    # a meal fans out into several usda lookups at once, so room for a few per client
+    stub = StubUSDA(latency=args.usda_latency, backlog=max(128, args.concurrency * 4))
+    workspace = make_workspace(stub.url)
+    url, stop = start_server(args, workspace)
+
+    rng = random.Random(args.seed)
+    kinds = list(MIX)
+    weights = [MIX[kind][0] for kind in kinds]
+    # the whole request plan is fixed up front, so a seed always replays the same traffic
+    plan = []
+    for _ in range(args.requests):
+        kind = rng.choices(kinds, weights)[0]
+        plan.append((kind, rng.choice(MIX[kind][1]), f"load-user-{rng.randrange(args.users)}"))
+
+    latencies = {kind: [] for kind in kinds}
+    errors = {}
+    position = itertools.count()
+    lock = threading.Lock()
+
+    def worker():
+        session = requests.Session()
+        while True:
+            i = next(position)
+            if i >= len(plan):
+                return
+            kind, message, user_id = plan[i]
+            started = time.perf_counter()
+            try:
+                response = session.post(url + args.endpoint, json={'message': message, 'user_id': user_id},
+                                        timeout=args.timeout)
+                ok = response.status_code == 200
+                error = None if ok else f"http {response.status_code}"
+            except requests.RequestException as e:
+                error = type(e).__name__
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                if error is None:
+                    latencies[kind].append(elapsed)
+                else:
+                    errors[error] = errors.get(error, 0) + 1
+
+    print(f"driving {url}{args.endpoint}: {args.requests} requests, {args.concurrency} clients, "
+          f"{args.users} users, usda latency {args.usda_latency * 1000:.0f}ms")
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    stop()
+    stub.close()
+    os.chdir(HERE)
+    shutil.rmtree(workspace, ignore_errors=True)
+
+    everything = [ms for values in latencies.values() for ms in values]
+    results = {
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round(len(everything) / elapsed, 2),
+        'errors': errors,
+        'usda_requests': stub.requests,
+        'overall': summarize(everything),
+        'by_kind': {kind: summarize(values) for kind, values in latencies.items() if values}
+    }
+
+    overall = results['overall']
+    print(f"\n{results['throughput_rps']} req/s over {results['duration_s']}s, "
+          f"{sum(errors.values())} errors, {stub.requests} usda calls")
+    print(f"{'kind':<20} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for kind, s in list(results['by_kind'].items()) + [('overall', overall)]:
+        print(f"{kind:<20} {s['count']:>7} {s['p50_ms']:>9.2f} {s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f}")
+
+    settings = {key: getattr(args, key) for key in ('requests', 'concurrency', 'users', 'usda_latency', 'seed',
+                                                   'endpoint', 'server', 'workers', 'threads', 'url')}
+    save_results('load', settings, results, args.output)
+
+
+def run_compare(args):
+    with open(args.old, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(args.new, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+    if old['benchmark'] != new['benchmark']:
+        sys.exit(f"can't compare a {old['benchmark']} run with a {new['benchmark']} run")
+    print(f"{old['benchmark']}: {old.get('commit')} ({old['timestamp']}) -> {new.get('commit')} ({new['timestamp']})\n")
+
+    if old['benchmark'] == 'micro':
+        rows = [(name, old['results'][name]['median_us'], new['results'][name]['median_us'])
+                for name in new['results'] if name in old['results']]
+        unit = 'median us'
+    else:
+        rows = [('throughput_rps', old['results']['throughput_rps'], new['results']['throughput_rps'])]
+        for kind in ['overall'] + list(new['results']['by_kind']):
+            a = old['results']['overall'] if kind == 'overall' else old['results']['by_kind'].get(kind)
+            b = new['results']['overall'] if kind == 'overall' else new['results']['by_kind'][kind]
+            if a:
+                rows += [(f"{kind} {p}", a[f'{p}_ms'], b[f'{p}_ms']) for p in ('p50', 'p95', 'p99')]
+        unit = 'value'
+
+    print(f"{'':<40} {'old ' + unit:>12} {'new ' + unit:>12} {'change':>9}")
+    for name, a, b in rows:
+        change = f"{(b - a) / a * 100:+.1f}%" if a else ''
+        print(f"{name:<40} {a:>12.2f} {b:>12.2f} {change:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='micro-benchmarks and load tests for the chatbot')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    micro = sub.add_parser('micro', help='time the hot functions and process_chat per intent')
+    micro.add_argument('--repeat', type=int, default=5)
+    micro.add_argument('--filter', help='only benchmarks whose name contains this')
+    micro.add_argument('--output', help='json file (default: bench_results/)')
+
+    load = sub.add_parser('load', help='drive /chat with a realistic message mix')
+    load.add_argument('--requests', type=int, default=2000)
+    load.add_argument('--concurrency', type=int, default=16, help='parallel clients')
+    load.add_argument('--users', type=int, default=200, help='distinct user ids')
+    load.add_argument('--usda-latency', type=float, default=0.2, help='stub usda delay in seconds')
+    load.add_argument('--seed', type=int, default=1)
+    load.add_argument('--endpoint', default='/chat')
+    load.add_argument('--timeout', type=float, default=30)
+    load.add_argument('--server', choices=('inprocess', 'serve'), default='inprocess')
+    load.add_argument('--workers', type=int, default=2, help='with --server serve')
+    load.add_argument('--threads', type=int, default=8, help='with --server serve')
+    load.add_argument('--port', type=int)
+    load.add_argument('--url', help='drive an already running server instead')
+    load.add_argument('--output', help='json file (default: bench_results/)')
+
+    compare = sub.add_parser('compare', help='compare two saved runs')
+    compare.add_argument('old')
+    compare.add_argument('new')
+
+    args = parser.parse_args(argv)
+    {'micro': run_micro, 'load': run_load, 'compare': run_compare}[args.command](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,404 @@
+"""
+fdc index - offline copy of usda fooddata central in a read-only sqlite file
+the importer streams a downloaded bulk dataset (json, or the csv release as a folder
+or zip) in constant memory: foods and their nutrients go to staging tables on disk,
+are pivoted into one row per food with the same fields search_usda returns, and get
+a full text index on the name. the file is built next to the old one and swapped in
+by rename, running workers pick it up on their next lookup.
+
+    python fdc_index.py import FoodData_Central_sr_legacy_food_json_2021-10-28.json
+    python fdc_index.py import FoodData_Central_csv_2024-04-18.zip
+    python fdc_index.py import fdc_sample.json
+    python fdc_index.py search "chicken rice"
+"""
+
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zipfile
+
+from sqlite_db import SQLiteDB
+from usda_cache import MemoryCache, normalize_query
+from usda_client import nutrient_field
+
+
+FIELDS = ('calories', 'protein', 'carbs', 'fat', 'sodium', 'fiber', 'sugar')
+
+# data types worth answering from, best first (the csv release also has lab samples)
+TYPE_RANK = {
+    'foundation_food': 0, 'Foundation': 0,
+    'sr_legacy_food': 1, 'SR Legacy': 1,
+    'survey_fndds_food': 2, 'Survey (FNDDS)': 2,
+    'branded_food': 3, 'Branded': 3
+}
+
+# words of a question that say nothing about which food it is
+QUERY_STOPWORDS = {
+    'nutrition', 'nutritional', 'nutrient', 'nutrients', 'calories', 'calorie', 'kcal', 'info',
+    'information', 'facts', 'how', 'many', 'much', 'in', 'of', 'a', 'an', 'the', 'is', 'are',
+    'what', 'whats', 'does', 'do', 'for', 'about', 'tell', 'me', 'show', 'give', 'and', 'with', 'per',
+    # "is banana healthy", "can diabetics eat durian" - every word must match, so none of these may stay
+    'healthy', 'healthier', 'unhealthy', 'good', 'bad', 'ok', 'okay', 'safe', 'eat', 'eating', 'ate',
+    'can', 'could', 'should', 'i', 'my', 'we', 'you', 'it', 'to', 'or', 'if', 'be', 'there', 'any',
+    'please', 'diet', 'diabetes', 'diabetic', 'diabetics', 'cholesterol', 'hypertension'
+}
+
+SCHEMA = (
+    'CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE staged_foods (fdc_id INTEGER PRIMARY KEY, name TEXT NOT NULL, data_type TEXT)',
+    'CREATE TABLE staged_nutrients (fdc_id INTEGER, field TEXT, value REAL, PRIMARY KEY (fdc_id, field))'
+    ' WITHOUT ROWID',
+    'CREATE TABLE foods (fdc_id INTEGER PRIMARY KEY, name TEXT NOT NULL, data_type TEXT, type_rank INTEGER, '
+    + ', '.join(f'{field} REAL' for field in FIELDS) + ')',
+    "CREATE VIRTUAL TABLE food_names USING fts5(name, content='foods', content_rowid='fdc_id',"
+    " tokenize='porter unicode61')"
+)
+
+BATCH_SIZE = 5000
+
+
+def match_expression(query):
+    """fts5 query for a question - every one of its food words, or None if it has none
+    ("egg tart" must not come back as a raw egg, a partial match is left to the api)"""
+    words = [w for w in normalize_query(query).split() if w not in QUERY_STOPWORDS and len(w) > 1]
+    if not words:
+        return None
+    return ' AND '.join(f'"{w}"' for w in dict.fromkeys(words))
+
+
+class FDCIndex:
+    """name search over an imported index file, None from every lookup while there is none"""
+
+    def __init__(self, path, memory_size=1024, mmap_size=256 * 1024 * 1024, check_interval=2.0):
+        self.path = path
+        self.mmap_size = mmap_size
+        self.check_interval = check_interval
+        self.memory = MemoryCache(memory_size)
+        self.db = None
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._stamp = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _current(self):
+        """db for the file as it is now - reopened (and the memo cleared) after a re-import"""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self.db
+        with self._lock:
+            self._checked_at = now
+            try:
+                st = os.stat(self.path)
+                stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+            except OSError:
+                stamp = None
+            if stamp != self._stamp:
+                self._stamp = stamp
+                self.memory.clear()
+                self.db = SQLiteDB(self.path, readonly=True, mmap_size=self.mmap_size) if stamp else None
+            return self.db
+
+    def available(self):
+        return self._current() is not None
+
+    def search(self, query):
+        """best matching food as search_usda returns it, or None"""
+        db = self._current()
+        if db is None:
+            return None
+        key = normalize_query(query)
+        found, food = self.memory.get(key)
+        if found:
+            return food
+
+        expression = match_expression(query)
+        food = None
+        try:
+            if expression:
+                food = self._best(db, expression)
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"warning: fdc index lookup failed - {e}")
+            return None
+        if food:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.memory.set(key, food, math.inf)
+        return food
+
+    def _best(self, db, expression):
+        # fts5 can stop after the top few by rank, the tie break (data type, shorter name) runs on those
+        rows = db.execute(
+            f"SELECT f.type_rank, length(f.name), m.rank, f.name, {', '.join('f.' + f for f in FIELDS)}"
+            " FROM (SELECT rowid, rank FROM food_names WHERE food_names MATCH ? ORDER BY rank LIMIT 10) m"
+            " JOIN foods f ON f.fdc_id = m.rowid",
+            (expression,)
+        ).fetchall()
+        if not rows:
+            return None
+        best = min(rows, key=lambda r: (r[2], r[0], r[1]))
+        nutrients = {field: value for field, value in zip(FIELDS, best[4:]) if value is not None}
+        return {'name': best[3], **nutrients, 'source': 'USDA'}
+
+    def info(self):
+        db = self._current()
+        if db is None:
+            return None
+        try:
+            return dict(db.execute('SELECT key, value FROM meta').fetchall())
+        except sqlite3.Error:
+            return None
+
+    def stats(self):
+        info = self.info()
+        return {
+            'path': self.path,
+            'available': info is not None,
+            'foods': int(info['foods']) if info else 0,
+            'imported_at': info.get('imported_at') if info else None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'memory': self.memory.stats()
+        }
+
+
+# streaming readers - each yields (fdc_id, name, data_type, {field: value})
+
+def iter_json_array(stream, chunk_size=1 << 16):
+    """objects of the first json array in the stream, one at a time
+    ({"SRLegacyFoods": [...]} or a bare [...]), memory bounded by the largest object"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    while '[' not in buffer:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        buffer += chunk
+    buffer = buffer[buffer.index('[') + 1:]
+    while True:
+        buffer = buffer.lstrip(' \t\r\n,')
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer) if buffer else (None, 0)
+        except ValueError:
+            end = 0
+        if not end:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                if buffer:
+                    raise ValueError('fdc json ends in the middle of a food')
+                return
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+
+def food_from_json(item):
+    """(fdc_id, name, data_type, nutrients) from a bulk download record (or an api search hit)"""
+    nutrients = {}
+    for n in item.get('foodNutrients', []):
+        nutrient = n.get('nutrient') or {}
+        name = nutrient.get('name') or n.get('nutrientName', '')
+        unit = nutrient.get('unitName') or n.get('unitName', '')
+        value = n.get('amount', n.get('value'))
+        field = nutrient_field(name)
+        # energy is listed in kcal and in kJ
+        if field and value is not None and not (field == 'calories' and unit.lower() == 'kj'):
+            nutrients[field] = value
+    return item.get('fdcId'), item.get('description'), item.get('dataType'), nutrients
+
+
+def read_json(stream):
+    for item in iter_json_array(stream):
+        if isinstance(item, dict):
+            yield food_from_json(item)
+
+
+def read_csv(open_member):
+    """the csv release: nutrient.csv (small) is read first, food.csv and food_nutrient.csv
+    are streamed straight into the staging tables by the caller, never held in memory"""
+    with open_member('nutrient.csv') as f:
+        fields = {}
+        for row in csv.DictReader(f):
+            field = nutrient_field(row.get('name', ''))
+            if field and not (field == 'calories' and row.get('unit_name', '').lower() == 'kj'):
+                fields[row['id']] = field
+
+    def foods():
+        with open_member('food.csv') as f:
+            for row in csv.DictReader(f):
+                yield row['fdc_id'], row['description'], row['data_type']
+
+    def nutrients():
+        with open_member('food_nutrient.csv') as f:
+            for row in csv.DictReader(f):
+                field = fields.get(row['nutrient_id'])
+                if field and row.get('amount') not in (None, ''):
+                    yield row['fdc_id'], field, row['amount']
+
+    return foods(), nutrients()
+
+
+def csv_opener(path):
+    """open_member(name) for a csv release folder or zip (files may sit in a subfolder)"""
+    if os.path.isdir(path):
+        def open_member(name):
+            for root, _, files in os.walk(path):
+                if name in files:
+                    return open(os.path.join(root, name), 'r', encoding='utf-8', newline='')
+            raise FileNotFoundError(f"{name} not found in {path}")
+        return open_member
+
+    archive = zipfile.ZipFile(path)
+
+    def open_member(name):
+        for member in archive.namelist():
+            if member.rsplit('/', 1)[-1] == name:
+                return io.TextIOWrapper(archive.open(member), encoding='utf-8', newline='')
+        raise FileNotFoundError(f"{name} not found in {path}")
+    return open_member
+
+
+def open_json(path):
+    if not zipfile.is_zipfile(path):
+        return open(path, 'r', encoding='utf-8')
+    archive = zipfile.ZipFile(path)
+    member = next(m for m in archive.namelist() if m.endswith('.json'))
+    return io.TextIOWrapper(archive.open(member), encoding='utf-8')
+
+
+def is_csv_release(path):
+    if os.path.isdir(path):
+        return True
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            return any(m.endswith('food_nutrient.csv') for m in archive.namelist())
+    return False
+
+
+def batched(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def build_index(source, out_path):
+    """import a bulk dataset into a new index file at out_path, returns the number of foods"""
+    tmp_path = out_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path, isolation_level=None)
+    try:
+        # a throwaway file until the rename - no journal, no fsync
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        for statement in SCHEMA:
+            conn.execute(statement)
+
+        add_food = 'INSERT OR REPLACE INTO staged_foods (fdc_id, name, data_type) VALUES (?, ?, ?)'
+        # later rows win, like parse_food does with an api hit
+        add_nutrient = 'INSERT OR REPLACE INTO staged_nutrients (fdc_id, field, value) VALUES (?, ?, ?)'
+
+        def load(sql, rows):
+            for batch in batched(rows):
+                conn.execute('BEGIN')
+                conn.executemany(sql, batch)
+                conn.execute('COMMIT')
+
+        if is_csv_release(source):
+            foods, nutrients = read_csv(csv_opener(source))
+            load(add_food, (row for row in foods if row[2] in TYPE_RANK))
+            load(add_nutrient, nutrients)
+        else:
+            with open_json(source) as stream:
+                def rows():
+                    for fdc_id, name, data_type, nutrients in read_json(stream):
+                        if fdc_id is None or not name:
+                            continue
+                        yield 'food', (fdc_id, name, data_type)
+                        for field, value in nutrients.items():
+                            yield 'nutrient', (fdc_id, field, value)
+                for batch in batched(rows()):
+                    conn.execute('BEGIN')
+                    conn.executemany(add_food, [r for kind, r in batch if kind == 'food'])
+                    conn.executemany(add_nutrient, [r for kind, r in batch if kind == 'nutrient'])
+                    conn.execute('COMMIT')
+
+        # one row per food that has at least one of our nutrients
+        ranks = ' '.join(f"WHEN '{name}' THEN {rank}" for name, rank in TYPE_RANK.items())
+        pivot = ', '.join(f"MAX(CASE WHEN n.field = '{field}' THEN n.value END)" for field in FIELDS)
+        conn.execute('BEGIN')
+        conn.execute(
+            f"INSERT INTO foods (fdc_id, name, data_type, type_rank, {', '.join(FIELDS)})"
+            f" SELECT f.fdc_id, f.name, f.data_type, CASE f.data_type {ranks} ELSE 9 END, {pivot}"
+            " FROM staged_foods f JOIN staged_nutrients n ON n.fdc_id = f.fdc_id GROUP BY f.fdc_id"
+        )
+        conn.execute("INSERT INTO food_names (food_names) VALUES ('rebuild')")
+        count = conn.execute('SELECT COUNT(*) FROM foods').fetchone()[0]
+        conn.executemany('INSERT INTO meta (key, value) VALUES (?, ?)', [
+            ('source', os.path.basename(os.path.normpath(source))),
+            ('imported_at', time.strftime('%Y-%m-%dT%H:%M:%S')),
+            ('foods', str(count))
+        ])
+        conn.execute('DROP TABLE staged_foods')
+        conn.execute('DROP TABLE staged_nutrients')
+        conn.execute('COMMIT')
+        conn.execute("INSERT INTO food_names (food_names) VALUES ('optimize')")
+        conn.execute('VACUUM')
+    except BaseException:
+        conn.close()
+        os.remove(tmp_path)
+        raise
+    conn.close()
+    os.replace(tmp_path, out_path)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='offline usda fooddata central index')
+    parser.add_argument('--db', default=None, help='index file (default: from config.json)')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    load = sub.add_parser('import', help='build the index from a bulk download (json, csv folder or zip)')
+    load.add_argument('path')
+
+    find = sub.add_parser('search', help='best match for a query')
+    find.add_argument('query')
+
+    args = parser.parse_args(argv)
+    db_path = args.db
+    if db_path is None:
+        with open('config.json', 'r', encoding='utf-8') as f:
+            db_path = json.load(f).get('usda_index', {}).get('path', 'fdc_index.sqlite3')
+
+    if args.command == 'import':
+        started = time.perf_counter()
+        count = build_index(args.path, db_path)
+        print(f"indexed {count} foods into {db_path} in {time.perf_counter() - started:.1f}s")
+    else:
+        index = FDCIndex(db_path)
+        if not index.available():
+            sys.exit(f"no index at {db_path} - run: python fdc_index.py import <download>")
+        print(json.dumps(index.search(args.query), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+food search - inverted index over food names and aliases
+finds the best matching dish for a message without scanning every food
+"""
+
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# local spellings folded to one form before indexing and searching
+SPELLING_VARIANTS = {
+    'kuey': 'kway', 'kuay': 'kway', 'kwey': 'kway',
+    'teoh': 'teow', 'tiao': 'teow', 'tiaw': 'teow',
+    'paratha': 'prata', 'parata': 'prata',
+    'chili': 'chilli', 'chilly': 'chilli',
+    'wanton': 'wonton', 'wantan': 'wonton',
+    'bah': 'bak', 'huey': 'huay', 'fu': 'foo',
+    'kachang': 'kacang', 'ais': 'ice',
+    'loh': 'lor', 'mi': 'mee', 'sate': 'satay',
+    'martabak': 'murtabak', 'kuih': 'kueh'
+}
+
+DEFAULT_MIN_SCORE = 0.6
+DEFAULT_MIN_SIMILARITY = 0.75
+
+# only the tokens sharing the most trigrams get the (slower) edit distance check
+MAX_FUZZY_CANDIDATES = 50
+
+
+def tokenize(text):
+    """lowercase word tokens with spelling variants folded"""
+    return [SPELLING_VARIANTS.get(t, t) for t in TOKEN_RE.findall(text.lower())]
+
+
+def trigrams(token):
+    """character trigrams of a token, padded so short words still get some"""
+    padded = f" {token} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def edit_distance(a, b, limit):
+    """damerau-levenshtein (adjacent swaps count as one edit), gives up past limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class FoodIndex:
+    """token index over names/aliases plus a trigram index over the vocabulary for typos"""
+
+    def __init__(self, foods, min_score=DEFAULT_MIN_SCORE, min_similarity=DEFAULT_MIN_SIMILARITY):
+        self.min_score = min_score
+        self.min_similarity = min_similarity
+        self.items = []
+        # one entry per name or alias: (item id, name tokens)
+        self._names = []
+        self._postings = defaultdict(set)
+        self._gram_postings = defaultdict(set)
+
+        for item in foods:
+            item_id = len(self.items)
+            self.items.append(item)
+            for name in [item.get('name', '')] + list(item.get('aliases', ())):
+                tokens = tuple(tokenize(name))
+                if not tokens:
+                    continue
+                name_id = len(self._names)
+                self._names.append((item_id, tokens))
+                for token in tokens:
+                    self._postings[token].add(name_id)
+
+        for token in self._postings:
+            for gram in trigrams(token):
+                self._gram_postings[gram].add(token)
+
+        # rare tokens ("laksa") say more about the dish than common ones ("rice")
+        total = max(len(self._names), 1)
+        self._idf = {t: math.log(1 + total / len(ids)) for t, ids in self._postings.items()}
+
+        # same words come up in every request ("nutrition", "calories"), index is immutable
+        self._expand = lru_cache(maxsize=4096)(self._expand_token)
+
+    def __len__(self):
+        return len(self.items)
+
+    def _expand_token(self, token):
+        """vocabulary tokens close to this one, as ((token, similarity), ...)"""
+        if token in self._postings:
+            return ((token, 1.0),)
+        if len(token) < 4:
+            return ()
+
+        # trigrams narrow the vocabulary down, edit distance decides
+        shared = Counter()
+        for gram in trigrams(token):
+            shared.update(self._gram_postings.get(gram, ()))
+
+        close = []
+        for candidate, _ in shared.most_common(MAX_FUZZY_CANDIDATES):
+            longest = max(len(token), len(candidate))
+            limit = int(longest * (1 - self.min_similarity))
+            distance = edit_distance(token, candidate, limit)
+            if distance <= limit:
+                close.append((candidate, 1 - distance / longest))
+        return tuple(close)
+
+    def search(self, query, k=5):
+        """top k (score, item) pairs for the query, best first"""
+        query_tokens = tokenize(query)
+        matched = {}
+        for token in query_tokens:
+            for vocab_token, similarity in self._expand(token):
+                if similarity > matched.get(vocab_token, 0):
+                    matched[vocab_token] = similarity
+        if not matched:
+            return []
+
+        candidates = set()
+        for token in matched:
+            candidates.update(self._postings[token])
+
+        query_text = ' ' + ' '.join(query_tokens) + ' '
+        best = {}
+        for name_id in candidates:
+            item_id, tokens = self._names[name_id]
+            weight = sum(self._idf[t] for t in tokens)
+            score = sum(self._idf[t] * matched.get(t, 0) for t in tokens) / weight
+            # exact phrase in the message, then longer (more specific) names win ties
+            phrase = (' ' + ' '.join(tokens) + ' ') in query_text
+            key = (score, phrase, len(tokens))
+            if item_id not in best or key > best[item_id]:
+                best[item_id] = key
+
+        top = heapq.nlargest(k, best.items(), key=lambda pair: (pair[1], -pair[0]))
+        return [(round(key[0], 3), self.items[item_id]) for item_id, key in top]
+
+    def best(self, query):
+        """best matching item, or None if nothing scores high enough"""
+        results = self.search(query, k=1)
+        if results and results[0][0] >= self.min_score:
+            return results[0][1]
+        return None
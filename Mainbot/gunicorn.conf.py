@@ -0,0 +1,42 @@
+"""
+gunicorn settings, read from the "server" section of config.json
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+"""
+
+import gc
+import json
+
+with open('config.json', 'r', encoding='utf-8') as f:
+    CONFIG = json.load(f)
+SERVER_SETTINGS = CONFIG.get('server', {})
+
+bind = SERVER_SETTINGS.get('bind', '127.0.0.1:5000')
+workers = SERVER_SETTINGS.get('workers', 2)
+if workers > 1 and CONFIG.get('sessions', {}).get('backend', 'memory') == 'memory':
+    # memory sessions are per worker, a user's name would only be known to one of them
+    print("warning: memory sessions are per worker, running 1 worker - "
+          "set sessions.backend to 'sqlite' to run more")
+    workers = 1
+threads = SERVER_SETTINGS.get('threads', 8)
+worker_class = 'gthread'
+timeout = SERVER_SETTINGS.get('timeout', 30)
+graceful_timeout = SERVER_SETTINGS.get('graceful_timeout', 30)
+
+# load data files and build the indexes once in the master, workers share them copy-on-write
+preload_app = True
+
+
+def when_ready(server):
+    # keep the gc from touching (and so copying) the preloaded objects in every worker
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from wsgi import start_worker
+    start_worker()
+
+
+def worker_exit(server, worker):
+    from wsgi import stop_worker
+    stop_worker(SERVER_SETTINGS.get('flush_timeout', 5))
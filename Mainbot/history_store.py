@@ -0,0 +1,201 @@
+"""
+history store - structured chat history in sqlite, indexed by user and time
+used as a history writer sink, and as a cli for streaming exports:
+
+    python history_store.py export --user web_user_1 --since 2025-12-01 > chats.jsonl
+    python history_store.py export --unanswered --min-latency 1000
+    python history_store.py import chat_history.txt
+"""
+
+import argparse
+import json
+import re
+import sys
+from datetime import datetime
+
+from sqlite_db import SQLiteDB
+
+
+COLUMNS = ('id', 'ts', 'user_id', 'intent', 'matched', 'message', 'response', 'latency_ms')
+
+# questions the bot had no real answer for
+UNANSWERED = "(intent = 'help' OR (intent IN ('nutrition', 'meal') AND matched IS NULL))"
+
+
+def parse_time(value):
+    """epoch seconds from a number or an iso date/datetime string"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+class HistoryStore:
+    """append-only chats table with (user_id, ts) and (ts) indexes"""
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS chats ('
+        ' id INTEGER PRIMARY KEY, ts REAL NOT NULL, user_id TEXT, intent TEXT,'
+        ' matched TEXT, message TEXT, response TEXT, latency_ms REAL)',
+        'CREATE INDEX IF NOT EXISTS chats_user_ts ON chats (user_id, ts)',
+        'CREATE INDEX IF NOT EXISTS chats_ts ON chats (ts)'
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self.db = SQLiteDB(path, self.SCHEMA)
+        self.rows_written = 0
+
+    def write_batch(self, records):
+        """history writer sink - one transaction per batch"""
+        self.db.executemany(
+            'INSERT INTO chats (ts, user_id, intent, matched, message, response, latency_ms)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(r['ts'], r.get('user_id'), r.get('intent'), r.get('matched'),
+              r.get('message'), r.get('response'), r.get('latency_ms')) for r in records]
+        )
+        self.rows_written += len(records)
+
+    def _where(self, user_id=None, since=None, until=None, intent=None,
+               min_latency_ms=None, unanswered=False):
+        clauses, params = [], []
+        if user_id is not None:
+            clauses.append('user_id = ?')
+            params.append(user_id)
+        if since is not None:
+            clauses.append('ts >= ?')
+            params.append(parse_time(since))
+        if until is not None:
+            clauses.append('ts < ?')
+            params.append(parse_time(until))
+        if intent is not None:
+            clauses.append('intent = ?')
+            params.append(intent)
+        if min_latency_ms is not None:
+            clauses.append('latency_ms >= ?')
+            params.append(min_latency_ms)
+        if unanswered:
+            clauses.append(UNANSWERED)
+        return clauses, params
+
+    def iter_records(self, batch_size=500, **filters):
+        """stream matching records oldest first, constant memory however many there are"""
+        clauses, params = self._where(**filters)
+        # keyset pagination on (ts, id) - walks the (user_id, ts) or (ts) index
+        # and holds no read transaction open between pages
+        last = (float('-inf'), 0)
+        sql = (f"SELECT {', '.join(COLUMNS)} FROM chats"
+               f" WHERE {' AND '.join(clauses + ['(ts, id) > (?, ?)'])} ORDER BY ts, id LIMIT ?")
+        while True:
+            rows = self.db.execute(sql, params + [last[0], last[1], batch_size]).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield dict(zip(COLUMNS, row))
+            last = (rows[-1][1], rows[-1][0])
+
+    def query(self, limit=100, newest_first=True, **filters):
+        """small result sets for the api, newest first by default"""
+        clauses, params = self._where(**filters)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        order = 'DESC' if newest_first else 'ASC'
+        rows = self.db.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM chats {where} ORDER BY ts {order} LIMIT ?",
+            params + [limit]
+        ).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def top_messages(self, since=None, intents=('nutrition', 'meal'), limit=200):
+        """[(message, intent, count)] of the most repeated answered messages, most asked first"""
+        clauses, params = self._where(since=since)
+        clauses.append(f"intent IN ({', '.join('?' * len(intents))})")
+        clauses.append('matched IS NOT NULL')
+        rows = self.db.execute(
+            f"SELECT lower(message), intent, COUNT(*) AS n FROM chats WHERE {' AND '.join(clauses)}"
+            " GROUP BY lower(message), intent ORDER BY n DESC LIMIT ?",
+            params + list(intents) + [limit]
+        ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def stats(self):
+        try:
+            count = self.db.execute('SELECT MAX(id) FROM chats').fetchone()[0] or 0
+        except Exception:
+            count = None
+        return {'rows': count, 'rows_written': self.rows_written}
+
+
+def parse_text_log(lines):
+    """records from the old free-form chat_history.txt format"""
+    record = None
+    for line in lines:
+        line = line.rstrip('\n')
+        if line.startswith('=' * 60):
+            if record:
+                record['response'] = record['response'].strip()
+                yield record
+            record = None
+            continue
+        stamp = re.match(r"^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\]$", line)
+        if stamp and record is None:
+            record = {'ts': datetime.strptime(stamp.group(1), "%Y-%m-%d %H:%M:%S").timestamp(),
+                      'message': '', 'response': ''}
+        elif record is not None and line.startswith('User: ') and not record['response']:
+            record['message'] = line[len('User: '):]
+        elif record is not None and line.startswith('Bot: '):
+            record['response'] = line[len('Bot: '):]
+        elif record is not None and record['response']:
+            record['response'] += '\n' + line
+    if record:
+        record['response'] = record['response'].strip()
+        yield record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='query and export structured chat history')
+    parser.add_argument('--db', default=None, help='history db (default: from config.json)')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    export = sub.add_parser('export', help='stream matching records as json lines')
+    export.add_argument('--user', dest='user_id')
+    export.add_argument('--since', help='epoch seconds or iso date')
+    export.add_argument('--until', help='epoch seconds or iso date')
+    export.add_argument('--intent')
+    export.add_argument('--min-latency', dest='min_latency_ms', type=float, help='milliseconds')
+    export.add_argument('--unanswered', action='store_true', help='only questions without an answer')
+
+    legacy = sub.add_parser('import', help='load an old text chat_history.txt')
+    legacy.add_argument('path')
+
+    args = parser.parse_args(argv)
+    db_path = args.db
+    if db_path is None:
+        with open('config.json', 'r', encoding='utf-8') as f:
+            db_path = json.load(f).get('history_store', {}).get('db_path', 'chat_history.sqlite3')
+    store = HistoryStore(db_path)
+
+    if args.command == 'export':
+        filters = {k: getattr(args, k) for k in ('user_id', 'since', 'until', 'intent', 'min_latency_ms')}
+        for record in store.iter_records(unanswered=args.unanswered, **filters):
+            sys.stdout.write(json.dumps(record, ensure_ascii=False) + '\n')
+    else:
+        batch, total = [], 0
+        with open(args.path, 'r', encoding='utf-8') as f:
+            for record in parse_text_log(f):
+                batch.append(record)
+                if len(batch) >= 1000:
+                    store.write_batch(batch)
+                    total += len(batch)
+                    batch = []
+        if batch:
+            store.write_batch(batch)
+            total += len(batch)
+        print(f"imported {total} records into {db_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""
+history writer - background, batched writes of chat history
+requests only drop a record on a bounded queue, a writer thread hands
+batches to the sinks (the rotating text log, the structured history store)
+"""
+
+import atexit
+import glob
+import gzip
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
+
+import metrics
+
+
+_STOP = object()
+
+FLUSH_SECONDS = metrics.histogram('chatbot_history_flush_seconds', 'time to write one batch, per sink', ['sink'])
+FLUSH_ERRORS = metrics.counter('chatbot_history_flush_errors_total', 'batches a sink failed to write', ['sink'])
+
+
+class HistoryWriter:
+    """queues chat records and flushes them to every sink from a background thread"""
+
+    def __init__(self, sinks, max_queue=10000, batch_size=100, flush_interval=1.0,
+                 overflow='drop', block_timeout=0.5):
+        if overflow not in ('drop', 'block'):
+            raise ValueError(f"overflow must be 'drop' or 'block', not {overflow!r}")
+        self.sinks = list(sinks)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+
+    def start(self):
+        """start the writer thread (again after a fork, since threads don't survive it)"""
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                # entries queued by the parent belong to the parent
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+            self._closed = False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def write(self, record):
+        """queue one record, never touches the disk on the calling thread"""
+        if self._closed:
+            return False
+        if self._thread is None or self._pid != os.getpid():
+            self.start()
+        try:
+            if self.overflow == 'block':
+                self._queue.put(record, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self, timeout=5.0):
+        """flush everything still queued and stop the thread"""
+        if self._closed or self._thread is None or self._pid != os.getpid():
+            return
+        self._closed = True
+        try:
+            # the sentinel has to get in even if the queue is full
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            if stopping:
+                # drain whatever is left
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        for sink in self.sinks:
+            name = type(sink).__name__
+            try:
+                with FLUSH_SECONDS.time(sink=name):
+                    sink.write_batch(batch)
+            except Exception as e:
+                self.errors += 1
+                FLUSH_ERRORS.inc(sink=name)
+                print(f"warning: could not save to history - {e}")
+        self.written += len(batch)
+        self.batches += 1
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'batches': self.batches,
+            'errors': self.errors,
+            'overflow': self.overflow,
+            'sinks': {type(sink).__name__: sink.stats() for sink in self.sinks}
+        }
+
+
+def format_entry(record):
+    """readable text block for one chat record"""
+    timestamp = datetime.fromtimestamp(record['ts']).strftime("%Y-%m-%d %H:%M:%S")
+    return (
+        f"\n{'='*60}\n"
+        f"[{timestamp}]\n"
+        f"User: {record['message']}\n"
+        f"Bot: {record['response']}\n"
+    )
+
+
+class TextLog:
+    """human readable chat_history.txt, rotated by size or by day"""
+
+    def __init__(self, path, rotate='size', max_bytes=10 * 1024 * 1024, backup_count=10, compress=True):
+        if rotate not in (None, 'size', 'daily'):
+            raise ValueError(f"rotate must be 'size', 'daily' or None, not {rotate!r}")
+        self.path = path
+        self.rotate = rotate
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+        self.rotations = 0
+
+    def write_batch(self, records):
+        data = ''.join(format_entry(r) for r in records).encode('utf-8')
+        self._maybe_rotate(len(data))
+        # one append per batch, so entries from several processes don't interleave
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+    def _maybe_rotate(self, incoming):
+        if self.rotate is None:
+            return
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+
+        if self.rotate == 'size':
+            if st.st_size == 0 or st.st_size + incoming <= self.max_bytes:
+                return
+            stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        else:
+            last_write = datetime.fromtimestamp(st.st_mtime).date()
+            if last_write == datetime.now().date():
+                return
+            stamp = last_write.strftime('%Y%m%d')
+
+        base, ext = os.path.splitext(self.path)
+        target = f"{base}.{stamp}{ext}"
+        suffix = 1
+        while os.path.exists(target) or os.path.exists(target + '.gz'):
+            target = f"{base}.{stamp}-{suffix}{ext}"
+            suffix += 1
+        try:
+            os.rename(self.path, target)
+        except FileNotFoundError:
+            # another worker rotated it first
+            return
+        self.rotations += 1
+
+        if self.compress:
+            with open(target, 'rb') as src, gzip.open(target + '.gz', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(target)
+        self._prune_backups(base, ext)
+
+    def _prune_backups(self, base, ext):
+        if not self.backup_count:
+            return
+        backups = glob.glob(f"{glob.escape(base)}.*{ext}") + glob.glob(f"{glob.escape(base)}.*{ext}.gz")
+        backups.sort(key=os.path.getmtime)
+        for old in backups[:-self.backup_count]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {'rotations': self.rotations}
@@ -0,0 +1,139 @@
+"""
+intent router - normalizes a message once and classifies it in one pass
+keywords and phrases of every intent are compiled into a single lookup table,
+so the per-message cost depends on message length, not on how many intents exist
+"""
+
+import re
+
+
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+
+class Message:
+    """a user message, lowercased and tokenized once"""
+
+    __slots__ = ('raw', 'text', 'tokens')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.text = raw.lower().strip()
+        self.tokens = tuple(t.strip("'") for t in TOKEN_RE.findall(self.text) if t.strip("'"))
+
+
+def normalize(message):
+    """Message from a string (or the same Message if already normalized)"""
+    return message if isinstance(message, Message) else Message(message)
+
+
+class Route:
+    """classifier output - matched intents plus extracted entities"""
+
+    __slots__ = ('intents', 'entities')
+
+    def __init__(self, intents, entities):
+        self.intents = intents
+        self.entities = entities
+
+    def __repr__(self):
+        return f"Route(intents={self.intents}, entities={self.entities})"
+
+
+class _Intent:
+    __slots__ = ('name', 'priority', 'handler', 'when')
+
+    def __init__(self, name, priority, handler, when):
+        self.name = name
+        self.priority = priority
+        self.handler = handler
+        self.when = when
+
+
+class IntentRouter:
+    """registry of intents and their handlers, with a compiled keyword table"""
+
+    def __init__(self, fallback='help'):
+        self.fallback = fallback
+        self._intents = {}
+        # token -> {intent: weak}, (token, token, ...) -> {intent: weak}
+        self._tokens = {}
+        self._phrases = {}
+        self._openers = {}
+        self._max_phrase = 1
+        self._extractors = []
+
+    def register(self, name, priority, keywords=(), phrases=(), weak=(), openers=(), when=None):
+        """add an intent - lower priority number wins when several match
+        keywords/phrases match anywhere, openers only at the start of the message,
+        weak keywords only count if no normal keyword of any intent matched,
+        when(ctx) can veto the intent based on user state"""
+        self._intents[name] = _Intent(name, priority, None, when)
+        for keyword in keywords:
+            self._add(keyword, name, False, self._tokens, self._phrases)
+        for phrase in phrases:
+            self._add(phrase, name, False, self._tokens, self._phrases)
+        for keyword in weak:
+            self._add(keyword, name, True, self._tokens, self._phrases)
+        for opener in openers:
+            self._add(opener, name, False, self._openers, self._openers)
+
+    def _add(self, text, name, weak, tokens, phrases):
+        key = tuple(Message(text).tokens)
+        self._max_phrase = max(self._max_phrase, len(key))
+        table = tokens if len(key) == 1 else phrases
+        key = key[0] if len(key) == 1 else key
+        table.setdefault(key, {})[name] = weak
+
+    def handler(self, name):
+        """decorator that registers the handler for an intent"""
+        def decorator(func):
+            self._intents[name].handler = func
+            return func
+        return decorator
+
+    def extractor(self, func):
+        """decorator for entity extractors, func(msg, entities, intents) -> None"""
+        self._extractors.append(func)
+        return func
+
+    def classify(self, message):
+        """Route for a message - one pass over its tokens"""
+        msg = normalize(message)
+        tokens = msg.tokens
+        strong, weak = set(), set()
+
+        for i, token in enumerate(tokens):
+            for name, is_weak in self._tokens.get(token, {}).items():
+                (weak if is_weak else strong).add(name)
+            for n in range(2, min(self._max_phrase, len(tokens) - i) + 1):
+                for name, is_weak in self._phrases.get(tokens[i:i + n], {}).items():
+                    (weak if is_weak else strong).add(name)
+
+        for n in range(1, min(self._max_phrase, len(tokens)) + 1):
+            key = tokens[0] if n == 1 else tokens[:n]
+            strong.update(self._openers.get(key, ()))
+
+        entities = {}
+        for extract in self._extractors:
+            extract(msg, entities, strong)
+
+        # weak keywords ("healthy") only decide when nothing else matched
+        return Route(strong if strong else weak, entities)
+
+    def resolve(self, route, ctx):
+        """name of the intent dispatch would run, without running it"""
+        candidates = sorted((self._intents[name] for name in route.intents if name in self._intents),
+                            key=lambda intent: intent.priority)
+        for intent in candidates:
+            if intent.handler is None:
+                continue
+            if intent.when is not None and not intent.when(ctx):
+                continue
+            return intent.name
+        return self.fallback
+
+    def dispatch(self, route, ctx):
+        """run the highest priority intent that accepts this context"""
+        intent = self._intents[self.resolve(route, ctx)]
+        ctx.meta['intent'] = intent.name
+        return intent.handler(ctx)
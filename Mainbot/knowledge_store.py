@@ -0,0 +1,207 @@
+"""
+knowledge store - loads foods, myths, swaps (and config.json) once and keeps them in memory
+the files are polled in the background and reloaded when they change
+"""
+
+import json
+import os
+import threading
+import time
+from types import MappingProxyType
+
+import metrics
+
+
+RELOAD_SECONDS = metrics.histogram('chatbot_data_reload_seconds',
+                                   'time to parse the data files and rebuild derived indexes')
+RELOAD_ERRORS = metrics.counter('chatbot_data_reload_errors_total', 'background reloads that failed')
+
+
+# read from file
+def read_from_file(filename):
+    """read json lines from text file, skip comments and handle errors"""
+    try:
+        # make file if not there
+        if not os.path.exists(filename):
+            return []
+
+        with open(filename, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+            data = []
+
+            for line_num, line in enumerate(lines, 1):
+                line = line.strip()
+
+                # skip empty lines and comment lines (starting with #)
+                if not line or line.startswith('#'):
+                    continue
+
+                try:
+                    # try to parse as json
+                    item = json.loads(line)
+                    data.append(item)
+                except json.JSONDecodeError as e:
+                    # print warning but continue
+                    print(f"warning: line {line_num} in {filename} has invalid json - skipping")
+                    continue
+
+            return data
+    except FileNotFoundError:
+        return []
+    except Exception as e:
+        print(f"error reading file {filename}: {e}")
+        return []
+
+
+def freeze(value):
+    """turn parsed json into read-only mappings and tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def file_stamp(filename):
+    """(mtime, size) of a file, or None if it is missing"""
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class Snapshot:
+    """one consistent, read-only version of all the datasets"""
+
+    __slots__ = ('version', 'foods', 'myths', 'swaps', 'config', 'stamps', 'loaded_at', 'derived')
+
+    def __init__(self, version, foods, myths, swaps, stamps, derived=None, config=None):
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'foods', foods)
+        object.__setattr__(self, 'myths', myths)
+        object.__setattr__(self, 'swaps', swaps)
+        object.__setattr__(self, 'config', config if config is not None else MappingProxyType({}))
+        object.__setattr__(self, 'stamps', stamps)
+        object.__setattr__(self, 'loaded_at', time.time())
+        # indexes built from this exact data, see KnowledgeStore.register
+        object.__setattr__(self, 'derived', MappingProxyType(derived if derived is not None else {}))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('snapshot is read-only')
+
+
+class KnowledgeStore:
+    """holds the current snapshot and swaps it atomically on reload"""
+
+    def __init__(self, files, reload_interval=2.0, config_path=None):
+        self.files = files
+        self.reload_interval = reload_interval
+        self.config_path = config_path
+        self._snapshot = Snapshot(0, MappingProxyType({}), (), (), {})
+        self._builders = {}
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def snapshot(self):
+        """current snapshot - grab it once per request and use it throughout"""
+        return self._snapshot
+
+    def register(self, name, builder):
+        """build snapshot.derived[name] = builder(snapshot) on every (re)load"""
+        self._builders[name] = builder
+        if self._snapshot.version:
+            self.reload(force=True)
+
+    def _watched(self):
+        watched = {key: self.files[key] for key in ('sg_foods', 'myths', 'swaps')}
+        if self.config_path:
+            watched['config'] = self.config_path
+        return watched
+
+    def _load_config(self):
+        """parsed config.json, or the previous one if it is mid-edit / broken"""
+        if not self.config_path:
+            return None
+        try:
+            with open(self.config_path, 'r', encoding='utf-8') as f:
+                return freeze(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"warning: could not reload {self.config_path} - {e}")
+            return self._snapshot.config
+
+    def _build(self, version, stamps):
+        """parse every file into a new snapshot"""
+        watched = self._watched()
+
+        foods = {}
+        for item in read_from_file(watched['sg_foods']):
+            if not isinstance(item, dict) or not item.get('name'):
+                continue
+            # store with lowercase key for case-insensitive matching
+            foods[item['name'].lower()] = freeze(item)
+
+        myths = tuple(freeze(m) for m in read_from_file(watched['myths']) if isinstance(m, dict))
+        swaps = tuple(freeze(s) for s in read_from_file(watched['swaps']) if isinstance(s, dict))
+
+        derived = {}
+        snapshot = Snapshot(version, MappingProxyType(foods), myths, swaps, stamps, derived,
+                            config=self._load_config())
+
+        # builders run in registration order and can use what earlier ones built
+        for name, builder in self._builders.items():
+            derived[name] = builder(snapshot)
+        return snapshot
+
+    def reload(self, force=False):
+        """reload if any file changed since the last load, returns True if it did"""
+        with self._reload_lock:
+            stamps = {key: file_stamp(path) for key, path in self._watched().items()}
+            current = self._snapshot
+            if not force and current.version and stamps == current.stamps:
+                return False
+
+            # build fully before publishing so readers never see a half-loaded state
+            with RELOAD_SECONDS.time():
+                self._snapshot = self._build(current.version + 1, stamps)
+            return True
+
+    def _watch(self):
+        while not self._stop.wait(self.reload_interval):
+            try:
+                if self.reload():
+                    print(f"knowledge store reloaded (version {self._snapshot.version})")
+            except Exception as e:
+                # keep serving the old snapshot
+                RELOAD_ERRORS.inc()
+                print(f"warning: knowledge store reload failed - {e}")
+
+    def start(self):
+        """start the background file watcher (safe to call again, eg after a fork)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        if self.reload_interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name='knowledge-store', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """stop the background file watcher"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.reload_interval + 1)
+            self._thread = None
+
+    def stats(self):
+        snap = self._snapshot
+        return {
+            'version': snap.version,
+            'loaded_at': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(snap.loaded_at)),
+            'foods': len(snap.foods),
+            'myths': len(snap.myths),
+            'swaps': len(snap.swaps)
+        }
+
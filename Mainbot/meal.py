@@ -0,0 +1,141 @@
+"""
+meal - a message naming several dishes ("chicken rice, teh tarik and kaya toast")
+split into one lookup per dish, and the nutrients of the found ones added up
+"""
+
+import re
+
+from intent_router import Message
+from nutrient_table import COLUMNS
+
+
+# commas and joining words separate dishes, except inside dish names that have one
+# ("mac and cheese", "sweet and sour pork")
+SEPARATOR_RE = re.compile(r"\s*[,;+/\n]\s*")
+JOINERS = {'and', 'with', 'plus', 'then'}
+COMPOUND_PHRASES = (
+    ('mac', 'and', 'cheese'), ('macaroni', 'and', 'cheese'), ('sweet', 'and', 'sour'),
+    ('fish', 'and', 'chips'), ('fish', 'and', 'chip'), ('salt', 'and', 'pepper'),
+    ('bread', 'and', 'butter'), ('peanut', 'butter', 'and', 'jelly'), ('bangers', 'and', 'mash'),
+    ('pie', 'and', 'mash'), ('surf', 'and', 'turf'), ('pork', 'and', 'beans'), ('ham', 'and', 'cheese'),
+    ('chicken', 'and', 'waffles'), ('rice', 'and', 'peas'), ('steak', 'and', 'kidney'),
+    ('cookies', 'and', 'cream'), ('strawberries', 'and', 'cream'), ('hot', 'and', 'sour')
+)
+
+# words around the dish names ("nutrition for", "i had", "in total")
+FILLER_WORDS = {
+    'nutrition', 'nutritional', 'nutrient', 'nutrients', 'info', 'information', 'facts', 'breakdown',
+    'for', 'of', 'in', 'the', 'my', 'i', 'me', 'we', 'had', 'ate', 'eat', 'eating', 'have', 'having',
+    'what', 'whats', 'is', 'are', 'was', 'were', 'how', 'many', 'much', 'total', 'totals', 'altogether',
+    'together', 'combined', 'meal', 'lunch', 'dinner', 'breakfast', 'supper', 'today', 'please', 'tell',
+    'show', 'give', 'about', 'also', 'some', 'there', 'just', 'so', 'far', 'this', 'that',
+    # nutrient names, not adjectives like "sweet" that belong to dishes
+    'calories', 'calorie', 'kcal', 'cals', 'sodium', 'sugar', 'sugars', 'fat', 'fats', 'fiber', 'fibre',
+    'protein', 'proteins', 'carbs', 'carb', 'carbohydrate', 'carbohydrates'
+}
+
+NUMBER_WORDS = {'a': 1, 'an': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6,
+                'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'half': 0.5}
+UNIT_WORDS = {'plate', 'plates', 'bowl', 'bowls', 'cup', 'cups', 'glass', 'glasses', 'serving', 'servings',
+              'portion', 'portions', 'piece', 'pieces', 'pc', 'pcs', 'slice', 'slices', 'packet', 'packets',
+              'packs', 'pack', 'order', 'orders'}
+
+MAX_DISHES = 10
+
+
+class MealItem:
+    """one dish of a meal - the words to look up and how many servings"""
+
+    __slots__ = ('query', 'quantity')
+
+    def __init__(self, query, quantity=1):
+        self.query = query
+        self.quantity = quantity
+
+    def __repr__(self):
+        return f"MealItem({self.query!r}, {self.quantity})"
+
+
+def parse_item(tokens):
+    """MealItem from the words of one segment, None if only filler is left"""
+    quantity = None
+    words = []
+    for token in tokens:
+        if quantity is None and not words:
+            if token.isdigit() and 0 < int(token) <= 20:
+                quantity = int(token)
+                continue
+            if token in NUMBER_WORDS:
+                quantity = NUMBER_WORDS[token]
+                continue
+        if token in UNIT_WORDS and not words:
+            continue
+        if token not in FILLER_WORDS:
+            words.append(token)
+    if not words:
+        return None
+    return MealItem(' '.join(words), quantity or 1)
+
+
+def compound_joiners(tokens):
+    """positions of joining words that are part of a dish name"""
+    kept = set()
+    for phrase in COMPOUND_PHRASES:
+        size = len(phrase)
+        for i in range(len(tokens) - size + 1):
+            if tuple(tokens[i:i + size]) == phrase:
+                kept.update(i + j for j, word in enumerate(phrase) if word in JOINERS)
+    return kept
+
+
+def split_segment(segment, resolve=None):
+    """MealItems for one comma-separated segment, split on "and"/"with" unless the joining
+    word is part of a dish name - a known compound, or the name of the food the whole
+    segment resolves to (resolve(query) -> food or None). a part nothing knows stays a
+    dish of its own, for usda to look up"""
+    tokens = Message(segment.replace('&', ' and ')).tokens
+    whole = parse_item(tokens)
+    if whole is None:
+        return []
+    kept = compound_joiners(tokens)
+    groups = [[]]
+    for i, token in enumerate(tokens):
+        if token in JOINERS and i not in kept:
+            groups.append([])
+        else:
+            groups[-1].append(token)
+    parts = [item for item in map(parse_item, groups) if item]
+    if len(parts) < 2:
+        return parts or [whole]
+    if resolve is not None:
+        # a search finds the first dish inside a longer text, so only an exact name counts
+        food = resolve(whole.query)
+        if food and whole.query in {' '.join(Message(name).tokens) for name in food_names(food)}:
+            return [whole]
+    return parts
+
+
+def food_names(food):
+    return (food.get('name') or '',) + tuple(food.get('aliases', ()))
+
+
+def split_dishes(text, limit=MAX_DISHES, resolve=None):
+    """MealItems for the dishes in a message, repeats merged, at most limit of them"""
+    items = {}
+    for item in (item for segment in SEPARATOR_RE.split(text) for item in split_segment(segment, resolve)):
+        if item.query in items:
+            items[item.query].quantity += item.quantity
+        elif len(items) < limit:
+            items[item.query] = item
+    return list(items.values())
+
+
+def meal_totals(found):
+    """{column: total} over (MealItem, food) pairs, a missing value counts as 0"""
+    totals = dict.fromkeys(COLUMNS, 0.0)
+    for item, food in found:
+        for column in COLUMNS:
+            value = food.get(column)
+            if isinstance(value, (int, float)):
+                totals[column] += value * item.quantity
+    return totals
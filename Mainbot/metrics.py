@@ -0,0 +1,253 @@
+"""
+metrics - counters, gauges and latency histograms in prometheus text format,
+plus a profiler that can be switched on at runtime for a fraction of requests
+modules define their metrics at import time and update them on the hot path,
+which costs a perf_counter() call and a short lock per observation
+"""
+
+import bisect
+import cProfile
+import io
+import math
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+
+# seconds - from a cached lookup (~10us) to a usda call at its deadline
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    """monotonically increasing count per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        lines = self.header()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}")
+        return lines
+
+
+class Gauge(Metric):
+    """current value, read from a function at scrape time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, func):
+        super().__init__(name, documentation)
+        self.func = func
+
+    def render(self):
+        try:
+            value = self.func()
+        except Exception:
+            return []
+        if value is None:
+            return []
+        return self.header() + [f"{self.name} {format_value(value)}"]
+
+
+class Histogram(Metric):
+    """cumulative buckets, sum and count per label set"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+inf last), sum]
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """observe how long the with block took"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        series = self._series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._series.items())
+        for key, (counts, total) in items:
+            running = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                running += count
+                le = format_labels(self.labelnames, key, [('le', format_value(bound))])
+                lines.append(f"{self.name}_bucket{le} {running}")
+            labels = format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {running}")
+        return lines
+
+
+class Registry:
+    """all metrics of this process, by name"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_add(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"metric {name} already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_add(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_add(Histogram, name, documentation, labelnames, buckets)
+
+    def gauge(self, name, documentation, func):
+        """gauge whose value is func() at scrape time (replaces an earlier one of that name)"""
+        with self._lock:
+            metric = self._metrics[name] = Gauge(name, documentation, func)
+            return metric
+
+    def render(self):
+        """prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = [
+            '# HELP process_pid worker process answering this scrape (metrics are per process)',
+            '# TYPE process_pid gauge',
+            f'process_pid {os.getpid()}'
+        ]
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+gauge = REGISTRY.gauge
+
+
+class RequestProfiler:
+    """cProfile for a random fraction of requests, results merged until reset
+    off (rate 0) it costs one float comparison per request"""
+
+    def __init__(self, rate=0.0):
+        self.rate = rate
+        self.sampled = 0
+        self.skipped = 0
+        self._stats = None
+        self._lock = threading.Lock()
+
+    def configure(self, rate):
+        self.rate = max(0.0, min(1.0, float(rate)))
+
+    def reset(self):
+        with self._lock:
+            self._stats = None
+            self.sampled = 0
+            self.skipped = 0
+
+    @contextmanager
+    def maybe_profile(self):
+        if not self.rate or random.random() >= self.rate:
+            yield
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is already running on this interpreter
+            self.skipped += 1
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+                self.sampled += 1
+
+    def report(self, limit=30, sort='cumulative'):
+        """top functions of the merged samples as text"""
+        with self._lock:
+            if self._stats is None:
+                return f"no profiled requests yet (rate {self.rate})\n"
+            out = io.StringIO()
+            self._stats.stream = out
+            self._stats.sort_stats(sort).print_stats(limit)
+        return f"{self.sampled} profiled requests (rate {self.rate})\n" + out.getvalue()
+
+    def stats(self):
+        return {'rate': self.rate, 'sampled': self.sampled, 'skipped': self.skipped}
@@ -0,0 +1,86 @@
+"""
+myth matcher - aho-corasick automaton over every myth keyword
+finds all keyword hits in one pass over the message, however many myths there are
+"""
+
+from collections import deque
+
+
+class MythMatcher:
+    """compiled keyword automaton, rebuilt only when myths.txt changes"""
+
+    def __init__(self, myths):
+        self.myths = list(myths)
+        # goto[state] = {char: next state}, out[state] = [(keyword, myth id), ...]
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+
+        for myth_id, myth in enumerate(self.myths):
+            for keyword in myth.get('keywords', ()):
+                keyword = keyword.lower().strip()
+                if keyword:
+                    self._add(keyword, myth_id)
+        self._link()
+
+    def __len__(self):
+        return len(self.myths)
+
+    def _add(self, keyword, myth_id):
+        state = 0
+        for char in keyword:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((keyword, myth_id))
+
+    def _link(self):
+        """breadth first pass to set failure links and merge outputs"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find_all(self, text):
+        """every (start, keyword, myth id) hit, keywords must start on a word boundary"""
+        text = text.lower()
+        hits = []
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for keyword, myth_id in self._out[state]:
+                start = i - len(keyword) + 1
+                if start == 0 or not text[start - 1].isalnum():
+                    hits.append((start, keyword, myth_id))
+        return hits
+
+    def search(self, text):
+        """matching myths, most specific first"""
+        matched = {}
+        for start, keyword, myth_id in self.find_all(text):
+            longest, keywords = matched.get(myth_id, (0, set()))
+            keywords.add(keyword)
+            matched[myth_id] = (max(longest, len(keyword)), keywords)
+
+        # longest keyword wins, then most distinct keywords, then file order
+        ranked = sorted(matched.items(), key=lambda pair: (-pair[1][0], -len(pair[1][1]), pair[0]))
+        return [self.myths[myth_id] for myth_id, _ in ranked]
+
+    def best(self, text):
+        """most specific matching myth, or None"""
+        results = self.search(text)
+        return results[0] if results else None
@@ -0,0 +1,240 @@
+"""
+nutrient table - the food database as columns of floats instead of per-food dicts
+every column also keeps its row indexes sorted by value, so a range filter is two
+bisects and a slice, several filters scan only the narrowest range, and top-k is a
+heap over the matches (or just the first k of the order when nothing is filtered).
+parse_food_query turns "low sodium dishes under 500 kcal" into a query on it.
+"""
+
+import heapq
+import math
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+COLUMNS = ('calories', 'protein', 'carbs', 'fat', 'sodium', 'fiber', 'sugar')
+
+UNITS = {'calories': ' kcal', 'sodium': 'mg'}
+
+
+def amount(column, value):
+    """"500 kcal", "600mg", "4g" """
+    return f"{value:g}{UNITS.get(column, 'g')}"
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class NutrientTable:
+    """column-oriented copy of the foods, rows in the order they were given"""
+
+    def __init__(self, foods):
+        self.items = tuple(foods)
+        self.columns = {}
+        self._order = {}
+        self._sorted = {}
+        for name in COLUMNS:
+            values = array('d', (to_float(food.get(name)) for food in self.items))
+            # foods without this nutrient can't match a filter or ranking on it
+            order = sorted((i for i, v in enumerate(values) if not math.isnan(v)), key=values.__getitem__)
+            self.columns[name] = values
+            self._order[name] = array('l', order)
+            self._sorted[name] = array('d', (values[i] for i in order))
+
+    def __len__(self):
+        return len(self.items)
+
+    def range(self, name, lo=None, hi=None):
+        """row indexes with lo <= value <= hi (either bound optional), in value order"""
+        values = self._sorted[name]
+        start = 0 if lo is None else bisect_left(values, lo)
+        end = len(values) if hi is None else bisect_right(values, hi)
+        return self._order[name][start:end]
+
+    def select(self, where):
+        """row indexes matching every {column: (lo, hi)} range"""
+        if not where:
+            return range(len(self.items))
+        # scan the narrowest range, check the others on the columns directly
+        ranges = sorted(((self.range(name, lo, hi), name) for name, (lo, hi) in where.items()),
+                        key=lambda r: len(r[0]))
+        rows, _ = ranges[0]
+        checks = [(self.columns[name], lo, hi) for name, (lo, hi) in where.items() if name != ranges[0][1]]
+        if not checks:
+            return rows
+        return [i for i in rows
+                if all((lo is None or col[i] >= lo) and (hi is None or col[i] <= hi) for col, lo, hi in checks)]
+
+    def top(self, where=None, order_by='calories', descending=False, k=5):
+        """up to k foods matching where, ranked by order_by"""
+        if not where:
+            # no filter: the first k rows of the sorted order
+            order = self._order[order_by]
+            rows = order[::-1][:k] if descending else order[:k]
+            return [self.items[i] for i in rows]
+
+        rows = self.select(where)
+        column = self.columns[order_by]
+        rows = [i for i in rows if not math.isnan(column[i])]
+        pick = heapq.nlargest if descending else heapq.nsmallest
+        return [self.items[i] for i in pick(k, rows, key=column.__getitem__)]
+
+    def count(self, where=None):
+        return len(self.select(where))
+
+
+NUTRIENT_WORDS = {
+    'calories': 'calories', 'calorie': 'calories', 'kcal': 'calories', 'cal': 'calories', 'cals': 'calories',
+    'energy': 'calories',
+    'sodium': 'sodium', 'salt': 'sodium', 'salty': 'sodium',
+    'sugar': 'sugar', 'sugars': 'sugar', 'sugary': 'sugar', 'sweet': 'sugar',
+    'fat': 'fat', 'fats': 'fat', 'fatty': 'fat', 'oily': 'fat',
+    'fiber': 'fiber', 'fibre': 'fiber',
+    'protein': 'protein', 'proteins': 'protein',
+    'carbs': 'carbs', 'carb': 'carbs', 'carbohydrate': 'carbs', 'carbohydrates': 'carbs'
+}
+
+LOW_WORDS = {'low', 'lower', 'less', 'reduced', 'light'}
+HIGH_WORDS = {'high', 'higher', 'more', 'rich', 'lots'}
+MOST_WORDS = {'highest', 'most', 'max', 'maximum', 'top'}
+LEAST_WORDS = {'lowest', 'least', 'min', 'minimum', 'fewest'}
+BELOW_WORDS = {'under', 'below', 'max', 'maximum', 'within', 'upto', '<'}
+ABOVE_WORDS = {'over', 'above', 'min', 'minimum', '>'}
+# "less than", "at most" ... folded into one token before parsing
+COMPARATOR_PHRASES = {('less', 'than'): 'under', ('fewer', 'than'): 'under', ('at', 'most'): 'under',
+                      ('up', 'to'): 'under', ('more', 'than'): 'over', ('at', 'least'): 'over',
+                      ('greater', 'than'): 'over'}
+
+# health condition -> (column kept under its dish limit, column to rank by, descending)
+CONDITION_PROFILES = {
+    'diabetes': ('sugar', 'fiber', True),
+    'blood_pressure': ('sodium', 'sodium', False),
+    'cholesterol': ('fat', 'fat', False),
+    'weight': ('calories', 'calories', False)
+}
+CONDITION_WORDS = {
+    'diabetes': 'diabetes', 'diabetic': 'diabetes', 'diabetics': 'diabetes',
+    'hypertension': 'blood_pressure', 'bp': 'blood_pressure', 'pressure': 'blood_pressure',
+    'cholesterol': 'cholesterol', 'ldl': 'cholesterol',
+    'weight': 'weight', 'slimming': 'weight'
+}
+
+NUMBER_RE = re.compile(r'^(\d+(?:\.\d+)?)([a-z]*)$')
+
+
+class FoodQuery:
+    """parsed recommendation request"""
+
+    __slots__ = ('where', 'order_by', 'descending', 'k', 'condition')
+
+    def __init__(self, where, order_by, descending, k, condition):
+        self.where = where
+        self.order_by = order_by
+        self.descending = descending
+        self.k = k
+        self.condition = condition
+
+    def __repr__(self):
+        return (f"FoodQuery(where={self.where}, order_by={self.order_by!r}, descending={self.descending}, "
+                f"k={self.k}, condition={self.condition!r})")
+
+
+def _fold(tokens):
+    folded, i = [], 0
+    while i < len(tokens):
+        pair = tuple(tokens[i:i + 2])
+        if pair in COMPARATOR_PHRASES:
+            folded.append(COMPARATOR_PHRASES[pair])
+            i += 2
+        else:
+            folded.append(tokens[i])
+            i += 1
+    # "500kcal" -> "500", "kcal"
+    split = []
+    for token in folded:
+        match = NUMBER_RE.match(token)
+        if match and match.group(2):
+            split.extend(match.groups())
+        else:
+            split.append(token)
+    return split
+
+
+def _nutrient_near(tokens, i, previous):
+    """nutrient a number at position i refers to: its unit, the word after it, or the one before"""
+    for j in (i + 1, i + 2):
+        if j < len(tokens) and tokens[j] in NUTRIENT_WORDS:
+            return NUTRIENT_WORDS[tokens[j]]
+        if j < len(tokens) and tokens[j] == 'mg':
+            return 'sodium'
+        if j < len(tokens) and tokens[j] not in ('g', 'grams', 'of'):
+            break
+    return previous
+
+
+def parse_food_query(tokens, dish_limits, dish_targets, default_k=5):
+    """FoodQuery from message tokens, or None if the message asks for no filter or ranking
+    dish_limits ({column: max per dish}) give "low x" its meaning, dish_targets ({column: min}) "high x" """
+    tokens = _fold(list(tokens))
+    where = {}
+    order = None
+    condition = None
+    k = default_k
+    previous = None
+
+    def bound(column, lo=None, hi=None):
+        old_lo, old_hi = where.get(column, (None, None))
+        lo = lo if old_lo is None or (lo is not None and lo > old_lo) else old_lo
+        hi = hi if old_hi is None or (hi is not None and hi < old_hi) else old_hi
+        where[column] = (lo, hi)
+
+    for i, token in enumerate(tokens):
+        after = tokens[i + 1] if i + 1 < len(tokens) else None
+        nutrient = NUTRIENT_WORDS.get(after) if after else None
+
+        if token in NUTRIENT_WORDS:
+            previous = NUTRIENT_WORDS[token]
+        elif token in CONDITION_WORDS and condition is None:
+            condition = CONDITION_WORDS[token]
+
+        if token in LEAST_WORDS and nutrient:
+            order = order or (nutrient, False)
+        elif token in MOST_WORDS and nutrient:
+            order = order or (nutrient, True)
+        elif token in LOW_WORDS and nutrient:
+            if nutrient in dish_limits:
+                bound(nutrient, hi=dish_limits[nutrient])
+            order = order or (nutrient, False)
+        elif token in HIGH_WORDS and nutrient:
+            if nutrient in dish_targets:
+                bound(nutrient, lo=dish_targets[nutrient])
+            order = order or (nutrient, True)
+        elif (token in BELOW_WORDS or token in ABOVE_WORDS) and after and NUMBER_RE.match(after):
+            column = _nutrient_near(tokens, i + 1, previous) or ('calories' if float(after) >= 100 else None)
+            if column:
+                if token in BELOW_WORDS:
+                    bound(column, hi=float(after))
+                else:
+                    bound(column, lo=float(after))
+        elif token == 'top' and after and after.isdigit():
+            k = int(after)
+        elif token.isdigit() and after in ('dishes', 'foods', 'options', 'meals', 'ideas'):
+            k = int(token)
+
+    if condition:
+        limited, ranked, descending = CONDITION_PROFILES[condition]
+        if limited in dish_limits:
+            bound(limited, hi=dish_limits[limited])
+        order = order or (ranked, descending)
+
+    if not where and order is None:
+        return None
+    if order is None:
+        # rank by the first thing they asked to keep low, else calories
+        order = next(((column, False) for column, (lo, hi) in where.items() if hi is not None), ('calories', False))
+    return FoodQuery(where, order[0], order[1], max(1, min(k, 20)), condition)
@@ -0,0 +1,316 @@
+"""
+rate limit - admission control in front of the chat endpoints and the usda api
+token buckets per user id and per client ip turn floods into 429s, and a gate caps
+usda calls in flight so misses past it get a local-only answer instead of a queue.
+memory backend is per process, sqlite backend is one file shared by every worker.
+"""
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlite_db import SQLiteDB
+
+
+class Decision:
+    """outcome of an admission check - retry_after in whole seconds when refused"""
+
+    __slots__ = ('allowed', 'scope', 'retry_after')
+
+    def __init__(self, allowed, scope=None, retry_after=0):
+        self.allowed = allowed
+        self.scope = scope
+        self.retry_after = retry_after
+
+    def __repr__(self):
+        return f"Decision(allowed={self.allowed}, scope={self.scope!r}, retry_after={self.retry_after})"
+
+
+ALLOWED = Decision(True)
+
+
+def wait_for(tokens, cost, rate):
+    """seconds until a bucket holding tokens can pay cost"""
+    return max(1, math.ceil((cost - tokens) / rate)) if rate > 0 else 3600
+
+
+class MemoryBuckets:
+    """token buckets in an lru capped at max_keys - an evicted key starts full again"""
+
+    backend = 'memory'
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def take(self, key, rate, burst, cost=1):
+        """(allowed, retry_after) - cost tokens are taken only if there are enough"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+        return allowed, 0 if allowed else wait_for(tokens, cost, rate)
+
+    def refund(self, key, burst, cost=1):
+        """give back tokens taken for a request that was refused after all"""
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated = self._buckets[key]
+                self._buckets[key] = (min(burst, tokens + cost), updated)
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def stats(self):
+        return {'backend': self.backend, 'keys': len(self._buckets), 'max_keys': self.max_keys,
+                'evictions': self.evictions}
+
+
+class SQLiteBuckets:
+    """token buckets in a shared sqlite file, each take is one atomic upsert"""
+
+    backend = 'sqlite'
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS buckets ('
+        ' key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL) WITHOUT ROWID',
+        'CREATE INDEX IF NOT EXISTS buckets_updated ON buckets (updated)'
+    )
+
+    # refill and spend in one statement, so concurrent workers can't both spend the last token
+    TAKE = (
+        'INSERT INTO buckets (key, tokens, updated) VALUES (:key, :burst - :cost, :now)'
+        ' ON CONFLICT(key) DO UPDATE SET'
+        ' tokens = MIN(:burst, tokens + MAX(0, :now - updated) * :rate) - :cost, updated = :now'
+        ' WHERE MIN(:burst, tokens + MAX(0, :now - updated) * :rate) >= :cost'
+        ' RETURNING tokens'
+    )
+
+    def __init__(self, path, idle_ttl=3600, prune_every=1000, timeout=1.0):
+        # short busy timeout - past it the request is let through rather than held up
+        self.db = SQLiteDB(path, self.SCHEMA, timeout=timeout)
+        self.idle_ttl = idle_ttl
+        self.prune_every = prune_every
+        self.errors = 0
+        self._writes = 0
+
+    def take(self, key, rate, burst, cost=1):
+        now = time.time()
+        try:
+            taken = self.db.execute(self.TAKE, {'key': key, 'rate': rate, 'burst': burst,
+                                                'cost': cost, 'now': now}).fetchall()
+            if taken:
+                self._writes += 1
+                if self._writes % self.prune_every == 0:
+                    self.prune()
+                return True, 0
+            row = self.db.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+        except Exception as e:
+            # a broken limiter must not take the chatbot down with it
+            self.errors += 1
+            print(f"warning: rate limit check failed - {e}")
+            return True, 0
+        tokens = min(burst, row[0] + max(0, now - row[1]) * rate) if row else burst
+        return False, wait_for(tokens, cost, rate)
+
+    def refund(self, key, burst, cost=1):
+        try:
+            self.db.execute('UPDATE buckets SET tokens = MIN(?, tokens + ?) WHERE key = ?', (burst, cost, key))
+        except Exception as e:
+            self.errors += 1
+            print(f"warning: rate limit refund failed - {e}")
+
+    def prune(self):
+        """drop buckets idle long enough to have refilled"""
+        self.db.execute('DELETE FROM buckets WHERE updated < ?', (time.time() - self.idle_ttl,))
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM buckets').fetchone()[0]
+
+    def stats(self):
+        try:
+            keys = len(self)
+        except Exception:
+            keys = None
+        return {'backend': self.backend, 'keys': keys, 'errors': self.errors}
+
+
+class MemoryGate:
+    """at most limit holders at once in this process, acquire never waits"""
+
+    backend = 'memory'
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.refused = 0
+
+    def acquire(self):
+        """a lease, or None if every slot is taken"""
+        with self._lock:
+            if self._in_use >= self.limit:
+                self.refused += 1
+                return None
+            self._in_use += 1
+            self.acquired += 1
+            return True
+
+    def release(self, lease):
+        with self._lock:
+            self._in_use -= 1
+
+    def in_use(self):
+        return self._in_use
+
+    def stats(self):
+        return {'backend': self.backend, 'limit': self.limit, 'in_use': self._in_use,
+                'acquired': self.acquired, 'refused': self.refused}
+
+
+class SQLiteGate:
+    """at most limit holders across every worker - leases expire, so a crashed
+    worker can't keep its slots"""
+
+    backend = 'sqlite'
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS gate_leases (id INTEGER PRIMARY KEY, pid INTEGER, expires_at REAL NOT NULL)',
+    )
+
+    def __init__(self, path, limit, lease_ttl=10.0, prune_every=200, timeout=1.0):
+        self.db = SQLiteDB(path, self.SCHEMA, timeout=timeout)
+        self.limit = limit
+        self.lease_ttl = lease_ttl
+        self.prune_every = prune_every
+        self.errors = 0
+        self.acquired = 0
+        self.refused = 0
+
+    def acquire(self):
+        now = time.time()
+        try:
+            # count and claim in one statement
+            cursor = self.db.execute(
+                'INSERT INTO gate_leases (pid, expires_at)'
+                ' SELECT ?, ? WHERE (SELECT COUNT(*) FROM gate_leases WHERE expires_at > ?) < ?',
+                (os.getpid(), now + self.lease_ttl, now, self.limit)
+            )
+            if cursor.rowcount != 1:
+                self.refused += 1
+                return None
+            self.acquired += 1
+            if self.acquired % self.prune_every == 0:
+                self.db.execute('DELETE FROM gate_leases WHERE expires_at <= ?', (now,))
+            return cursor.lastrowid
+        except Exception as e:
+            self.errors += 1
+            print(f"warning: usda gate failed - {e}")
+            # fail open, 0 is a lease with nothing to release
+            return 0
+
+    def release(self, lease):
+        if not lease:
+            return
+        try:
+            self.db.execute('DELETE FROM gate_leases WHERE id = ?', (lease,))
+        except Exception as e:
+            self.errors += 1
+            print(f"warning: usda gate release failed - {e}")
+
+    def in_use(self):
+        try:
+            return self.db.execute('SELECT COUNT(*) FROM gate_leases WHERE expires_at > ?',
+                                   (time.time(),)).fetchone()[0]
+        except Exception:
+            return None
+
+    def stats(self):
+        return {'backend': self.backend, 'limit': self.limit, 'in_use': self.in_use(),
+                'acquired': self.acquired, 'refused': self.refused, 'errors': self.errors}
+
+
+class RateLimiter:
+    """per ip and per user buckets for requests, plus the gate handed to the usda client"""
+
+    def __init__(self, buckets, gate, user=(2.0, 20), ip=(10.0, 60), enabled=True):
+        self.buckets = buckets
+        self.gate = gate
+        # (tokens per second, burst)
+        self.scopes = {'ip': ip, 'user': user}
+        self.enabled = enabled
+        self.allowed = 0
+        self.limited = dict.fromkeys(self.scopes, 0)
+
+    def check(self, user_id, ip, cost=1):
+        """Decision for a request costing cost messages - the ip is checked first,
+        so a flood of made-up user ids from one client still runs dry"""
+        if not self.enabled:
+            return ALLOWED
+        taken = []
+        for scope, key in (('ip', ip), ('user', user_id)):
+            if not key:
+                continue
+            rate, burst = self.scopes[scope]
+            ok, retry_after = self.buckets.take(f"{scope}:{key}", rate, burst, min(cost, burst))
+            if not ok:
+                # a refused request costs nothing, so the ip isn't drained by one user's 429s
+                for charged_scope, charged_key in taken:
+                    self.refund(charged_scope, charged_key, cost)
+                self.limited[scope] += 1
+                return Decision(False, scope, retry_after)
+            taken.append((scope, key))
+        self.allowed += 1
+        return ALLOWED
+
+    def refund(self, scope, key, cost=1):
+        """give back what check charged one scope, eg the ip's share of a refused message"""
+        if self.enabled and key:
+            burst = self.scopes[scope][1]
+            self.buckets.refund(f"{scope}:{key}", burst, min(cost, burst))
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'backend': self.buckets.backend,
+            'limits': {scope: {'rate': rate, 'burst': burst} for scope, (rate, burst) in self.scopes.items()},
+            'allowed': self.allowed,
+            'limited': dict(self.limited),
+            'buckets': self.buckets.stats(),
+            'usda_gate': self.gate.stats()
+        }
+
+
+def create_rate_limiter(settings, lease_ttl=10.0):
+    """rate limiter for the "rate_limit" section of config.json"""
+    backend = settings.get('backend', 'memory')
+    user = settings.get('user', {})
+    ip = settings.get('ip', {})
+    user = (float(user.get('rate', 2.0)), float(user.get('burst', 20)))
+    ip = (float(ip.get('rate', 10.0)), float(ip.get('burst', 60)))
+    concurrency = settings.get('usda_concurrency', 8)
+    if backend == 'memory':
+        buckets = MemoryBuckets(settings.get('max_keys', 100000))
+        gate = MemoryGate(concurrency)
+    elif backend == 'sqlite':
+        path = settings.get('db_path', 'rate_limits.sqlite3')
+        # a bucket idle this long is full again and can go
+        idle_ttl = max((burst / rate for rate, burst in (user, ip) if rate > 0), default=60)
+        buckets = SQLiteBuckets(path, idle_ttl=max(idle_ttl, 60))
+        gate = SQLiteGate(path, concurrency, lease_ttl)
+    else:
+        raise ValueError(f"unknown rate limit backend {backend!r} (use 'memory' or 'sqlite')")
+    return RateLimiter(buckets, gate, user, ip, settings.get('enabled', True))
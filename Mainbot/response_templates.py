@@ -0,0 +1,106 @@
+"""
+response templates - guideline and swap answers rendered once per data version
+only the name prefix and the closing line are filled in per request
+"""
+
+
+class Template:
+    """pre-rendered body plus the personalization slots"""
+
+    __slots__ = ('body', 'closing')
+
+    def __init__(self, body, closing=''):
+        self.body = body
+        # closing line is only added when we know the user's name
+        self.closing = closing
+
+    def render(self, name_prefix='', user_name=''):
+        if user_name and self.closing:
+            return name_prefix + self.body + self.closing.format(name=user_name)
+        return name_prefix + self.body
+
+
+def swap_lines(swaps):
+    lines = [f"- {swap['unhealthy']} → {swap['healthy']}\n" for swap in swaps]
+    return "\n\nHEALTHY SWAPS:\n" + ''.join(lines) if lines else ''
+
+
+def condition_swaps(snapshot, condition, limit=3):
+    index = snapshot.derived.get('swap_index')
+    if index is not None:
+        return index.for_condition(condition, limit)
+    return [s for s in snapshot.swaps if s.get('category') == condition][:limit]
+
+
+def build_diabetes(snapshot):
+    guide = snapshot.config['hpb_guidelines']['diabetes']
+    body = ''.join([
+        "here are some diabetes management tips based on HPB guidelines:\n\n",
+        "TARGETS:\n",
+        f"- Fasting glucose: {guide['fasting_glucose_normal']}\n",
+        f"- Sugar limit: {guide['sugar_limit']}\n",
+        f"- Daily fiber: {guide['fiber_recommendation']}\n\n",
+        "GOOD CHOICES:\n",
+        "- Fish soup, yong tau foo (more veggies), economic rice\n\n",
+        "AVOID:\n",
+        "- Sugary drinks, fried noodles, white rice in large portions\n",
+        swap_lines(condition_swaps(snapshot, 'diabetes'))
+    ])
+    return Template(body, "\n\nNeed more specific advice, {name}?")
+
+
+def build_blood_pressure(snapshot):
+    guide = snapshot.config['hpb_guidelines']['blood_pressure']
+    body = ''.join([
+        "here's how to manage blood pressure with food:\n\n",
+        f"TARGET: {guide['normal']}\n",
+        f"SODIUM LIMIT: {guide['sodium_limit']}\n\n",
+        "TIPS:\n",
+        "- Ask for 'less salt' or 'no MSG' at hawker centers\n",
+        "- Avoid instant noodles and processed meats\n",
+        "- Choose steamed over fried options\n",
+        swap_lines(condition_swaps(snapshot, 'blood_pressure'))
+    ])
+    return Template(body, "\n\nWant more BP-friendly food tips, {name}?")
+
+
+def build_cholesterol(snapshot):
+    guide = snapshot.config['hpb_guidelines']['cholesterol']
+    body = ''.join([
+        "let's talk about managing cholesterol:\n\n",
+        f"LDL TARGET: {guide['ldl_target']}\n\n",
+        "TIPS:\n",
+        "- Choose grilled/steamed over fried foods\n",
+        "- Use olive oil or canola oil for cooking\n",
+        "- Eat fatty fish (salmon, mackerel) 2x per week\n",
+        "- Limit coconut milk curries\n",
+        swap_lines(condition_swaps(snapshot, 'cholesterol'))
+    ])
+    return Template(body, "\n\nAny other questions about cholesterol, {name}?")
+
+
+def build_swaps(snapshot):
+    lines = ["here are some healthy food swaps you can make:\n\n"]
+    for i, swap in enumerate(snapshot.swaps[:8], 1):
+        lines.append(f"{i}. {swap['unhealthy']} → {swap['healthy']}\n")
+        lines.append(f"   Why? {swap['benefit']}\n\n")
+    return Template(''.join(lines), "Try these out, {name}! Your body will thank you.")
+
+
+BUILDERS = {
+    'diabetes': build_diabetes,
+    'blood_pressure': build_blood_pressure,
+    'cholesterol': build_cholesterol,
+    'swaps': build_swaps
+}
+
+
+class ResponseTemplates:
+    """all static answers for one snapshot - rebuilt by the knowledge store on reload"""
+
+    def __init__(self, snapshot):
+        self.version = snapshot.version
+        self._templates = {name: build(snapshot) for name, build in BUILDERS.items()}
+
+    def render(self, name, name_prefix='', user_name=''):
+        return self._templates[name].render(name_prefix, user_name)
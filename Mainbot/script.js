@@ -19,7 +19,8 @@ async function sendMessage() {
     const typingIndicator = addTypingIndicator();
 
     try { 
-        const response = await fetch('http://127.0.0.1:5000/chat', {
+        // streamed, so slow usda lookups don't hold back the rest of the answer
+        const response = await fetch('http://127.0.0.1:5000/chat/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -30,20 +31,42 @@ async function sendMessage() {
             })
         });
 
+        // rate limited - say so instead of a generic error
+        if (response.status === 429) {
+            const data = await response.json().catch(() => ({}));
+            removeTypingIndicator(typingIndicator);
+            addMaterialMessage(data.response || 'Too many messages - please wait a moment and try again.', 'bot');
+            return;
+        }
+
         // check if response ok
         if (!response.ok) {
             throw new Error(`Server error: ${response.status}`);
         }
 
-        const data = await response.json();
-        
-        // remove typing indicator
+        let botMessage = null;
+        let typing = Promise.resolve();
+        let received = false;
+
+        await readEventStream(response, (event, data) => {
+            if (event === 'part' && data.text) {
+                // first part replaces the typing indicator, later ones are typed after it
+                if (!botMessage) {
+                    removeTypingIndicator(typingIndicator);
+                    botMessage = createBotMessage();
+                }
+                received = true;
+                typing = typing.then(() => typeText(botMessage, data.text));
+            } else if (event === 'error') {
+                throw new Error(data.response || 'Server error');
+            }
+        });
+
         removeTypingIndicator(typingIndicator);
+        await typing;
 
         // check if we got a response
-        if (data.response) {
-            await addBotMessageWithTypingEffect(data.response);
-        } else {
+        if (!received) {
             throw new Error('No response from server');
         }
 
@@ -84,8 +107,41 @@ function addMessageWithAnimation(text, sender) {
     }, 10);
 }
 
+// read a server-sent event stream from a fetch response, onEvent(event, data) per event
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // events are separated by a blank line
+        let end;
+        while ((end = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, end);
+            buffer = buffer.slice(end + 2);
+
+            let event = 'message';
+            let data = '';
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            });
+            onEvent(event, data ? JSON.parse(data) : {});
+        }
+    }
+}
+
 // add bot message with typing effect
 async function addBotMessageWithTypingEffect(text) {
+    return typeText(createBotMessage(), text);
+}
+
+// empty bot message bubble, returns the span to type into
+function createBotMessage() {
     const chatBox = document.getElementById('chat-box');
     const messageDiv = document.createElement('div');
     messageDiv.className = 'mui-message bot';
@@ -109,8 +165,12 @@ async function addBotMessageWithTypingEffect(text) {
         messageDiv.style.opacity = '1';
     }, 10);
     
-    // typing effect
-    const textSpan = messageDiv.querySelector('.bot-text');
+    return messageDiv.querySelector('.bot-text');
+}
+
+// typing effect - appends text to a bot message span
+function typeText(textSpan, text) {
+    const chatBox = document.getElementById('chat-box');
     let index = 0;
     const speed = 15; // ms per character
     
@@ -0,0 +1,223 @@
+"""
+production server - preforked worker processes, each with a pool of request threads
+
+    python serve.py
+    python serve.py --bind 0.0.0.0:8000 --workers 4 --threads 16
+
+settings come from the "server" section of config.json. the app (data files, food
+index, myth matcher, templates) is loaded once before forking, so workers share it
+copy-on-write. SIGTERM or ctrl-c stops accepting connections, lets in-flight requests
+finish (up to graceful_timeout) and flushes chat history before the workers exit.
+"""
+
+import argparse
+import gc
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+
+class RequestHandler(WSGIRequestHandler):
+    # one request per connection, so idle keep-alive clients can't hold a pool thread
+    protocol_version = 'HTTP/1.0'
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """werkzeug server on an inherited listening socket, requests run on a fixed thread pool"""
+
+    multithread = True
+
+    def __init__(self, app, fd, host, port, threads):
+        super().__init__(host, port, app, RequestHandler, fd=fd)
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='request')
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        future = self.pool.submit(self._handle, request, client_address)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def drain(self, timeout):
+        """wait for in-flight requests, returns how many were still running at the timeout"""
+        with self._lock:
+            pending = list(self._pending)
+        _, not_done = wait(pending, timeout)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        return len(not_done)
+
+
+def parse_bind(bind):
+    host, _, port = bind.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class PreforkServer:
+    """binds the socket and preloads the app in the parent, then forks and supervises workers"""
+
+    def __init__(self, bind='127.0.0.1:5000', workers=2, threads=8, timeout=30,
+                 graceful_timeout=30, flush_timeout=5):
+        self.host, self.port = parse_bind(bind)
+        self.workers = workers
+        self.threads = threads
+        self.timeout = timeout
+        self.graceful_timeout = graceful_timeout
+        self.flush_timeout = flush_timeout
+        self.children = {}
+        self.stopping = False
+
+    def run(self):
+        # preload before forking - imports the app, parses the data files, builds the indexes
+        import wsgi
+        self.wsgi = wsgi
+
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(BaseWSGIServer.request_queue_size)
+        self.socket.set_inheritable(True)
+
+        # objects that exist now stay shared - the gc won't write to their pages
+        gc.collect()
+        gc.freeze()
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        print(f"serving on http://{self.host}:{self.port} with {self.workers} workers x {self.threads} threads")
+
+        for _ in range(self.workers):
+            self._spawn()
+        try:
+            while not self.stopping:
+                self._reap(respawn=True)
+                time.sleep(0.5)
+        finally:
+            self._shutdown()
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.monotonic()
+            return
+        code = 0
+        try:
+            self._worker()
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(code)
+
+    def _reap(self, respawn):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if not pid:
+                return
+            self.children.pop(pid, None)
+            if respawn and not self.stopping:
+                print(f"worker {pid} exited ({status}), starting a new one")
+                self._spawn()
+
+    def _shutdown(self):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout + self.flush_timeout + 1
+        while self.children and time.monotonic() < deadline:
+            self._reap(respawn=False)
+            time.sleep(0.1)
+        for pid in list(self.children):
+            print(f"worker {pid} did not stop in time, killing it")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self._reap(respawn=False)
+        self.socket.close()
+
+    def _worker(self):
+        # ctrl-c reaches the whole process group - only the parent decides when to stop
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        RequestHandler.timeout = self.timeout
+        self.wsgi.start_worker()
+
+        server = PooledWSGIServer(self.wsgi.application, self.socket.fileno(), self.host, self.port, self.threads)
+        self.socket.close()
+
+        def stop(signum, frame):
+            # shutdown() waits for serve_forever, which runs on this very thread
+            threading.Thread(target=server.shutdown, daemon=True).start()
+        signal.signal(signal.SIGTERM, stop)
+
+        server.serve_forever()
+        unfinished = server.drain(self.graceful_timeout)
+        if unfinished:
+            print(f"worker {os.getpid()}: {unfinished} requests still running at shutdown")
+        self.wsgi.stop_worker(self.flush_timeout)
+
+
+def main(argv=None):
+    with open('config.json', 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    settings = config.get('server', {})
+
+    parser = argparse.ArgumentParser(description='run the chatbot with preforked workers')
+    parser.add_argument('--bind', default=settings.get('bind', '127.0.0.1:5000'), help='host:port')
+    parser.add_argument('--workers', type=int, default=settings.get('workers', 2))
+    parser.add_argument('--threads', type=int, default=settings.get('threads', 8), help='per worker')
+    parser.add_argument('--timeout', type=float, default=settings.get('timeout', 30),
+                        help='seconds a client connection may sit idle')
+    parser.add_argument('--graceful-timeout', type=float, default=settings.get('graceful_timeout', 30),
+                        help='seconds in-flight requests get to finish on shutdown')
+    parser.add_argument('--flush-timeout', type=float, default=settings.get('flush_timeout', 5),
+                        help='seconds to flush chat history on shutdown')
+    args = parser.parse_args(argv)
+
+    if args.workers > 1 and config.get('sessions', {}).get('backend', 'memory') == 'memory':
+        # a user's name would only be known to the worker that heard it
+        print("warning: memory sessions are per worker, running 1 worker - "
+              "set sessions.backend to 'sqlite' to run more")
+        args.workers = 1
+    rate_limit = config.get('rate_limit', {})
+    if args.workers > 1 and rate_limit.get('enabled', True) and rate_limit.get('backend', 'memory') == 'memory':
+        print(f"warning: memory rate limits are per worker (so {args.workers}x the configured limits) - "
+              "set rate_limit.backend to 'sqlite' to share them")
+
+    PreforkServer(args.bind, args.workers, args.threads, args.timeout,
+                  args.graceful_timeout, args.flush_timeout).run()
+
+
+if __name__ == '__main__':
+    main()
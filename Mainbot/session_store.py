@@ -0,0 +1,180 @@
+"""
+session store - per-user chat state (name, message count, awaiting name)
+memory backend is a bounded lru with idle expiry, sqlite backend is shared
+by every worker process
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from sqlite_db import SQLiteDB
+
+
+class UserSession:
+    """compact per-user record"""
+
+    __slots__ = ('name', 'count', 'awaiting_name', 'last_seen')
+
+    def __init__(self, name='', count=0, awaiting_name=False, last_seen=0.0):
+        self.name = name
+        self.count = count
+        self.awaiting_name = awaiting_name
+        self.last_seen = last_seen
+
+    def __repr__(self):
+        return f"UserSession(name={self.name!r}, count={self.count}, awaiting_name={self.awaiting_name})"
+
+
+class MemorySessionStore:
+    """in-process lru capped at max_users, sessions idle for idle_ttl are dropped"""
+
+    backend = 'memory'
+
+    def __init__(self, max_users=10000, idle_ttl=24 * 3600):
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, user_id):
+        """session for user_id, or None if unknown or expired"""
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                return None
+            if now - session.last_seen > self.idle_ttl:
+                del self._sessions[user_id]
+                self.expirations += 1
+                return None
+            return UserSession(session.name, session.count, session.awaiting_name, session.last_seen)
+
+    def put(self, user_id, session):
+        now = time.time()
+        with self._lock:
+            self._sessions[user_id] = UserSession(session.name, session.count, session.awaiting_name, now)
+            self._sessions.move_to_end(user_id)
+            # oldest first, so expired sessions sit at the front
+            while self._sessions:
+                oldest_id, oldest = next(iter(self._sessions.items()))
+                if now - oldest.last_seen > self.idle_ttl:
+                    self.expirations += 1
+                elif len(self._sessions) > self.max_users:
+                    self.evictions += 1
+                else:
+                    break
+                del self._sessions[oldest_id]
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def memory_bytes(self):
+        """rough size of the sessions and their keys"""
+        with self._lock:
+            items = list(self._sessions.items())
+        total = sys.getsizeof(self._sessions)
+        for user_id, session in items:
+            total += sys.getsizeof(user_id) + sys.getsizeof(session) + sys.getsizeof(session.name)
+        return total
+
+    def stats(self):
+        return {
+            'backend': self.backend,
+            'size': len(self._sessions),
+            'max_users': self.max_users,
+            'idle_ttl': self.idle_ttl,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'memory_bytes': self.memory_bytes()
+        }
+
+
+class SQLiteSessionStore:
+    """sessions in a wal-mode sqlite file so every worker sees the same state"""
+
+    backend = 'sqlite'
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS sessions ('
+        ' user_id TEXT PRIMARY KEY, name TEXT NOT NULL DEFAULT \'\','
+        ' count INTEGER NOT NULL DEFAULT 0, awaiting_name INTEGER NOT NULL DEFAULT 0,'
+        ' last_seen REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen)'
+    )
+
+    def __init__(self, path, max_users=100000, idle_ttl=24 * 3600, prune_every=500):
+        self.db = SQLiteDB(path, self.SCHEMA)
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self.prune_every = prune_every
+        self._writes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, user_id):
+        row = self.db.execute(
+            'SELECT name, count, awaiting_name, last_seen FROM sessions WHERE user_id = ? AND last_seen > ?',
+            (user_id, time.time() - self.idle_ttl)
+        ).fetchone()
+        if row is None:
+            return None
+        return UserSession(row[0], row[1], bool(row[2]), row[3])
+
+    def put(self, user_id, session):
+        self.db.execute(
+            'INSERT INTO sessions (user_id, name, count, awaiting_name, last_seen) VALUES (?, ?, ?, ?, ?)'
+            ' ON CONFLICT(user_id) DO UPDATE SET name = excluded.name, count = excluded.count,'
+            ' awaiting_name = excluded.awaiting_name, last_seen = excluded.last_seen',
+            (user_id, session.name, session.count, int(session.awaiting_name), time.time())
+        )
+        self._writes += 1
+        # prune in the background of normal traffic instead of on every write
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def prune(self):
+        """drop idle sessions, then least recently seen ones above max_users"""
+        self.expirations += self.db.execute(
+            'DELETE FROM sessions WHERE last_seen <= ?', (time.time() - self.idle_ttl,)
+        ).rowcount
+        self.evictions += self.db.execute(
+            'DELETE FROM sessions WHERE user_id IN ('
+            ' SELECT user_id FROM sessions ORDER BY last_seen DESC LIMIT -1 OFFSET ?)',
+            (self.max_users,)
+        ).rowcount
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+    def stats(self):
+        try:
+            size = len(self)
+            page_count = self.db.execute('PRAGMA page_count').fetchone()[0]
+            page_size = self.db.execute('PRAGMA page_size').fetchone()[0]
+        except Exception:
+            size, page_count, page_size = None, 0, 0
+        return {
+            'backend': self.backend,
+            'size': size,
+            'max_users': self.max_users,
+            'idle_ttl': self.idle_ttl,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'disk_bytes': page_count * page_size
+        }
+
+
+def create_session_store(settings):
+    """session store for the "sessions" section of config.json"""
+    backend = settings.get('backend', 'memory')
+    max_users = settings.get('max_users', 10000)
+    idle_ttl = settings.get('idle_ttl', 24 * 3600)
+    if backend == 'memory':
+        return MemorySessionStore(max_users, idle_ttl)
+    if backend == 'sqlite':
+        return SQLiteSessionStore(settings.get('db_path', 'sessions.sqlite3'), max_users, idle_ttl)
+    raise ValueError(f"unknown session backend {backend!r} (use 'memory' or 'sqlite')")
@@ -0,0 +1,63 @@
+"""
+sqlite helper - one connection per thread and per process to a shared db file
+wal mode lets several worker processes read and write the same file
+read-only dbs (built offline, replaced by rename) are opened immutable and memory-mapped
+"""
+
+import os
+import sqlite3
+import threading
+from urllib.parse import quote
+
+
+class SQLiteDB:
+    """lazily opens a connection per thread, reopened after a fork"""
+
+    def __init__(self, path, schema=(), timeout=5.0, readonly=False, mmap_size=0):
+        self.path = path
+        self.schema = schema
+        self.timeout = timeout
+        self.readonly = readonly
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+
+    def _connect(self):
+        if self.readonly:
+            # immutable: no locks, no journal, the file must not change while open
+            uri = f"file:{quote(os.path.abspath(self.path))}?immutable=1"
+            conn = sqlite3.connect(uri, uri=True, timeout=self.timeout, isolation_level=None)
+        else:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        if self.mmap_size:
+            conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        return conn
+
+    def conn(self):
+        """connection for the calling thread"""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            conn = self._connect()
+            for statement in self.schema:
+                conn.execute(statement)
+            local.conn = conn
+            local.pid = os.getpid()
+        return local.conn
+
+    def execute(self, sql, params=()):
+        return self.conn().execute(sql, params)
+
+    def executemany(self, sql, rows):
+        conn = self.conn()
+        with conn:
+            conn.execute('BEGIN')
+            conn.executemany(sql, rows)
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local = threading.local()
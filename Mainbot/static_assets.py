@@ -0,0 +1,199 @@
+"""
+static assets - the web page, css and js held in memory, with gzip (and brotli, if the
+brotli package is installed) variants built once when the files are loaded
+every variant has a content-hash etag, so a revalidation is a dict lookup and a 304.
+the page links its css/js by hash (style.css?v=1a2b3c4d5e6f), those urls are cached by
+the browser for a year, and an edit changes the hash and so the url on the next load.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+
+from knowledge_store import file_stamp
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+CONTENT_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'text/javascript; charset=utf-8'
+}
+
+# best first
+ENCODINGS = ('br', 'gzip')
+
+
+def compress(encoding, body):
+    if encoding == 'br':
+        return brotli.compress(body, quality=11)
+    # mtime=0 so the same file always gives the same bytes
+    return gzip.compress(body, compresslevel=9, mtime=0)
+
+
+def parse_accept_encoding(header):
+    """{coding: q} from an Accept-Encoding header"""
+    accepted = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        match = re.search(r'q\s*=\s*([0-9.]+)', params)
+        if match:
+            try:
+                q = float(match.group(1))
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def etag_matches(header, etags):
+    """If-None-Match against the etags of the current content (weak comparison)"""
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    sent = {tag.strip().removeprefix('W/') for tag in header.split(',')}
+    return not sent.isdisjoint(etags)
+
+
+class Asset:
+    """one file, its hash and its encoded variants"""
+
+    __slots__ = ('name', 'content_type', 'version', 'variants', 'etags')
+
+    def __init__(self, name, body, content_type):
+        self.name = name
+        self.content_type = content_type
+        self.version = hashlib.sha256(body).hexdigest()[:12]
+        self.variants = {'identity': body}
+        for encoding in ENCODINGS:
+            if encoding == 'br' and brotli is None:
+                continue
+            encoded = compress(encoding, body)
+            # tiny files can come out bigger
+            if len(encoded) < len(body):
+                self.variants[encoding] = encoded
+        # a different etag per encoding - they are different bytes
+        self.etags = {encoding: f'"{self.version}-{encoding}"' if encoding != 'identity' else f'"{self.version}"'
+                      for encoding in self.variants}
+
+    def choose(self, accept_encoding):
+        """best variant the client takes"""
+        accepted = parse_accept_encoding(accept_encoding)
+        wildcard = accepted.get('*', 0.0)
+        for encoding in ENCODINGS:
+            if encoding in self.variants and accepted.get(encoding, wildcard) > 0:
+                return encoding
+        return 'identity'
+
+
+class StaticAssets:
+    """named files from one directory, reloaded when they change on disk"""
+
+    def __init__(self, directory, pages, assets, max_age=365 * 24 * 3600, check_interval=2.0):
+        self.directory = directory
+        # pages link to assets, so they are loaded after them with the links versioned
+        self.pages = tuple(pages)
+        self.assets = tuple(assets)
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self._files = {}
+        self._stamps = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reloads = 0
+        self.load()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def load(self):
+        """read every file and build its variants"""
+        stamps = {name: file_stamp(self._path(name)) for name in self.pages + self.assets}
+        files = {}
+        for name in self.assets:
+            with open(self._path(name), 'rb') as f:
+                files[name] = Asset(name, f.read(), self._content_type(name))
+
+        # href="style.css" -> href="style.css?v=<hash>"
+        links = re.compile(r'''(\b(?:href|src)=["'])(%s)(["'])''' % '|'.join(re.escape(n) for n in self.assets))
+        for name in self.pages:
+            with open(self._path(name), 'r', encoding='utf-8') as f:
+                html = f.read()
+            if self.assets:
+                html = links.sub(lambda m: f"{m.group(1)}{m.group(2)}?v={files[m.group(2)].version}{m.group(3)}", html)
+            files[name] = Asset(name, html.encode('utf-8'), self._content_type(name))
+
+        self._files = files
+        self._stamps = stamps
+        self.reloads += 1
+
+    def _content_type(self, name):
+        ext = os.path.splitext(name)[1]
+        return CONTENT_TYPES.get(ext) or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    def _refresh(self):
+        """reload if a file changed, looked at no more than once per check_interval"""
+        now = time.monotonic()
+        if self.check_interval <= 0 or now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            stamps = {name: file_stamp(self._path(name)) for name in self.pages + self.assets}
+            if stamps != self._stamps:
+                try:
+                    self.load()
+                    print("static assets reloaded")
+                except OSError as e:
+                    # mid-save or deleted, keep serving what we have
+                    print(f"warning: could not reload static assets - {e}")
+
+    def version(self, name):
+        self._refresh()
+        return self._files[name].version
+
+    def respond(self, name, version=None, accept_encoding=None, if_none_match=None):
+        """(status, headers, body) for a GET of the named file"""
+        self._refresh()
+        asset = self._files[name]
+        encoding = asset.choose(accept_encoding)
+
+        headers = [('Content-Type', asset.content_type), ('ETag', asset.etags[encoding]),
+                   ('Vary', 'Accept-Encoding')]
+        if name in self.assets and version == asset.version:
+            # this url names these exact bytes, they never change
+            headers.append(('Cache-Control', f'public, max-age={self.max_age}, immutable'))
+        else:
+            headers.append(('Cache-Control', 'no-cache'))
+
+        if etag_matches(if_none_match, asset.etags.values()):
+            return 304, headers, b''
+
+        body = asset.variants[encoding]
+        if encoding != 'identity':
+            headers.append(('Content-Encoding', encoding))
+        headers.append(('Content-Length', str(len(body))))
+        return 200, headers, body
+
+    def stats(self):
+        return {
+            'brotli': brotli is not None,
+            'reloads': self.reloads,
+            'files': {name: {'version': asset.version,
+                             'bytes': {encoding: len(body) for encoding, body in asset.variants.items()}}
+                      for name, asset in self._files.items()}
+        }
@@ -0,0 +1,112 @@
+"""
+swap index - healthy swaps keyed by health condition and by the food/ingredient words
+they are about ("white rice", "coconut milk curry", plus any "keywords" in healthy_swaps.txt)
+local foods are matched once per data version, so a nutrition answer for one of them is a
+dict lookup; any other food (usda) costs a handful of lookups over the words of its name.
+"""
+
+from intent_router import Message
+from nutrient_table import CONDITION_PROFILES
+
+
+# "bubble tea with pearls" is about bubble tea
+QUALIFIERS = {'with', 'without', 'and', 'or'}
+
+# longest keyword phrase, in words
+MAX_PHRASE = 3
+
+# a swap for a condition the food is over its dish limit for ranks higher
+CONDITION_BONUS = 0.5
+
+
+def phrases(text, n=MAX_PHRASE):
+    """every run of 1..n words of text"""
+    tokens = Message(text).tokens
+    for size in range(1, n + 1):
+        for i in range(len(tokens) - size + 1):
+            yield ' '.join(tokens[i:i + size])
+
+
+def subject_terms(unhealthy):
+    """the food a swap replaces and its head word - "fried chicken" -> "fried chicken", "chicken"
+    (so chicken dishes find it, but "fried carrot cake" needs a keyword)"""
+    words = []
+    for token in Message(unhealthy).tokens:
+        if token in QUALIFIERS:
+            break
+        words.append(token)
+    if not words:
+        return ()
+    return (' '.join(words[-MAX_PHRASE:]), words[-1])
+
+
+def food_names(food):
+    return (food.get('name', ''),) + tuple(food.get('aliases', ()))
+
+
+class SwapIndex:
+    """swaps by condition, by term, and the best ones for every local food"""
+
+    def __init__(self, swaps, foods=(), dish_limits=None, limit=2):
+        self.swaps = tuple(swaps)
+        self.dish_limits = dict(dish_limits or {})
+        self.limit = limit
+
+        by_condition = {}
+        postings = {}
+        for i, swap in enumerate(self.swaps):
+            by_condition.setdefault(swap.get('category', 'general'), []).append(swap)
+            terms = set(subject_terms(swap.get('unhealthy', '')))
+            terms.update(' '.join(Message(k).tokens) for k in swap.get('keywords', ()))
+            terms.discard('')
+            for term in terms:
+                postings.setdefault(term, []).append(i)
+        self.by_condition = {condition: tuple(s) for condition, s in by_condition.items()}
+        # a word several swaps share ("fried", "curry") counts for less than one only one has ("laksa"),
+        # a phrase for more than a word
+        self.by_term = {term: tuple((i, len(term.split()) / len(ids)) for i in ids)
+                        for term, ids in postings.items()}
+
+        self.by_food = {food['name'].lower(): self.match(food_names(food), food) for food in foods}
+
+    def __len__(self):
+        return len(self.swaps)
+
+    def match(self, texts, food=None, limit=None):
+        """best swaps for the words in texts, ranked by term weight (and by the food's
+        nutrients against the dish limits, if given)"""
+        matched = set()
+        for text in texts:
+            if text:
+                matched.update(phrases(text))
+        scores = {}
+        for phrase in matched:
+            for i, weight in self.by_term.get(phrase, ()):
+                scores[i] = scores.get(i, 0.0) + weight
+        if food is not None:
+            for i in scores:
+                profile = CONDITION_PROFILES.get(self.swaps[i].get('category'))
+                column = profile[0] if profile else None
+                value = food.get(column) if column else None
+                if isinstance(value, (int, float)) and value > self.dish_limits.get(column, float('inf')):
+                    scores[i] += CONDITION_BONUS
+        best = sorted(scores, key=lambda i: (-scores[i], i))[:limit or self.limit]
+        return tuple(self.swaps[i] for i in best)
+
+    def for_food(self, food, query=None):
+        """swaps to show with a nutrition answer - precomputed for local foods"""
+        swaps = self.by_food.get(food.get('name', '').lower()) if food.get('source') != 'USDA' else None
+        if swaps is not None:
+            return swaps
+        return self.match(food_names(food) + (query,), food)
+
+    def for_condition(self, condition, limit=None):
+        swaps = self.by_condition.get(condition, ())
+        return swaps[:limit] if limit else swaps
+
+    def stats(self):
+        return {
+            'swaps': len(self.swaps),
+            'terms': len(self.by_term),
+            'foods_with_swaps': sum(1 for swaps in self.by_food.values() if swaps)
+        }
@@ -0,0 +1,26 @@
+"""
+offline fdc index search - run with `python -m pytest` from this folder
+"""
+
+import os
+
+from fdc_index import FDCIndex, build_index, match_expression
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fdc_sample.json')
+
+
+def test_question_words_are_not_food_words():
+    assert match_expression("is banana healthy") == '"banana"'
+    assert match_expression("can diabetics eat banana?") == '"banana"'
+    assert match_expression("is it healthy") is None
+
+
+def test_common_phrasings_hit_the_index(tmp_path):
+    path = str(tmp_path / 'fdc_index.sqlite3')
+    build_index(SAMPLE, path)
+    index = FDCIndex(path)
+    for question in ("is banana healthy", "are bananas good for me", "calories in banana"):
+        food = index.search(question)
+        assert food is not None and 'banana' in food['name'].lower(), question
+    # a partial match is left to the api
+    assert index.search("egg tart") is None
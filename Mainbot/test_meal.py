@@ -0,0 +1,32 @@
+"""
+meal splitting - run with `python -m pytest` from this folder
+"""
+
+from meal import split_dishes
+
+
+def queries(text, resolve=None):
+    return [(item.query, item.quantity) for item in split_dishes(text, resolve=resolve)]
+
+
+def test_every_joined_dish_is_kept():
+    expected = [('chicken rice', 1), ('teh tarik', 1), ('kaya toast', 1)]
+    assert queries("nutrition for chicken rice and teh tarik and kaya toast") == expected
+    assert queries("chicken rice, teh tarik and kaya toast") == expected
+
+
+def test_unknown_dish_is_not_merged_into_a_neighbour():
+    known = {'chicken rice': {'name': 'Chicken Rice'}, 'laksa': {'name': 'Laksa'}}
+    assert queries("chicken rice, pad thai and laksa", known.get) == [
+        ('chicken rice', 1), ('pad thai', 1), ('laksa', 1)]
+
+
+def test_dish_names_with_a_joining_word_stay_whole():
+    assert queries("mac and cheese") == [('mac and cheese', 1)]
+    assert queries("2 sweet and sour pork with rice") == [('sweet and sour pork', 2), ('rice', 1)]
+    assert queries("mac & cheese with fries") == [('mac and cheese', 1), ('fries', 1)]
+
+
+def test_exact_food_name_stays_whole():
+    foods = {'rojak and tau huay': {'name': 'Rojak and Tau Huay'}}
+    assert queries("rojak and tau huay", foods.get) == [('rojak and tau huay', 1)]
@@ -0,0 +1,193 @@
+"""
+usda cache - two tier cache in front of the usda api
+tier 1 is an in-process lru with ttl, tier 2 is a sqlite file shared by all workers
+"not found" answers are cached too, for a shorter time
+"""
+
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from sqlite_db import SQLiteDB
+
+
+NORMALIZE_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize_query(query):
+    """cache key for a query - lowercase words, punctuation and spacing ignored"""
+    return ' '.join(NORMALIZE_RE.findall(query.lower()))
+
+
+class MemoryCache:
+    """bounded lru, entries expire after their own ttl"""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """(found, value) - value can be None for a cached "not found" """
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._data)
+        return {
+            'size': size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
+
+
+class SQLiteCache:
+    """persistent tier, survives restarts and is shared between processes"""
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS usda_cache ('
+        ' key TEXT PRIMARY KEY, value TEXT, expires_at REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS usda_cache_expires ON usda_cache (expires_at)'
+    )
+
+    def __init__(self, path, max_rows=100000):
+        self.db = SQLiteDB(path, self.SCHEMA)
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+        self._writes = 0
+
+    def get(self, key):
+        """(found, value, expires_at)"""
+        try:
+            row = self.db.execute(
+                'SELECT value, expires_at FROM usda_cache WHERE key = ? AND expires_at > ?',
+                (key, time.time())
+            ).fetchone()
+        except Exception as e:
+            self.errors += 1
+            print(f"warning: usda cache read failed - {e}")
+            return False, None, 0
+        if row is None:
+            self.misses += 1
+            return False, None, 0
+        self.hits += 1
+        return True, json.loads(row[0]), row[1]
+
+    def set(self, key, value, expires_at):
+        try:
+            self.db.execute(
+                'INSERT OR REPLACE INTO usda_cache (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value, ensure_ascii=False), expires_at)
+            )
+            self._writes += 1
+            # trim now and then instead of on every write
+            if self._writes % 500 == 0:
+                self.prune()
+        except Exception as e:
+            self.errors += 1
+            print(f"warning: usda cache write failed - {e}")
+
+    def prune(self):
+        """drop expired rows, then the soonest-to-expire rows above max_rows"""
+        removed = self.db.execute('DELETE FROM usda_cache WHERE expires_at <= ?', (time.time(),)).rowcount
+        removed += self.db.execute(
+            'DELETE FROM usda_cache WHERE key IN ('
+            ' SELECT key FROM usda_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_rows,)
+        ).rowcount
+        self.evictions += max(removed, 0)
+
+    def size(self):
+        try:
+            return self.db.execute('SELECT COUNT(*) FROM usda_cache').fetchone()[0]
+        except Exception:
+            return None
+
+    def stats(self):
+        return {
+            'size': self.size(),
+            'max_rows': self.max_rows,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'errors': self.errors
+        }
+
+
+class USDACache:
+    """memory first, then disk, keyed on the normalized query"""
+
+    def __init__(self, memory_size=1024, ttl=7 * 24 * 3600, negative_ttl=3600,
+                 db_path=None, max_rows=100000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = MemoryCache(memory_size)
+        self.disk = SQLiteCache(db_path, max_rows) if db_path else None
+
+    def get(self, query):
+        """(found, food) - found with food None means usda had nothing last time"""
+        key = normalize_query(query)
+        found, value = self.memory.get(key)
+        if found or self.disk is None:
+            return found, value
+
+        found, value, expires_at = self.disk.get(key)
+        if found:
+            # promote so the next lookup stays in process
+            self.memory.set(key, value, expires_at)
+        return found, value
+
+    def set(self, query, food):
+        """cache an answer, None (not found) is kept for negative_ttl only"""
+        key = normalize_query(query)
+        ttl = self.ttl if food is not None else self.negative_ttl
+        if ttl <= 0:
+            return
+        expires_at = time.time() + ttl
+        self.memory.set(key, food, expires_at)
+        if self.disk is not None:
+            self.disk.set(key, food, expires_at)
+
+    def stats(self):
+        return {
+            'memory': self.memory.stats(),
+            'disk': self.disk.stats() if self.disk is not None else None
+        }
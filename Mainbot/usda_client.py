@@ -0,0 +1,421 @@
+"""
+usda client - pooled, deadline bounded access to fooddata central
+identical queries in flight at the same time share one upstream call,
+and a circuit breaker stops calling usda for a while after repeated failures.
+an optional gate caps calls in flight, a call past it fails fast with OverloadedError
+AsyncUSDAClient does the same on asyncio, so one thread can wait on many lookups
+"""
+
+import asyncio
+import json
+import os
+import ssl
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from usda_cache import normalize_query
+
+
+class CircuitOpenError(Exception):
+    """usda is failing, the call was skipped without touching the network"""
+
+
+class OverloadedError(Exception):
+    """too many usda calls in flight already, the call was skipped instead of queued"""
+
+
+def nutrient_field(name):
+    """our field for a usda nutrient name ("Total lipid (fat)" -> "fat"), or None"""
+    name = name.lower()
+    if 'energy' in name or 'calorie' in name:
+        return 'calories'
+    if 'protein' in name:
+        return 'protein'
+    if 'carbohydrate' in name:
+        return 'carbs'
+    if 'total lipid' in name or ('fat' in name and 'fatty' not in name):
+        return 'fat'
+    if 'sodium' in name:
+        return 'sodium'
+    if 'fiber' in name:
+        return 'fiber'
+    if 'sugar' in name and 'added' not in name:
+        return 'sugar'
+    return None
+
+
+def parse_food(food):
+    """map a usda search hit to our nutrient fields"""
+    nutrients = {}
+    for n in food.get('foodNutrients', []):
+        field = nutrient_field(n.get('nutrientName', ''))
+        if field:
+            nutrients[field] = n.get('value', 0)
+
+    return {
+        'name': food.get('description'),
+        **nutrients,
+        'source': 'USDA'
+    }
+
+
+TRIAL = 'trial'
+
+
+class CircuitBreaker:
+    """closed -> open after N failures in a row -> half open after a cool down"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.short_circuited = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """truthy if a call may go out now - TRIAL for the one call let through while half open,
+        which must then end in record_success or record_failure whatever happens to it"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._trial_running:
+                # let exactly one trial call through
+                self._trial_running = True
+                return TRIAL
+            self.short_circuited += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'short_circuited': self.short_circuited
+        }
+
+
+class _Call:
+    """one upstream call that several threads may be waiting on"""
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class USDAClient:
+    """fooddata central search with pooling, single-flight, deadline and breaker"""
+
+    def __init__(self, url, api_key, timeout=2.5, connect_timeout=1.0, pool_size=10,
+                 failure_threshold=5, reset_timeout=30.0, gate=None):
+        self.url = url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.connect_timeout = min(connect_timeout, timeout)
+        self.pool_size = pool_size
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        # anything with acquire() -> lease or None and release(lease), see rate_limit.py
+        self.gate = gate
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._session = None
+        self._session_pid = None
+        self.calls = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.shed = 0
+
+    def acquire(self):
+        """gate lease for one call, raises OverloadedError if there is none to be had"""
+        if self.gate is None:
+            return None
+        lease = self.gate.acquire()
+        if lease is None:
+            self.shed += 1
+            raise OverloadedError('too many usda calls in flight')
+        return lease
+
+    def release(self, lease):
+        if self.gate is not None:
+            self.gate.release(lease)
+
+    def session(self):
+        """keep-alive session, recreated in each forked worker"""
+        if self._session is None or self._session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+            self._session_pid = os.getpid()
+        return self._session
+
+    def _fetch(self, query):
+        """one upstream request, None if usda has no match"""
+        params = {
+            "api_key": self.api_key,
+            "query": query,
+            "pageSize": 1
+        }
+        deadline = time.monotonic() + self.timeout
+        with self.session().get(self.url, params=params, stream=True,
+                                timeout=(self.connect_timeout, self.timeout)) as response:
+            response.raise_for_status()
+            # the socket timeout is per read, so check the overall budget while streaming
+            body = bytearray()
+            for chunk in response.iter_content(16384):
+                body += chunk
+                if time.monotonic() > deadline:
+                    raise requests.Timeout(f"usda response took longer than {self.timeout}s")
+
+        data = json.loads(body)
+        if data.get('foods'):
+            return parse_food(data['foods'][0])
+        return None
+
+    def search(self, query):
+        """search usda, raises CircuitOpenError, OverloadedError or requests errors on failure"""
+        key = normalize_query(query)
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            # same query already on the wire, wait for it instead of sending another
+            if not call.done.wait(self.timeout + self.connect_timeout):
+                raise requests.Timeout(f"usda lookup for '{key}' exceeded its deadline")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            # gate first - a half open breaker's trial call must not be refused after it
+            lease = self.acquire()
+            try:
+                allowed = self.breaker.allow()
+                if not allowed:
+                    raise CircuitOpenError('usda circuit is open')
+                self.calls += 1
+                try:
+                    call.result = self._fetch(query)
+                except requests.Timeout:
+                    self.timeouts += 1
+                    self.failures += 1
+                    self.breaker.record_failure()
+                    raise
+                except Exception:
+                    self.failures += 1
+                    self.breaker.record_failure()
+                    raise
+                except BaseException:
+                    # interrupted - an unfinished trial counts as failed, or the breaker never closes again
+                    if allowed == TRIAL:
+                        self.breaker.record_failure()
+                    raise
+            finally:
+                self.release(lease)
+            self.breaker.record_success()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.done.set()
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'shed': self.shed,
+            'in_flight': len(self._inflight),
+            'breaker': self.breaker.stats()
+        }
+
+
+async def http_get_json(url, params, connect_timeout):
+    """minimal asyncio http/1.1 GET that returns the decoded json body"""
+    parts = urlsplit(url)
+    secure = parts.scheme == 'https'
+    port = parts.port or (443 if secure else 80)
+    path = (parts.path or '/') + '?' + urlencode(params)
+
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(parts.hostname, port, ssl=ssl.create_default_context() if secure else None),
+            connect_timeout
+        )
+    except asyncio.TimeoutError:
+        raise requests.ConnectTimeout(f"could not connect to usda within {connect_timeout}s")
+    try:
+        writer.write(
+            f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nAccept: application/json\r\n"
+            f"Accept-Encoding: identity\r\nConnection: close\r\n\r\n".encode('latin-1')
+        )
+        await writer.drain()
+
+        status_line = await reader.readline()
+        try:
+            status = int(status_line.split()[1])
+        except (IndexError, ValueError):
+            raise requests.ConnectionError(f"bad response from usda: {status_line[:80]!r}")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+    except asyncio.IncompleteReadError as e:
+        raise requests.ConnectionError(f"usda closed the connection early: {e}")
+    finally:
+        writer.close()
+
+    if status >= 400:
+        raise requests.HTTPError(f"{status} error from usda")
+    return json.loads(body)
+
+
+class AsyncUSDAClient:
+    """asyncio search on top of a USDAClient - same url, deadline, breaker and counters,
+    but a lookup waiting on usda holds no thread, only a coroutine"""
+
+    def __init__(self, client, max_in_flight=200):
+        self.client = client
+        self.max_in_flight = max_in_flight
+        self._inflight = {}
+        self._limit = None
+
+    async def _gate(self, method, *args):
+        """acquire or release on the client's gate - a memory gate answers at once, a sqlite
+        one can wait on the file lock, so it runs off the event loop"""
+        if getattr(self.client.gate, 'backend', 'memory') == 'memory':
+            return method(*args)
+        return await asyncio.to_thread(method, *args)
+
+    async def _fetch(self, query):
+        client = self.client
+        params = {
+            "api_key": client.api_key,
+            "query": query,
+            "pageSize": 1
+        }
+        data = await http_get_json(client.url, params, client.connect_timeout)
+        if data.get('foods'):
+            return parse_food(data['foods'][0])
+        return None
+
+    async def _limited_fetch(self, query):
+        async with self._limit:
+            return await self._fetch(query)
+
+    async def search(self, query):
+        """search usda, raises CircuitOpenError, OverloadedError or requests errors on failure"""
+        client = self.client
+        key = normalize_query(query)
+        call = self._inflight.get(key)
+        if call is not None:
+            # same query already on the wire, wait for it instead of sending another
+            client.coalesced += 1
+            return await asyncio.shield(call)
+
+        call = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            if self._limit is None:
+                self._limit = asyncio.Semaphore(self.max_in_flight)
+            # gate first - a half open breaker's trial call must not be refused after it
+            lease = await self._gate(client.acquire)
+            try:
+                allowed = client.breaker.allow()
+                if not allowed:
+                    raise CircuitOpenError('usda circuit is open')
+                client.calls += 1
+                try:
+                    # waiting for a slot counts against the deadline too
+                    result = await asyncio.wait_for(self._limited_fetch(query), client.timeout)
+                except asyncio.TimeoutError:
+                    client.timeouts += 1
+                    client.failures += 1
+                    client.breaker.record_failure()
+                    raise requests.ReadTimeout(f"usda lookup took longer than {client.timeout}s")
+                except requests.ConnectTimeout:
+                    client.timeouts += 1
+                    client.failures += 1
+                    client.breaker.record_failure()
+                    raise
+                except Exception:
+                    client.failures += 1
+                    client.breaker.record_failure()
+                    raise
+                except BaseException:
+                    # cancelled - an unfinished trial counts as failed, or the breaker never closes again
+                    if allowed == TRIAL:
+                        client.breaker.record_failure()
+                    raise
+            finally:
+                # a lease lost to a cancel here expires on its own (lease_ttl)
+                await self._gate(client.release, lease)
+            client.breaker.record_success()
+            call.set_result(result)
+            return result
+        except BaseException as e:
+            # waiters get the same error (or are cancelled with us)
+            if isinstance(e, Exception):
+                call.set_exception(e)
+                call.exception()
+            else:
+                call.cancel()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self):
+        return {
+            'in_flight': len(self._inflight),
+            'max_in_flight': self.max_in_flight
+        }
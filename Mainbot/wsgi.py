@@ -0,0 +1,10 @@
+"""
+wsgi entry point for production servers
+
+    python serve.py                                  # built in, no extra packages
+    gunicorn -c gunicorn.conf.py wsgi:application    # if gunicorn is installed
+"""
+
+from app import app as application, start_worker, stop_worker
+
+__all__ = ['application', 'start_worker', 'stop_worker']